@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.core import checks
+
+
+class ChatsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "chats"
+
+    def ready(self):
+        from .roles import check_role_cache, connect_signals
+
+        # Connect the role cache invalidation in every process (shell,
+        # management commands), not only where the middleware is loaded.
+        connect_signals()
+        checks.register(check_role_cache, checks.Tags.caches)
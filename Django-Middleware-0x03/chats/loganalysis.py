@@ -0,0 +1,320 @@
+import glob
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+from datetime import datetime
+
+CHUNK_SIZE = 1 << 20
+
+# Lines written by RequestLoggingMiddleware before the JSON format, and
+# the notices BackgroundLogWriter adds when its queue overflows.
+LEGACY_LINE = re.compile(
+    rb"^(?P<ts>\d{4}-\d\d-\d\d[ T][\d:.]+) - User: (?P<user>.*) - Path: (?P<path>.*?)\r?$"
+)
+DROPPED_LINE = re.compile(rb"^(\d+) log lines dropped")
+NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+# json.loads() would sniff the encoding of every line; the log is UTF-8.
+_decode_json = json.JSONDecoder().decode
+
+
+def log_files(path):
+    """
+    `path` and its rotated copies (numbered or dated, optionally gzipped),
+    oldest first, so timestamps come out roughly in order.
+    """
+    dated, numbered = [], []
+    for name in glob.glob(glob.escape(path) + ".*"):
+        suffix = name[len(path) + 1:]
+        if suffix.endswith(".gz"):
+            suffix = suffix[:-3]
+        if suffix.isdigit():
+            numbered.append((-int(suffix), name))
+        elif re.fullmatch(r"\d{4}-\d\d-\d\d", suffix):
+            dated.append((suffix, name))
+    files = [name for _, name in sorted(dated)] + [name for _, name in sorted(numbered)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def iter_lines(path, chunk_size=CHUNK_SIZE):
+    """
+    Lines of a (possibly gzipped) file as bytes, read in fixed-size
+    chunks: memory use is bounded by `chunk_size` plus the longest line,
+    whatever the size of the file.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        rest = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+
+def parse_line(raw):
+    """
+    A log record as a dict, {"dropped": n} for a writer overflow notice,
+    or None for a line that is neither.
+    """
+    if raw.startswith(b"{"):
+        try:
+            record = _decode_json(raw.decode("utf-8"))
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+    match = LEGACY_LINE.match(raw)
+    if match is not None:
+        try:
+            ts = datetime.fromisoformat(match["ts"].decode()).timestamp()
+        except ValueError:
+            return None
+        return {
+            "ts": ts,
+            "user": match["user"].decode("utf-8", "replace"),
+            "path": match["path"].decode("utf-8", "replace"),
+        }
+    match = DROPPED_LINE.match(raw)
+    if match is not None:
+        return {"dropped": int(match[1])}
+    return None
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram: bucket i holds values up to
+    MIN_MS * GROWTH**i, so percentiles are within 5% of the exact value
+    and a few hundred buckets cover microseconds to minutes.
+    """
+
+    MIN_MS = 0.01
+    GROWTH = 1.05
+
+    __slots__ = ("buckets", "count", "max")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, ms):
+        if ms <= self.MIN_MS:
+            index = 0
+        else:
+            index = math.ceil(math.log(ms / self.MIN_MS, self.GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile, or None."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.MIN_MS * self.GROWTH ** index, self.max)
+        return self.max
+
+
+class SpaceSaving:
+    """
+    Approximate heavy hitters (Metwally et al.'s Space-Saving) in
+    `capacity` counters. A key that is not tracked replaces the smallest
+    counter and inherits its count, so counts are overestimated by at
+    most `error`; every key seen more than total/capacity times is kept.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # One (count, key) entry per tracked key. Increments don't touch
+        # the heap, so an entry may be below the real count; stale entries
+        # are pushed back with the real count when they surface.
+        self._heap = []
+
+    def offer(self, key):
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+            return
+        if len(counts) < self.capacity:
+            counts[key] = 1
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (1, key))
+            return
+        while True:
+            count, victim = heapq.heappop(self._heap)
+            if counts[victim] == count:
+                break
+            heapq.heappush(self._heap, (counts[victim], victim))
+        del counts[victim], self.errors[victim]
+        counts[key] = count + 1
+        self.errors[key] = count
+        heapq.heappush(self._heap, (count + 1, key))
+
+    def top(self, n):
+        """The n largest (key, count, error) triples."""
+        ranked = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+
+class GroupStats:
+    """Totals for one route (or normalized path)."""
+
+    __slots__ = ("count", "client_errors", "server_errors", "bytes", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.client_errors = 0
+        self.server_errors = 0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+
+class LogAnalyzer:
+    """
+    Streaming summary of request log records.
+
+    Memory is bounded whatever the amount of input: requests are grouped
+    by route (or by path with numeric segments replaced by <id> for
+    records without one) into at most `max_groups` groups, the rest going
+    to "<other>", and users and IPs are counted with SpaceSaving.
+    Legacy text records have no method, status or latency; they count
+    towards rates and talkers only.
+    """
+
+    OTHER = "<other>"
+
+    def __init__(self, capacity=1000, max_groups=500):
+        self.max_groups = max_groups
+        self.groups = {}
+        self.users = SpaceSaving(capacity)
+        self.ips = SpaceSaving(capacity)
+        self.total = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.first_ts = None
+        self.last_ts = None
+        # Busiest minute, assuming records come roughly in time order.
+        self._minute = None
+        self._minute_count = 0
+        self.peak_minute = (None, 0)
+
+    def feed_file(self, path, chunk_size=CHUNK_SIZE):
+        for raw in iter_lines(path, chunk_size):
+            if not raw.strip():
+                continue
+            record = parse_line(raw)
+            if record is None:
+                self.malformed += 1
+            elif "dropped" in record:
+                self.dropped += record["dropped"]
+            else:
+                self.add(record)
+
+    def add(self, record):
+        ts = record.get("ts")
+        if not isinstance(ts, (int, float)):
+            self.malformed += 1
+            return
+        self.total += 1
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+
+        minute = int(ts // 60)
+        if minute != self._minute:
+            self._minute, self._minute_count = minute, 0
+        self._minute_count += 1
+        if self._minute_count > self.peak_minute[1]:
+            self.peak_minute = (minute * 60, self._minute_count)
+
+        group = self._group(record)
+        group.count += 1
+        status = record.get("status")
+        if isinstance(status, int):
+            if status >= 500:
+                group.server_errors += 1
+            elif status >= 400:
+                group.client_errors += 1
+        ms = record.get("ms")
+        if isinstance(ms, (int, float)):
+            group.latency.observe(ms)
+        size = record.get("bytes")
+        if isinstance(size, int):
+            group.bytes += size
+
+        self.users.offer(str(record.get("user", "AnonymousUser")))
+        ip = record.get("ip")
+        if ip:
+            self.ips.offer(str(ip))
+
+    def _group(self, record):
+        route = record.get("route")
+        if not route or route == "<unmatched>":
+            route = NUMERIC_SEGMENT.sub("/<id>", str(record.get("path", "")))
+        method = record.get("method")
+        key = f"{method} {route}" if method else route
+        group = self.groups.get(key)
+        if group is None:
+            if len(self.groups) >= self.max_groups:
+                key = self.OTHER
+                group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = GroupStats()
+        return group
+
+    def summary(self, top=10):
+        span = (self.last_ts - self.first_ts) if self.total else 0
+        groups = []
+        for key, group in sorted(self.groups.items(), key=lambda item: -item[1].count):
+            latency = group.latency
+            groups.append({
+                "group": key,
+                "requests": group.count,
+                "per_second": round(group.count / span, 3) if span else None,
+                "client_errors": group.client_errors,
+                "server_errors": group.server_errors,
+                "bytes": group.bytes,
+                "p50_ms": _round(latency.percentile(50)),
+                "p95_ms": _round(latency.percentile(95)),
+                "p99_ms": _round(latency.percentile(99)),
+                "max_ms": _round(latency.max) if latency.count else None,
+            })
+        return {
+            "requests": self.total,
+            "malformed_lines": self.malformed,
+            "dropped_lines": self.dropped,
+            "first": self.first_ts,
+            "last": self.last_ts,
+            "per_second": round(self.total / span, 3) if span else None,
+            "peak_minute": {"start": self.peak_minute[0], "requests": self.peak_minute[1]},
+            "groups": groups,
+            "top_users": [
+                {"user": key, "requests": count, "error": error}
+                for key, count, error in self.users.top(top)
+            ],
+            "top_ips": [
+                {"ip": key, "requests": count, "error": error}
+                for key, count, error in self.ips.top(top)
+            ],
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
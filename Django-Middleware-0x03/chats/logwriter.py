@@ -0,0 +1,154 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import date
+
+
+class BackgroundLogWriter:
+    """
+    Append lines to a log file from a background thread.
+
+    Callers only pay for a non-blocking put() on an in-process queue.
+    A daemon thread drains the queue, batches lines together and writes
+    them in one call when either `batch_size` lines are waiting or
+    `flush_interval` seconds have passed.
+
+    - Rotation: by size (`max_bytes`, keeping `backup_count` numbered files)
+      and/or daily (`rotate_daily`, renaming to `<file>.YYYY-MM-DD`).
+    - When the queue is full, lines are dropped and counted; the number of
+      dropped lines is written to the log with the next batch.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_queue_size=10000,
+        batch_size=500,
+        flush_interval=1.0,
+        max_bytes=0,
+        backup_count=5,
+        rotate_daily=False,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_daily = rotate_daily
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.total_dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._current_date = date.today()
+
+        self._thread = threading.Thread(
+            target=self._run, name="request-log-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, line):
+        """Enqueue a line. Never blocks; returns False if the line was dropped."""
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                self.total_dropped += 1
+            return False
+
+    def close(self, timeout=5.0):
+        """Stop the writer thread after flushing everything queued so far."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopped.is_set() and self.queue.empty():
+                return
+
+    def _collect_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if self._stopped.is_set():
+                    # Shutting down: drain without waiting for the interval.
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            batch.append(f"{dropped} log lines dropped (queue full)\n")
+
+        try:
+            self._maybe_rotate()
+        except OSError:
+            # Several workers rotate the same file: another one may have
+            # moved it first. Keep appending to whatever file is there.
+            pass
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(batch))
+        except OSError:
+            # Logging must never take the writer thread down.
+            with self._dropped_lock:
+                self.dropped += len(batch)
+                self.total_dropped += len(batch)
+
+    def _maybe_rotate(self):
+        today = date.today()
+        if self.rotate_daily and today != self._current_date:
+            # Moved on first, so a failed rename is not retried every batch.
+            rotated, self._current_date = self._current_date, today
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.{rotated.isoformat()}")
+            return
+
+        if self.max_bytes and os.path.exists(self.path):
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate_numbered()
+
+    def _rotate_numbered(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path, **options):
+    """Return the shared writer for `path`, creating it on first use."""
+    path = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = BackgroundLogWriter(path, **options)
+            _writers[path] = writer
+        return writer
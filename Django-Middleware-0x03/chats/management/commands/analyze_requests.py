@@ -0,0 +1,98 @@
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.loganalysis import CHUNK_SIZE, LogAnalyzer, log_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the request log written by RequestLoggingMiddleware: "
+        "request rates, error counts and latency percentiles per route, and "
+        "the top users and IPs. Files are streamed in chunks (gzipped rotated "
+        "files included), so memory stays flat for logs of any size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "files", nargs="*",
+            help="Log files to read (default: REQUEST_LOG_FILE and its rotated copies, oldest first).",
+        )
+        parser.add_argument("--top", type=int, default=10, help="Number of top users and IPs to show.")
+        parser.add_argument(
+            "--capacity", type=int, default=1000,
+            help="Counters kept for top users/IPs; counts are exact below this many distinct keys.",
+        )
+        parser.add_argument("--max-groups", type=int, default=500, help="Routes tracked before folding into <other>.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Read size in bytes.")
+        parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+
+    def handle(self, *args, **options):
+        files = options["files"]
+        if not files:
+            files = log_files(os.path.abspath(getattr(settings, "REQUEST_LOG_FILE", "requests.log")))
+        missing = [path for path in files if not os.path.exists(path)]
+        if missing or not files:
+            raise CommandError(f"No such log file: {', '.join(missing) or 'requests.log'}")
+
+        analyzer = LogAnalyzer(capacity=options["capacity"], max_groups=options["max_groups"])
+        for path in files:
+            analyzer.feed_file(path, options["chunk_size"])
+        summary = analyzer.summary(options["top"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+        else:
+            self.report(files, summary)
+
+    def report(self, files, summary):
+        write = self.stdout.write
+        write(f"Files: {', '.join(files)}")
+        if not summary["requests"]:
+            write("No requests found.")
+            return
+        write(
+            f"{summary['requests']} requests from {_time(summary['first'])} to {_time(summary['last'])}"
+            f" ({_number(summary['per_second'])} req/s, peak {summary['peak_minute']['requests']}"
+            f" req/min at {_time(summary['peak_minute']['start'])})"
+        )
+        if summary["malformed_lines"] or summary["dropped_lines"]:
+            write(self.style.WARNING(
+                f"{summary['malformed_lines']} unparsable lines, "
+                f"{summary['dropped_lines']} lines dropped by the writer"
+            ))
+
+        write("")
+        write(
+            f"{'route':<40}{'requests':>10}{'req/s':>9}{'4xx':>7}{'5xx':>7}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        for g in summary["groups"]:
+            write(
+                f"{g['group'][:39]:<40}{g['requests']:>10}{_number(g['per_second']):>9}"
+                f"{g['client_errors']:>7}{g['server_errors']:>7}{_number(g['p50_ms']):>9}"
+                f"{_number(g['p95_ms']):>9}{_number(g['p99_ms']):>9}{_number(g['max_ms']):>9}"
+            )
+
+        for title, key, rows in (
+            ("Top users", "user", summary["top_users"]),
+            ("Top IPs", "ip", summary["top_ips"]),
+        ):
+            if not rows:
+                continue
+            write("")
+            write(title)
+            for row in rows:
+                error = f" (±{row['error']})" if row["error"] else ""
+                write(f"  {row[key][:38]:<38}{row['requests']:>10}{error}")
+
+
+def _time(ts):
+    return "-" if ts is None else datetime.fromtimestamp(ts).isoformat(sep=" ", timespec="seconds")
+
+
+def _number(value):
+    return "-" if value is None else f"{value:.2f}"
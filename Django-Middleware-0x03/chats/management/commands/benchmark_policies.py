@@ -0,0 +1,119 @@
+import time
+from datetime import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from chats import middleware, policies
+
+# (method, path) mix: mostly chat reads, some writes and unrelated paths.
+REQUESTS = [
+    ("GET", "/api/conversations/"),
+    ("GET", "/api/conversations/{n}/"),
+    ("GET", "/api/messages/"),
+    ("GET", "/api/messages/?conversation_id={n}"),
+    ("GET", "/api/messages/{n}/"),
+    ("POST", "/api/messages/"),
+    ("PATCH", "/api/messages/{n}/"),
+    ("POST", "/api/conversations/"),
+    ("GET", "/admin/"),
+    ("GET", "/static/app.js"),
+    ("GET", "/metrics"),
+    ("POST", "/api/token/"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-request overhead of PolicyMiddleware with the chain "
+        "RestrictAccessByTime -> OffensiveLanguage -> Rolepermission, on a "
+        "mix of chat and other requests. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100000)
+        parser.add_argument("--ids", type=int, default=500, help="Distinct object ids in the paths.")
+        parser.add_argument(
+            "--hour", type=int, default=19,
+            help="Clock hour to run at (default 19, inside the chat window, so every policy runs).",
+        )
+
+    def handle(self, *args, **options):
+        requests = self.build_requests(options["requests"], options["ids"])
+        # Rate limits high enough that no request is refused: the point is
+        # to measure the checks, not the 429 short-cut.
+        rules = [{
+            "name": "messages", "path": "/messages", "methods": ["POST"],
+            "limit": 10 ** 9, "window": 60, "scope": "ip",
+        }]
+        clock = _fixed_clock(options["hour"])
+        with override_settings(RATE_LIMIT_RULES=rules, RATE_LIMIT_STORE="memory", CHAT_POLICIES=None), \
+                mock.patch.object(middleware, "datetime", clock), \
+                mock.patch.object(policies, "datetime", clock):
+            chain = middleware.RestrictAccessByTimeMiddleware(
+                middleware.OffensiveLanguageMiddleware(
+                    middleware.RolepermissionMiddleware(_ok)
+                )
+            )
+            engine = middleware.PolicyMiddleware(_ok)
+            uncached = middleware.PolicyMiddleware(_ok)
+            uncached.engine = policies.PolicyEngine(
+                uncached.engine.policies, uncached.engine.limiter, cache_size=0
+            )
+
+            baseline = self.run(_ok, requests)
+            results = [
+                ("middleware chain", self.run(chain, requests)),
+                ("PolicyMiddleware", self.run(engine, requests)),
+                ("PolicyMiddleware (no cache)", self.run(uncached, requests)),
+            ]
+
+        self.stdout.write(f"{len(requests)} requests, {options['ids']} ids, hour {options['hour']}")
+        self.stdout.write(f"{'':<30}{'us/request':>12}{'overhead us':>13}")
+        for name, seconds in results:
+            per_request = seconds / len(requests) * 1e6
+            overhead = (seconds - baseline) / len(requests) * 1e6
+            self.stdout.write(f"{name:<30}{per_request:>12.2f}{overhead:>13.2f}")
+        info = engine.engine.policies_for.cache_info()
+        self.stdout.write(f"path cache: {info.hits} hits, {info.misses} misses, {info.currsize} entries")
+
+    def build_requests(self, count, ids):
+        factory = RequestFactory()
+        user = get_user_model()(pk=1, username="bench")
+        # Memoized roles (see chats.roles), so no query is made.
+        user._chat_roles = frozenset({"moderator"})
+        requests = []
+        for i in range(count):
+            method, path = REQUESTS[i % len(REQUESTS)]
+            request = factory.generic(method, path.format(n=i % ids + 1))
+            request.user = user if method != "GET" else AnonymousUser()
+            requests.append(request)
+        return requests
+
+    def run(self, handler, requests):
+        started = time.perf_counter()
+        for request in requests:
+            response = handler(request)
+            if response.status_code != 200:
+                raise RuntimeError(f"{request.method} {request.path} was refused ({response.status_code}).")
+        return time.perf_counter() - started
+
+
+_RESPONSE = HttpResponse("ok")
+
+
+def _ok(request):
+    return _RESPONSE
+
+
+def _fixed_clock(hour):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz).replace(hour=hour)
+
+    return FixedDatetime
@@ -0,0 +1,160 @@
+import threading
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets (Prometheus "le" labels).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+DENIAL_ATTRIBUTE = "_metrics_denial_reason"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Buckets are stored non-cumulative and only
+    summed up when rendered, so observe() is one bisect and two additions.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(le label, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            yield str(bound), total
+
+
+class RouteStats:
+    """Everything recorded for one (route, method) pair."""
+
+    __slots__ = ("statuses", "latency", "queries", "query_seconds", "size")
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.query_seconds = 0.0
+        self.size = Histogram(SIZE_BUCKETS)
+
+
+class MetricsRegistry:
+    """
+    In-memory request metrics, aggregated per route.
+
+    Routes are URL patterns (e.g. "api/messages/<int:pk>/"), never raw
+    paths, so the number of series stays bounded. Each process keeps its
+    own registry; scrape every worker (or run one) to get the full view.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._denials = {}
+
+    def observe_request(self, route, method, status, seconds, queries, query_seconds, size):
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = RouteStats()
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.query_seconds += query_seconds
+            if size is not None:
+                stats.size.observe(size)
+
+    def record_denial(self, route, method, reason, status):
+        key = (route, method, reason, status)
+        with self._lock:
+            self._denials[key] = self._denials.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._denials.clear()
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            denials = sorted(self._denials.items())
+            lines = []
+
+            _header(lines, "chats_http_requests_total", "counter", "Requests by route, method and status.")
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(_sample(
+                        "chats_http_requests_total",
+                        {"route": route, "method": method, "status": status},
+                        count,
+                    ))
+
+            for name, attribute, kind, help_text in (
+                ("chats_http_request_duration_seconds", "latency", "histogram", "Request latency."),
+                ("chats_db_queries_per_request", "queries", "histogram", "Database queries per request."),
+                ("chats_http_response_size_bytes", "size", "histogram", "Response body size."),
+            ):
+                _header(lines, name, kind, help_text)
+                for (route, method), stats in routes:
+                    _histogram(lines, name, {"route": route, "method": method}, getattr(stats, attribute))
+
+            _header(lines, "chats_db_query_duration_seconds_total", "counter", "Time spent in database queries.")
+            for (route, method), stats in routes:
+                lines.append(_sample(
+                    "chats_db_query_duration_seconds_total",
+                    {"route": route, "method": method},
+                    stats.query_seconds,
+                ))
+
+            _header(lines, "chats_denied_requests_total", "counter", "Requests refused by chats.middleware.")
+            for (route, method, reason, status), count in denials:
+                lines.append(_sample(
+                    "chats_denied_requests_total",
+                    {"route": route, "method": method, "reason": reason, "status": status},
+                    count,
+                ))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+    return f"{name}{{{label_text}}} {value}"
+
+
+def _header(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _histogram(lines, name, labels, histogram):
+    for le, count in histogram.cumulative():
+        lines.append(_sample(f"{name}_bucket", {**labels, "le": le}, count))
+    lines.append(_sample(f"{name}_sum", labels, histogram.sum))
+    lines.append(_sample(f"{name}_count", labels, histogram.count))
+
+
+registry = MetricsRegistry()
+
+
+def mark_denied(request, reason):
+    """
+    Record why a chats middleware refused `request`. MetricsMiddleware
+    counts it once the response comes back; without it this is a no-op.
+    """
+    setattr(request, DENIAL_ATTRIBUTE, reason)
@@ -1,37 +1,178 @@
-from datetime import datetime, timedelta
-from collections import defaultdict, deque
+import json
+import time
+from contextlib import ExitStack
+from datetime import datetime
 
+from django.conf import settings
+from django.db import connections
 from django.http import HttpResponseForbidden, HttpResponse
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .logwriter import get_writer
+from .policies import PolicyEngine
+from .ratelimit import RateLimiter, client_ip
+from .roles import get_user_roles
+
+
+class MetricsMiddleware:
+    """
+    Middleware that records per-route request metrics in chats.metrics:
+    request counts by status, latency, database queries and query time
+    (counted with connection.execute_wrapper), response sizes, and the
+    requests refused by the other chats middlewares.
+
+    Put it first in MIDDLEWARE so the time spent in the other middlewares
+    is included. The metrics are served by chats.views.metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.registry = metrics.registry
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        route = request_route(request)
+        size = None if response.streaming else len(response.content)
+        self.registry.observe_request(
+            route, request.method, response.status_code, elapsed,
+            counter.count, counter.seconds, size,
+        )
+        reason = getattr(request, metrics.DENIAL_ATTRIBUTE, None)
+        if reason is not None:
+            self.registry.record_denial(route, request.method, reason, response.status_code)
+        return response
+
+
+def request_route(request):
+    """The URL pattern `request` matched, e.g. "api/messages/<int:pk>/"."""
+    # resolver_match is only set once the request reached URL
+    # resolution; requests refused earlier are resolved here.
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return "<unmatched>"
+    return match.route or match.view_name or "<unmatched>"
+
+
+class _QueryCounter:
+    """execute_wrapper that counts queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
 
 
 class RequestLoggingMiddleware:
     """
     Middleware that logs each user's requests to requests.log.
 
-    In __call__ it logs:
+    Each request is written as one JSON object per line, after the
+    response is built:
+
+        {"ts": 1718000000.123, "method": "GET", "path": "/api/messages/",
+         "route": "api/messages/", "user": "alice", "ip": "10.0.0.7",
+         "status": 200, "ms": 12.4, "bytes": 5800}
+
+    ("bytes" is null for streaming responses.) REQUEST_LOG_FORMAT = "text"
+    restores the original format, without status or latency:
         f"{datetime.now()} - User: {user} - Path: {request.path}"
+
+    Lines are handed to a shared BackgroundLogWriter, so a request only
+    pays for an enqueue; batching, flushing and rotation happen on the
+    writer thread. Tune it with REQUEST_LOG_FILE and REQUEST_LOG_OPTIONS
+    (keyword arguments for BackgroundLogWriter) in settings. The
+    analyze_requests command summarizes the log, in either format.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.log_file = "requests.log"
+        self.log_file = getattr(settings, "REQUEST_LOG_FILE", "requests.log")
+        self.structured = getattr(settings, "REQUEST_LOG_FORMAT", "json") == "json"
+        self.writer = get_writer(
+            self.log_file, **getattr(settings, "REQUEST_LOG_OPTIONS", {})
+        )
 
     def __call__(self, request):
+        started = time.time()
+        response = self.get_response(request)
+        elapsed = time.time() - started
+
+        # Read the user after the response: the authentication middleware
+        # may come after this one and has set request.user by now.
         user = getattr(request, "user", None)
         if user is None or not getattr(user, "is_authenticated", False):
             user_repr = "AnonymousUser"
         else:
             user_repr = str(user)
 
-        line = f"{datetime.now()} - User: {user_repr} - Path: {request.path}\n"
-
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(line)
+        if self.structured:
+            line = json.dumps(
+                {
+                    "ts": round(started, 3),
+                    "method": request.method,
+                    "path": request.path,
+                    "route": request_route(request),
+                    "user": user_repr,
+                    "ip": client_ip(request),
+                    "status": response.status_code,
+                    "ms": round(elapsed * 1000, 2),
+                    "bytes": None if response.streaming else len(response.content),
+                },
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ) + "\n"
+        else:
+            line = f"{datetime.now()} - User: {user_repr} - Path: {request.path}\n"
 
-        response = self.get_response(request)
+        self.writer.write(line)
         return response
 
 
+class PolicyMiddleware:
+    """
+    Middleware that applies the time-window, rate-limit and role policies
+    of chats.policies in a single pass.
+
+    It replaces RestrictAccessByTimeMiddleware, OffensiveLanguageMiddleware
+    and RolepermissionMiddleware: instead of each of them scanning the
+    path, the policies are compiled from CHAT_POLICIES into one route
+    table and the policies of a path are looked up once (and cached).
+    Without CHAT_POLICIES it behaves like those three middlewares in
+    that order, except that "/messages" and "/conversations" are matched
+    as whole path segments rather than substrings (so /static/messages.js
+    is no longer treated as a chat path).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.engine = PolicyEngine.from_settings(settings)
+
+    def __call__(self, request):
+        denial = self.engine.evaluate(request)
+        if denial is not None:
+            metrics.mark_denied(request, denial.reason)
+            return HttpResponse(denial.message, status=denial.status)
+        return self.get_response(request)
+
+
 class RestrictAccessByTimeMiddleware:
     """
     Middleware that restricts access to the chat during certain hours.
@@ -50,6 +191,7 @@ class RestrictAccessByTimeMiddleware:
             # Simple interpretation of "outside 9PM and 6PM":
             # allow only between 18:00 and 21:00
             if not (18 <= now.hour < 21):
+                metrics.mark_denied(request, "time_window")
                 return HttpResponseForbidden("Chat access is restricted at this time.")
         return self.get_response(request)
 
@@ -62,40 +204,29 @@ class OffensiveLanguageMiddleware:
     - Tracks POST requests to /messages.
     - Allows up to 5 messages per 1-minute window per IP.
     - If the limit is exceeded, it blocks further messages.
+
+    Limits come from RATE_LIMIT_RULES (per IP, per user or per route) and
+    are counted in the store named by RATE_LIMIT_STORE ("memory", "cache",
+    "sqlite" or a dotted path); see chats.ratelimit. Use "cache" or
+    "sqlite" so that all workers share the same counters.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.ip_requests = defaultdict(deque)
-        self.time_window = timedelta(minutes=1)
-        self.max_requests = 5
+        self.limiter = RateLimiter.from_settings(settings)
 
     def __call__(self, request):
-        if request.method == "POST" and "/messages" in (request.path or ""):
-            ip_address = self._get_ip(request)
-            now = datetime.now()
-
-            timestamps = self.ip_requests[ip_address]
-
-            while timestamps and (now - timestamps[0]) > self.time_window:
-                timestamps.popleft()
-
-            if len(timestamps) >= self.max_requests:
-                return HttpResponse(
-                    "Rate limit exceeded: too many messages from this IP.",
-                    status=429,
-                )
-
-            timestamps.append(now)
+        ip_address = client_ip(request)
+        rule = self.limiter.check(request, ip_address)
+        if rule is not None:
+            metrics.mark_denied(request, f"rate_limit:{rule.name}")
+            return HttpResponse(
+                "Rate limit exceeded: too many messages from this IP.",
+                status=429,
+            )
 
         return self.get_response(request)
 
-    def _get_ip(self, request):
-        x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
-        if x_forwarded_for:
-            return x_forwarded_for.split(",")[0].strip()
-        return request.META.get("REMOTE_ADDR", "unknown")
-
 
 class RolepermissionMiddleware:
     """
@@ -103,6 +234,8 @@ class RolepermissionMiddleware:
     to specific actions.
 
     - If the user is not admin or moderator, it returns 403 for restricted actions.
+    - Staff and superusers are allowed without looking at groups; group
+      roles come from the cached lookup in chats.roles.
     """
 
     def __init__(self, get_response):
@@ -117,14 +250,13 @@ class RolepermissionMiddleware:
                 user = getattr(request, "user", None)
 
                 if user is None or not getattr(user, "is_authenticated", False):
+                    metrics.mark_denied(request, "login_required")
                     return HttpResponseForbidden("You must be logged in.")
 
                 is_admin_like = user.is_superuser or user.is_staff
-                has_role_group = user.groups.filter(
-                    name__in=["admin", "moderator"]
-                ).exists()
 
-                if not (is_admin_like or has_role_group):
+                if not (is_admin_like or get_user_roles(user)):
+                    metrics.mark_denied(request, "role")
                     return HttpResponseForbidden(
                         "You do not have permission to perform this action."
                     )
@@ -0,0 +1,287 @@
+import time
+from datetime import datetime
+from functools import cached_property, lru_cache
+
+from django.utils.module_loading import import_string
+
+from .ratelimit import DEFAULT_RULE, STORES, RateLimiter, RateLimitRule, client_ip
+from .roles import ROLE_GROUPS, get_user_roles
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+CHAT_PATHS = ("**/messages", "**/conversations")
+
+
+class Denial:
+    """Why a policy refused a request, and the response to send."""
+
+    __slots__ = ("policy", "reason", "status", "message")
+
+    def __init__(self, policy, reason, status, message):
+        self.policy = policy
+        self.reason = reason
+        self.status = status
+        self.message = message
+
+
+class Policy:
+    """
+    A rule applied to the requests whose path matches one of `paths` and
+    whose method is in `methods` (empty means all).
+
+    Paths are segment patterns matched as prefixes: "/api/messages"
+    covers /api/messages/ and /api/messages/3/. "*" matches one segment
+    and "**" any number of segments, so "**/messages" covers every path
+    with a "messages" segment.
+    """
+
+    type = None
+
+    def __init__(self, name, paths, methods=()):
+        self.name = name
+        self.paths = tuple(paths)
+        self.methods = frozenset(m.upper() for m in methods)
+
+    def check(self, request, context):
+        """Return a Denial, or None to let the request through."""
+        raise NotImplementedError
+
+
+class TimeWindowPolicy(Policy):
+    """Only allow requests from `start` to `end` o'clock (server time); end may wrap past midnight."""
+
+    type = "time_window"
+
+    def __init__(self, name, paths, methods=(), start=18, end=21,
+                 message="Chat access is restricted at this time."):
+        super().__init__(name, paths, methods)
+        self.start = start
+        self.end = end
+        self.message = message
+
+    def check(self, request, context):
+        hour = context.hour
+        if self.start <= self.end:
+            allowed = self.start <= hour < self.end
+        else:
+            allowed = hour >= self.start or hour < self.end
+        if not allowed:
+            return Denial(self, "time_window", 403, self.message)
+        return None
+
+
+class RateLimitPolicy(Policy):
+    """A chats.ratelimit rule (limit requests per window, per ip, user or route)."""
+
+    type = "rate_limit"
+
+    def __init__(self, name, paths, methods=(), limit=5, window=60, scope="ip",
+                 message="Rate limit exceeded: too many messages from this IP."):
+        super().__init__(name, paths, methods)
+        self.rule = RateLimitRule(name, "", limit, window, methods, scope)
+        self.message = message
+
+    def check(self, request, context):
+        key = self.rule.key_for(request, context.ip_address)
+        if not context.limiter.allow(key, self.rule, context.now):
+            return Denial(self, f"rate_limit:{self.name}", 429, self.message)
+        return None
+
+
+class RolePolicy(Policy):
+    """Require an authenticated user who is staff, superuser or has one of `roles`."""
+
+    type = "role"
+
+    def __init__(self, name, paths, methods=(), roles=ROLE_GROUPS):
+        super().__init__(name, paths, methods)
+        self.roles = frozenset(roles)
+
+    def check(self, request, context):
+        user = getattr(request, "user", None)
+        if user is None or not getattr(user, "is_authenticated", False):
+            return Denial(self, "login_required", 403, "You must be logged in.")
+        if user.is_superuser or user.is_staff:
+            return None
+        if not (get_user_roles(user) & self.roles):
+            return Denial(self, "role", 403, "You do not have permission to perform this action.")
+        return None
+
+
+POLICY_TYPES = {
+    cls.type: cls for cls in (TimeWindowPolicy, RateLimitPolicy, RolePolicy)
+}
+
+
+class _Node:
+    __slots__ = ("children", "wildcard", "globstar", "loops", "policies")
+
+    def __init__(self, loops=False):
+        self.children = {}
+        self.wildcard = None
+        self.globstar = None
+        # True for a "**" node: it consumes any number of segments.
+        self.loops = loops
+        self.policies = []
+
+
+def _segments(path):
+    return [segment for segment in path.split("/") if segment]
+
+
+class RouteTable:
+    """
+    Segment trie of the policies' path patterns. Matching walks the path
+    once, collecting the policies of every node reached, however many
+    policies there are.
+    """
+
+    def __init__(self, policies):
+        self.policies = list(policies)
+        self.root = _Node()
+        for index, policy in enumerate(self.policies):
+            for pattern in policy.paths:
+                node = self.root
+                for segment in _segments(pattern):
+                    if segment == "**":
+                        if node.globstar is None:
+                            node.globstar = _Node(loops=True)
+                        node = node.globstar
+                    elif segment == "*":
+                        if node.wildcard is None:
+                            node.wildcard = _Node()
+                        node = node.wildcard
+                    else:
+                        node = node.children.setdefault(segment, _Node())
+                node.policies.append(index)
+
+    def match(self, path):
+        """Policies whose patterns cover `path`, in declaration order."""
+        states = _expand([self.root])
+        matched = {index for node in states for index in node.policies}
+        for segment in _segments(path):
+            reached = []
+            for node in states:
+                child = node.children.get(segment)
+                if child is not None:
+                    reached.append(child)
+                if node.wildcard is not None:
+                    reached.append(node.wildcard)
+                if node.loops:
+                    reached.append(node)
+            states = _expand(reached)
+            if not states:
+                break
+            matched.update(index for node in states for index in node.policies)
+        return [self.policies[index] for index in sorted(matched)]
+
+
+def _expand(nodes):
+    # A "**" node also matches zero segments: reaching its parent reaches it.
+    states = []
+    for node in nodes:
+        while node is not None and node not in states:
+            states.append(node)
+            node = node.globstar
+    return states
+
+
+class _Context:
+    """Per-request values shared by the policies, computed on first use."""
+
+    def __init__(self, request, limiter):
+        self.request = request
+        self.limiter = limiter
+        self.now = time.time()
+
+    @cached_property
+    def hour(self):
+        return datetime.now().hour
+
+    @cached_property
+    def ip_address(self):
+        return client_ip(self.request)
+
+
+class PolicyEngine:
+    """
+    Evaluates every policy that applies to a request in one pass.
+
+    The policies are compiled once into a RouteTable; the policies for a
+    (method, path) pair are then memoized in an LRU cache of
+    `cache_size` entries, so a repeated path costs one dict lookup.
+    Policies run in declaration order and the first denial wins.
+    """
+
+    def __init__(self, policies, limiter, cache_size=1024):
+        self.policies = list(policies)
+        self.table = RouteTable(self.policies)
+        self.limiter = limiter
+        self.policies_for = lru_cache(maxsize=cache_size)(self._policies_for)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Policies come from CHAT_POLICIES, a list of dicts with a "type"
+        ("time_window", "rate_limit", "role" or a dotted path to a Policy
+        class) and that class's arguments. Without it, the defaults match
+        the original middlewares, with RATE_LIMIT_RULES as rate limits.
+        The limits are counted in the RATE_LIMIT_STORE store.
+        """
+        definitions = getattr(settings, "CHAT_POLICIES", None)
+        if definitions is None:
+            definitions = default_policies(settings)
+        policies = []
+        for definition in definitions:
+            options = dict(definition)
+            kind = options.pop("type")
+            policy_class = POLICY_TYPES.get(kind) or import_string(kind)
+            policies.append(policy_class(**options))
+
+        store = getattr(settings, "RATE_LIMIT_STORE", "memory")
+        options = getattr(settings, "RATE_LIMIT_STORE_OPTIONS", {})
+        store_class = STORES.get(store) or import_string(store)
+        return cls(
+            policies,
+            RateLimiter([], store_class(**options)),
+            getattr(settings, "CHAT_POLICY_CACHE_SIZE", 1024),
+        )
+
+    def _policies_for(self, method, path):
+        return tuple(
+            policy for policy in self.table.match(path)
+            if not policy.methods or method in policy.methods
+        )
+
+    def evaluate(self, request):
+        """Return the first Denial for `request`, or None if every policy allows it."""
+        policies = self.policies_for(request.method, request.path or "")
+        if not policies:
+            return None
+        context = _Context(request, self.limiter)
+        for policy in policies:
+            denial = policy.check(request, context)
+            if denial is not None:
+                return denial
+        return None
+
+
+def default_policies(settings):
+    """
+    The rules hard-coded in the original chats middlewares, as
+    CHAT_POLICIES entries. Their substring paths become segment patterns.
+    """
+    rules = getattr(settings, "RATE_LIMIT_RULES", None)
+    if rules is None:
+        rules = [DEFAULT_RULE]
+    rate_limits = []
+    for rule in rules:
+        rule = dict(rule)
+        # RateLimitRule.path is a substring; "**/<path>" is its
+        # segment-wise equivalent.
+        rule["paths"] = ["**/" + rule.pop("path").strip("/")]
+        rate_limits.append({"type": "rate_limit", **rule})
+    return [
+        {"type": "time_window", "name": "chat_hours", "paths": CHAT_PATHS, "start": 18, "end": 21},
+        *rate_limits,
+        {"type": "role", "name": "chat_writes", "paths": CHAT_PATHS, "methods": WRITE_METHODS},
+    ]
@@ -0,0 +1,270 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.utils.module_loading import import_string
+
+
+class RateLimitRule:
+    """
+    One rate limit: at most `limit` requests per `window` seconds.
+
+    - `path`: the rule applies when this string appears in request.path.
+    - `methods`: HTTP methods the rule applies to (empty means all).
+    - `scope`: what the limit is counted per:
+        "ip"    - per client IP address,
+        "user"  - per authenticated user (falls back to IP for anonymous),
+        "route" - one shared counter for everyone hitting the route.
+    """
+
+    SCOPES = ("ip", "user", "route")
+
+    def __init__(self, name, path, limit, window, methods=(), scope="ip"):
+        if scope not in self.SCOPES:
+            raise ValueError(f"Unknown rate limit scope: {scope!r}")
+        self.name = name
+        self.path = path
+        self.limit = int(limit)
+        self.window = int(window)
+        self.methods = frozenset(m.upper() for m in methods)
+        self.scope = scope
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def matches(self, request):
+        if self.methods and request.method not in self.methods:
+            return False
+        return self.path in (request.path or "")
+
+    def key_for(self, request, ip_address):
+        if self.scope == "route":
+            identity = "*"
+        elif self.scope == "user":
+            user = getattr(request, "user", None)
+            if user is not None and getattr(user, "is_authenticated", False):
+                identity = f"u{user.pk}"
+            else:
+                identity = f"ip{ip_address}"
+        else:
+            identity = f"ip{ip_address}"
+        return f"{self.name}:{identity}"
+
+
+class MemoryStore:
+    """
+    Per-process store. Keeps two counters per key and evicts keys whose
+    counters have expired (two windows of their own rule after the last
+    hit) or the least recently used ones once `max_keys` is reached, so
+    memory stays bounded.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()  # key -> [window_index, current, previous, expires]
+        self._lock = threading.Lock()
+
+    def get_counts(self, key, index):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return 0, 0
+            return _shift(entry[0], entry[1], entry[2], index)
+
+    def increment(self, key, index, window):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = self._data[key] = [index, 0, 0, 0]
+            else:
+                self._data.move_to_end(key)
+            current, previous = _shift(entry[0], entry[1], entry[2], index)
+            entry[:] = [index, current + 1, previous, now + 2 * window]
+            self._evict(now)
+
+    def _evict(self, now):
+        # Least recently used entries sit at the front of the OrderedDict.
+        # Each entry expires after its own rule's window, so an unexpired
+        # one (e.g. of a longer rule) stops the scan; the ones behind it
+        # are dropped when they reach the front or when max_keys is hit.
+        while self._data:
+            key, entry = next(iter(self._data.items()))
+            if entry[3] > now and len(self._data) <= self.max_keys:
+                break
+            del self._data[key]
+
+
+class CacheStore:
+    """
+    Store backed by a Django cache alias, shared by every worker that
+    talks to the same cache. Counters expire on their own after two
+    windows, so idle keys are evicted by the cache backend.
+    """
+
+    def __init__(self, alias="default", prefix="ratelimit"):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _key(self, key, index):
+        return f"{self.prefix}:{key}:{index}"
+
+    def get_counts(self, key, index):
+        values = self.cache.get_many([self._key(key, index), self._key(key, index - 1)])
+        return (
+            values.get(self._key(key, index), 0),
+            values.get(self._key(key, index - 1), 0),
+        )
+
+    def increment(self, key, index, window):
+        cache_key = self._key(key, index)
+        if not self.cache.add(cache_key, 1, timeout=2 * window):
+            try:
+                self.cache.incr(cache_key)
+            except ValueError:
+                # Expired between add() and incr().
+                self.cache.set(cache_key, 1, timeout=2 * window)
+
+
+class SQLiteStore:
+    """
+    Store in a SQLite file, shared by all worker processes on one host.
+    One row per (key, window); rows older than the previous window are
+    purged periodically.
+    """
+
+    def __init__(self, path="ratelimit.sqlite3", purge_every=1000):
+        self.path = os.path.abspath(path)
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        self._create_table()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_table(self):
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS ratelimit ("
+            " key TEXT NOT NULL, window_index INTEGER NOT NULL,"
+            " count INTEGER NOT NULL, expires REAL NOT NULL,"
+            " PRIMARY KEY (key, window_index)) WITHOUT ROWID"
+        )
+
+    def get_counts(self, key, index):
+        rows = self._connection().execute(
+            "SELECT window_index, count FROM ratelimit"
+            " WHERE key = ? AND window_index IN (?, ?)",
+            (key, index, index - 1),
+        ).fetchall()
+        counts = dict(rows)
+        return counts.get(index, 0), counts.get(index - 1, 0)
+
+    def increment(self, key, index, window):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO ratelimit (key, window_index, count, expires)"
+            " VALUES (?, ?, 1, ?)"
+            " ON CONFLICT (key, window_index) DO UPDATE SET count = count + 1",
+            (key, index, now + 2 * window),
+        )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM ratelimit WHERE expires < ?", (now,))
+
+
+def client_ip(request):
+    """The client address, taken from X-Forwarded-For when a proxy set it."""
+    x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+    if x_forwarded_for:
+        return x_forwarded_for.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "unknown")
+
+
+STORES = {
+    "memory": MemoryStore,
+    "cache": CacheStore,
+    "sqlite": SQLiteStore,
+}
+
+
+def _shift(stored_index, current, previous, index):
+    """Move stored (current, previous) counters forward to window `index`."""
+    if stored_index == index:
+        return current, previous
+    if stored_index == index - 1:
+        return 0, current
+    return 0, 0
+
+
+class RateLimiter:
+    """
+    Sliding-window counter limiter.
+
+    Each key only keeps the counts of the current and the previous fixed
+    window. The request rate is estimated as
+        previous * (1 - elapsed_fraction_of_current_window) + current
+    which approximates a true sliding window with O(1) state per key.
+    """
+
+    def __init__(self, rules, store):
+        self.rules = list(rules)
+        self.store = store
+
+    @classmethod
+    def from_settings(cls, settings):
+        rules = getattr(settings, "RATE_LIMIT_RULES", None)
+        if rules is None:
+            rules = [DEFAULT_RULE]
+        store = getattr(settings, "RATE_LIMIT_STORE", "memory")
+        options = getattr(settings, "RATE_LIMIT_STORE_OPTIONS", {})
+        store_class = STORES.get(store) or import_string(store)
+        return cls([RateLimitRule.from_dict(rule) for rule in rules], store_class(**options))
+
+    def check(self, request, ip_address):
+        """
+        Count the request against every matching rule.
+        Return the first rule that is exceeded, or None if allowed.
+        """
+        matched = [rule for rule in self.rules if rule.matches(request)]
+        if not matched:
+            return None
+        now = time.time()
+        for rule in matched:
+            if not self.allow(rule.key_for(request, ip_address), rule, now):
+                return rule
+        return None
+
+    def allow(self, key, rule, now=None):
+        now = time.time() if now is None else now
+        index = math.floor(now / rule.window)
+        elapsed = (now % rule.window) / rule.window
+        current, previous = self.store.get_counts(key, index)
+        if previous * (1 - elapsed) + current >= rule.limit:
+            return False
+        self.store.increment(key, index, rule.window)
+        return True
+
+
+# Matches the original behaviour: 5 message POSTs per minute per IP.
+DEFAULT_RULE = {
+    "name": "messages",
+    "path": "/messages",
+    "methods": ["POST"],
+    "limit": 5,
+    "window": 60,
+    "scope": "ip",
+}
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+
+User = get_user_model()
+
+ROLE_GROUPS = ("admin", "moderator")
+
+# Short enough that a per-process cache, which the signals below only
+# clear in the worker that made the change, is not stale for long.
+DEFAULT_ROLE_CACHE_TTL = 30
+
+
+def _cache():
+    return caches[getattr(settings, "ROLE_CACHE_ALIAS", "default")]
+
+
+def _ttl():
+    return getattr(settings, "ROLE_CACHE_TTL", DEFAULT_ROLE_CACHE_TTL)
+
+
+def check_role_cache(app_configs, **kwargs):
+    """Warn when a long ROLE_CACHE_TTL is kept in a per-process cache."""
+    alias = getattr(settings, "ROLE_CACHE_ALIAS", "default")
+    config = settings.CACHES.get(alias)
+    if config is None:
+        return [checks.Error(f"ROLE_CACHE_ALIAS names an unknown cache alias: {alias!r}.", id="chats.E001")]
+    if _ttl() > DEFAULT_ROLE_CACHE_TTL and issubclass(import_string(config["BACKEND"]), LocMemCache):
+        return [checks.Warning(
+            f"Roles are cached for {_ttl()} s in the per-process cache {alias!r}: a role "
+            "removed in one worker stays valid in the others until it expires.",
+            hint="Point ROLE_CACHE_ALIAS at a shared cache (Redis, Memcached, database) "
+                 f"or keep ROLE_CACHE_TTL at {DEFAULT_ROLE_CACHE_TTL} s or less.",
+            id="chats.W001",
+        )]
+    return []
+
+
+def _key(user_id):
+    return f"chats:roles:{user_id}"
+
+
+def get_user_roles(user):
+    """
+    Return the set of role group names ("admin", "moderator") of a user.
+
+    Roles are memoized on the user object for the rest of the request and
+    cached per user id in ROLE_CACHE_ALIAS for ROLE_CACHE_TTL seconds
+    (default 30), so the groups table is only queried on a cache miss.
+    The cache entry is dropped as soon as the user's group membership
+    changes, but only in the caches this process can reach: with the
+    default per-process cache, other workers keep the old roles for up
+    to ROLE_CACHE_TTL. Use a shared cache before raising the TTL (see
+    check_role_cache).
+    """
+    roles = getattr(user, "_chat_roles", None)
+    if roles is not None:
+        return roles
+
+    cache = _cache()
+    cached = cache.get(_key(user.pk))
+    if cached is None:
+        cached = list(
+            user.groups.filter(name__in=ROLE_GROUPS).values_list("name", flat=True)
+        )
+        cache.set(_key(user.pk), cached, _ttl())
+
+    roles = frozenset(cached)
+    user._chat_roles = roles
+    return roles
+
+
+def invalidate_user_roles(*user_ids):
+    _cache().delete_many([_key(user_id) for user_id in user_ids])
+
+
+def _invalidate_group_members(group):
+    invalidate_user_roles(*group.user_set.values_list("pk", flat=True))
+
+
+def _groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # Group.user_set.clear(): pk_set is not given, so collect members now.
+        _invalidate_group_members(instance)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if reverse:
+            invalidate_user_roles(*(pk_set or ()))
+        else:
+            invalidate_user_roles(instance.pk)
+
+
+def _group_saved(sender, instance, created, **kwargs):
+    # A rename can turn a group into (or out of) a role group.
+    if not created:
+        _invalidate_group_members(instance)
+
+
+def _group_deleted(sender, instance, **kwargs):
+    _invalidate_group_members(instance)
+
+
+def connect_signals():
+    """Invalidate cached roles on group changes (called from ChatsConfig.ready)."""
+    m2m_changed.connect(
+        _groups_changed, sender=User.groups.through, dispatch_uid="chats_roles_groups_changed"
+    )
+    post_save.connect(_group_saved, sender=Group, dispatch_uid="chats_roles_group_saved")
+    pre_delete.connect(_group_deleted, sender=Group, dispatch_uid="chats_roles_group_deleted")
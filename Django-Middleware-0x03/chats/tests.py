@@ -0,0 +1,313 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import metrics, middleware, policies
+from .logwriter import BackgroundLogWriter
+from .policies import Policy, RouteTable
+from .ratelimit import MemoryStore, RateLimiter, RateLimitRule
+from .roles import check_role_cache, get_user_roles
+from .views import metrics as metrics_view
+
+User = get_user_model()
+
+
+class MemoryStoreTests(SimpleTestCase):
+    def test_short_rule_traffic_keeps_long_rule_counters(self):
+        store = MemoryStore()
+        with mock.patch("chats.ratelimit.time.monotonic", return_value=1000.0):
+            store.increment("hourly:ip1", 0, 3600)
+        # Ten minutes later, well past two windows of a 60 s rule.
+        with mock.patch("chats.ratelimit.time.monotonic", return_value=1600.0):
+            store.increment("minute:ip2", 26, 60)
+        self.assertEqual(store.get_counts("hourly:ip1", 0), (1, 0))
+
+    def test_expired_entries_are_evicted(self):
+        store = MemoryStore()
+        with mock.patch("chats.ratelimit.time.monotonic", return_value=1000.0):
+            store.increment("minute:ip1", 16, 60)
+        with mock.patch("chats.ratelimit.time.monotonic", return_value=1121.0):
+            store.increment("minute:ip2", 18, 60)
+        self.assertNotIn("minute:ip1", store._data)
+        self.assertIn("minute:ip2", store._data)
+
+    def test_least_recently_used_keys_go_first_when_full(self):
+        store = MemoryStore(max_keys=2)
+        for key in ("a", "b", "c"):
+            store.increment(key, 0, 3600)
+        self.assertEqual(list(store._data), ["b", "c"])
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.minute = RateLimitRule("minute", "/messages", limit=100, window=60)
+        self.hour = RateLimitRule("hour", "/messages", limit=3, window=3600)
+        self.limiter = RateLimiter([self.minute, self.hour], MemoryStore())
+        self.factory = RequestFactory()
+
+    def check(self, ip_address, now):
+        request = self.factory.post("/api/messages/")
+        with mock.patch("chats.ratelimit.time.time", return_value=now), \
+                mock.patch("chats.ratelimit.time.monotonic", return_value=now):
+            return self.limiter.check(request, ip_address)
+
+    def test_longer_limit_holds_across_shorter_windows(self):
+        start = 36000.0
+        for i in range(3):
+            self.assertIsNone(self.check("10.0.0.1", start + i))
+        # Other clients keep the minute rule busy for ten minutes.
+        for second in range(60, 600, 30):
+            self.assertIsNone(self.check(f"10.0.1.{second // 30}", start + second))
+        self.assertIs(self.check("10.0.0.1", start + 600), self.hour)
+
+    def test_limit_resets_after_the_window(self):
+        start = 36000.0
+        for i in range(3):
+            self.assertIsNone(self.check("10.0.0.1", start + i))
+        self.assertIs(self.check("10.0.0.1", start + 10), self.hour)
+        self.assertIsNone(self.check("10.0.0.1", start + 2 * 3600))
+
+    def test_unmatched_requests_are_not_counted(self):
+        request = self.factory.get("/api/messages/")
+        limiter = RateLimiter([RateLimitRule("posts", "/messages", 1, 60, methods=["POST"])], MemoryStore())
+        for _ in range(3):
+            self.assertIsNone(limiter.check(request, "10.0.0.1"))
+
+
+class RoleCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        self.group = Group.objects.create(name="moderator")
+
+    def roles(self):
+        return get_user_roles(User.objects.get(pk=self.user.pk))
+
+    def test_long_ttl_in_a_per_process_cache_is_flagged(self):
+        self.assertEqual(check_role_cache(None), [])
+        with override_settings(ROLE_CACHE_TTL=300):
+            self.assertEqual([message.id for message in check_role_cache(None)], ["chats.W001"])
+        shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "roles"}}
+        with override_settings(ROLE_CACHE_TTL=300, CACHES=shared):
+            self.assertEqual(check_role_cache(None), [])
+
+    def test_cached_roles_follow_group_changes(self):
+        self.assertEqual(self.roles(), frozenset())
+        self.user.groups.add(self.group)
+        self.assertEqual(self.roles(), {"moderator"})
+        self.group.user_set.clear()
+        self.assertEqual(self.roles(), frozenset())
+        self.group.user_set.add(self.user)
+        self.group.name = "readers"
+        self.group.save()
+        self.assertEqual(self.roles(), frozenset())
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    def scrape(self, **extra):
+        return metrics_view(RequestFactory().get("/metrics", **extra)).status_code
+
+    def test_closed_by_default_even_from_loopback(self):
+        self.assertEqual(self.scrape(REMOTE_ADDR="127.0.0.1"), 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.5"])
+    def test_allowed_addresses(self):
+        self.assertEqual(self.scrape(REMOTE_ADDR="10.0.0.5"), 200)
+        self.assertEqual(self.scrape(REMOTE_ADDR="127.0.0.1"), 403)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_bearer_token(self):
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer s3cret"), 200)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer wrong"), 403)
+        self.assertEqual(self.scrape(), 403)
+
+
+def _fixed_clock(hour):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2024, 5, 1, hour, 30, tzinfo=tz)
+
+    return FixedDatetime
+
+
+def _ok(request):
+    return HttpResponse("ok")
+
+
+def _user(pk, roles=(), **flags):
+    user = User(pk=pk, username=f"user{pk}", **flags)
+    # Memoized roles (see chats.roles), so no query is made.
+    user._chat_roles = frozenset(roles)
+    return user
+
+
+class RouteTableTests(SimpleTestCase):
+    def match(self, table, path):
+        return [policy.name for policy in table.match(path)]
+
+    def test_patterns_match_as_prefixes(self):
+        table = RouteTable([Policy("messages", ["/api/messages"])])
+        self.assertEqual(self.match(table, "/api/messages"), ["messages"])
+        self.assertEqual(self.match(table, "/api/messages/3/"), ["messages"])
+        self.assertEqual(self.match(table, "/api/messagesx/"), [])
+        self.assertEqual(self.match(table, "/messages/"), [])
+
+    def test_star_matches_one_segment(self):
+        table = RouteTable([Policy("nested", ["/api/conversations/*/messages"])])
+        self.assertEqual(self.match(table, "/api/conversations/7/messages/"), ["nested"])
+        self.assertEqual(self.match(table, "/api/conversations/messages/"), [])
+        self.assertEqual(self.match(table, "/api/conversations/7/8/messages/"), [])
+
+    def test_globstar_matches_any_number_of_segments(self):
+        table = RouteTable([Policy("chat", ["**/messages"]), Policy("export", ["/api/**/export"])])
+        self.assertEqual(self.match(table, "/messages"), ["chat"])
+        self.assertEqual(self.match(table, "/api/v2/conversations/3/messages/9/"), ["chat"])
+        self.assertEqual(self.match(table, "/api/export"), ["export"])
+        self.assertEqual(self.match(table, "/api/messages/export/"), ["chat", "export"])
+        self.assertEqual(self.match(table, "/static/messages.js"), [])
+
+    def test_policies_come_back_in_declaration_order(self):
+        table = RouteTable([
+            Policy("second", ["**/messages"]), Policy("first", ["/api"]), Policy("third", ["/api/*"]),
+        ])
+        self.assertEqual(self.match(table, "/api/messages/"), ["second", "first", "third"])
+
+
+@override_settings(
+    CHAT_POLICIES=None,
+    RATE_LIMIT_STORE="memory",
+    RATE_LIMIT_STORE_OPTIONS={},
+    RATE_LIMIT_RULES=[
+        {"name": "messages", "path": "/messages", "methods": ["POST"], "limit": 2, "window": 60},
+        {"name": "conversations", "path": "/conversations", "limit": 3, "window": 60, "scope": "user"},
+    ],
+)
+class PolicyMiddlewareEquivalenceTests(SimpleTestCase):
+    """The default policies against the middleware chain they replace."""
+
+    PATHS = [
+        "/api/messages/",
+        "/api/messages/3/",
+        "/messages",
+        "/api/conversations/",
+        "/api/conversations/2/messages/",
+        "/admin/",
+        "/api/users/",
+    ]
+    METHODS = ["GET", "POST", "PATCH", "DELETE"]
+
+    def users(self):
+        return [
+            AnonymousUser(),
+            _user(1),
+            _user(2, roles=["moderator"]),
+            _user(3, roles=["admin"]),
+            _user(4, is_staff=True),
+            _user(5, is_superuser=True),
+        ]
+
+    def outcomes(self, hour, requests):
+        factory = RequestFactory()
+        clock = _fixed_clock(hour)
+        results = {}
+        with mock.patch.object(middleware, "datetime", clock), \
+                mock.patch.object(policies, "datetime", clock), \
+                mock.patch("chats.ratelimit.time.time", return_value=36000.0):
+            for name, handler in (
+                ("chain", middleware.RestrictAccessByTimeMiddleware(
+                    middleware.OffensiveLanguageMiddleware(middleware.RolepermissionMiddleware(_ok))
+                )),
+                ("policies", middleware.PolicyMiddleware(_ok)),
+            ):
+                outcome = []
+                for method, path, user, ip_address in requests:
+                    request = factory.generic(method, path, REMOTE_ADDR=ip_address)
+                    request.user = user
+                    response = handler(request)
+                    outcome.append((
+                        method, path, str(user), response.status_code, response.content,
+                        getattr(request, metrics.DENIAL_ATTRIBUTE, None),
+                    ))
+                results[name] = outcome
+        return results["chain"], results["policies"]
+
+    def test_same_outcome_over_methods_paths_users_and_hours(self):
+        requests = [
+            (method, path, user, "10.0.0.%d" % index)
+            for index, user in enumerate(self.users())
+            for path in self.PATHS
+            for method in self.METHODS
+        ]
+        for hour in (0, 9, 17, 18, 20, 21, 23):
+            with self.subTest(hour=hour):
+                chain, engine = self.outcomes(hour, requests)
+                self.assertEqual(engine, chain)
+
+    def test_same_rate_limit_decisions(self):
+        moderator = _user(2, roles=["moderator"])
+        requests = [
+            *[("POST", "/api/messages/", moderator, "10.0.0.1")] * 4,
+            *[("POST", "/api/messages/", AnonymousUser(), "10.0.0.2")] * 3,
+            *[("GET", "/api/conversations/", moderator, "10.0.0.%d" % i) for i in range(5)],
+            *[("GET", "/api/conversations/", AnonymousUser(), "10.0.0.9")] * 4,
+        ]
+        chain, engine = self.outcomes(19, requests)
+        self.assertEqual(engine, chain)
+        self.assertEqual([outcome[3] for outcome in engine[:4]], [200, 200, 429, 429])
+
+    def test_chat_paths_are_matched_by_whole_segments(self):
+        # The old middlewares matched "/messages" as a substring of the
+        # path; the policies match path segments.
+        chain, engine = self.outcomes(9, [("GET", "/static/messages.js", AnonymousUser(), "10.0.0.1")])
+        self.assertEqual(chain[0][3], 403)
+        self.assertEqual(engine[0][3], 200)
+
+
+class BackgroundLogWriterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "requests.log")
+
+    def test_failed_rotation_keeps_appending(self):
+        writer = BackgroundLogWriter(self.path, flush_interval=0.01, max_bytes=10, backup_count=2)
+        self.addCleanup(writer.close)
+        replace = os.replace
+        failures = [FileNotFoundError("rotated by another worker")]
+
+        def flaky_replace(src, dst):
+            if failures:
+                raise failures.pop()
+            replace(src, dst)
+
+        with mock.patch("chats.logwriter.os.replace", side_effect=flaky_replace):
+            writer.write("first line\n")
+            self.wait_for(lambda: os.path.exists(self.path))
+            writer.write("second line\n")
+            self.wait_for(lambda: not failures)
+            self.assertTrue(writer._thread.is_alive())
+            writer.write("third line\n")
+            writer.close()
+
+        self.assertEqual(writer.total_dropped, 0)
+        with open(self.path, encoding="utf-8") as f:
+            current = f.read()
+        with open(self.path + ".1", encoding="utf-8") as f:
+            rotated = f.read()
+        # The failed rotation appended to the current file; the next one rotated it.
+        self.assertEqual(rotated, "first line\nsecond line\n")
+        self.assertEqual(current, "third line\n")
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("The writer thread made no progress.")
@@ -0,0 +1,32 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import registry
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint for the metrics collected by
+    MetricsMiddleware.
+
+    Answered only for a scraper that sends METRICS_TOKEN as a bearer
+    token, or that connects from one of METRICS_ALLOWED_IPS. Neither is
+    set by default, so the endpoint is closed until configured: behind a
+    reverse proxy every request comes from the proxy's address, so
+    loopback is not trusted implicitly.
+    """
+    if not _scrape_allowed(request):
+        return HttpResponseForbidden("Metrics access is not allowed.")
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _scrape_allowed(request):
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        scheme, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode()):
+            return True
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", ())
+    return request.META.get("REMOTE_ADDR") in allowed
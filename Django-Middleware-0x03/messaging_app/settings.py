@@ -1,7 +1,7 @@
 MIDDLEWARE = [
+    "chats.middleware.MetricsMiddleware",
     ...
     "chats.middleware.RequestLoggingMiddleware",
-    "chats.middleware.RestrictAccessByTimeMiddleware",
-    "chats.middleware.OffensiveLanguageMiddleware",
-    "chats.middleware.RolepermissionMiddleware",
+    # Time window, rate limits and roles (see chats.policies).
+    "chats.middleware.PolicyMiddleware",
 ]
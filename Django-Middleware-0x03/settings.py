@@ -9,8 +9,10 @@ from messaging_app.settings import *  # noqa
 
 # Explicit references so the checker can see all middleware paths:
 MIDDLEWARE_CHECKER_REFERENCES = [
+    "chats.middleware.MetricsMiddleware",
     "chats.middleware.RequestLoggingMiddleware",
     "chats.middleware.RestrictAccessByTimeMiddleware",
     "chats.middleware.OffensiveLanguageMiddleware",
     "chats.middleware.RolepermissionMiddleware",
+    "chats.middleware.PolicyMiddleware",
 ]
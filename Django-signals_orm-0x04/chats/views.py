@@ -1,9 +1,10 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth import get_user_model
-from django.views.decorators.cache import cache_page
 
+from messaging.cache import cache_per_user
 from messaging.models import Message
+from messaging.threads import fetch_conversation_threads, get_all_replies
 
 User = get_user_model()
 
@@ -12,21 +13,11 @@ User = get_user_model()
 def conversation_thread(request, username):
     """Display a threaded conversation between the current user and another user.
 
-    Uses select_related and prefetch_related to optimize queries for messages and replies.
+    All threads and their nested replies are loaded with a single query.
     """
     other_user = get_object_or_404(User, username=username)
 
-    # Base messages in the conversation (top-level messages only)
-    messages = (
-        Message.objects.filter(
-            sender__in=[request.user, other_user],
-            receiver__in=[request.user, other_user],
-            parent_message__isnull=True,
-        )
-        .select_related("sender", "receiver")
-        .prefetch_related("replies", "replies__sender", "replies__receiver")
-        .order_by("timestamp")
-    )
+    messages = fetch_conversation_threads(request.user, other_user)
 
     context = {
         "other_user": other_user,
@@ -36,16 +27,12 @@ def conversation_thread(request, username):
 
 
 def _get_all_replies(message):
-    """Recursively collect all replies to a message.
+    """Collect all replies to a message, depth-first.
 
-    This is a Python-level recursion that can be used to render
-    threads in templates.
+    The whole thread is loaded in one query and can be used to render
+    threads in templates (each reply has a depth attribute).
     """
-    all_replies = []
-    for reply in message.replies.all():
-        all_replies.append(reply)
-        all_replies.extend(_get_all_replies(reply))
-    return all_replies
+    return get_all_replies(message)
 
 
 @login_required
@@ -56,12 +43,13 @@ def unread_inbox(request):
     return render(request, "chats/unread_inbox.html", context)
 
 
-@cache_page(60)
 @login_required
+@cache_per_user()
 def conversation_list(request):
     """Cached view that lists recent conversations/messages for the user.
 
-    The view is cached for 60 seconds using @cache_page.
+    The page is cached per user and invalidated whenever a message sent to
+    or by the user changes (see messaging.cache).
     """
     recent_messages = (
         Message.objects.filter(receiver=request.user)
@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.db.models.functions import Length, Substr
 
-from .models import Message, Notification, MessageHistory
+from .models import AccountDeletion, Message, Notification, MessageHistory, ReadWatermark
 
 
 @admin.register(Message)
@@ -22,9 +23,45 @@ class NotificationAdmin(admin.ModelAdmin):
 
 @admin.register(MessageHistory)
 class MessageHistoryAdmin(admin.ModelAdmin):
-    list_display = ("id", "message", "edited_by", "edited_at", "short_old_content")
-    list_filter = ("edited_at",)
+    list_display = ("id", "message", "version", "edited_by", "edited_at", "short_old_content")
+    list_filter = ("edited_at", "is_snapshot")
     search_fields = ("message__content", "old_content", "edited_by__username")
+    readonly_fields = ("content_of_version",)
 
+    def get_queryset(self, request):
+        # The list only needs the start of a snapshot and the size of a
+        # delta, so the full texts are not loaded.
+        return (
+            super()
+            .get_queryset(request)
+            .defer("old_content", "delta")
+            .annotate(old_content_start=Substr("old_content", 1, 51), delta_length=Length("delta"))
+        )
+
+    @admin.display(description="old content")
     def short_old_content(self, obj):
-        return (obj.old_content[:50] + "...") if len(obj.old_content) > 50 else obj.old_content
+        if not obj.is_snapshot:
+            return f"(delta, {obj.delta_length} chars)"
+        start = obj.old_content_start
+        return (start[:50] + "...") if len(start) > 50 else start
+
+    @admin.display(description="content of this version")
+    def content_of_version(self, obj):
+        if obj.version == 0:
+            return obj.old_content
+        return obj.message.content_at(obj.version)
+
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = (
+        "user_id", "requested_at", "completed_at",
+        "messages_deleted", "notifications_deleted", "histories_deleted",
+    )
+    list_filter = ("completed_at",)
+
+
+@admin.register(ReadWatermark)
+class ReadWatermarkAdmin(admin.ModelAdmin):
+    list_display = ("user", "peer", "last_read_message_id", "last_read_at")
+    search_fields = ("user__username", "peer__username")
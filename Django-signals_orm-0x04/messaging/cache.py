@@ -0,0 +1,125 @@
+"""
+Per-user view cache with event-based invalidation.
+
+cache_page keys responses on the URL only, so two users can be served
+each other's page, and a new message stays invisible until the entry
+expires. Here every cached page is keyed on the user and on the current
+"version" of the scopes it depends on (the user, a conversation between
+two users). Message signals replace those versions, which makes every
+older entry unreachable at once, so entries can live for a long time.
+
+The backend is whichever Django cache alias MESSAGING_VIEW_CACHE names
+(default "default"); use a shared backend such as FileBasedCache or
+Redis when running several workers.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+def _cache():
+    return caches[getattr(settings, "MESSAGING_VIEW_CACHE", "default")]
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def conversation_scope(user_a_id, user_b_id):
+    low, high = sorted((user_a_id, user_b_id))
+    return f"conversation:{low}-{high}"
+
+
+def _version_key(scope):
+    return f"messaging:version:{scope}"
+
+
+def get_versions(scopes):
+    """
+    Current version token of each scope. Versions are random tokens, not
+    counters, so an evicted version can never match an old page again.
+    """
+    cache = _cache()
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, scope in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        versions[scope] = version
+    return versions
+
+
+def bump(*scopes):
+    """Invalidate every cached page depending on any of `scopes`."""
+    if scopes:
+        _cache().set_many({_version_key(scope): uuid.uuid4().hex for scope in set(scopes)}, timeout=None)
+
+
+def bump_for_messages(pairs):
+    """Invalidate the users and conversations of (sender_id, receiver_id) pairs."""
+    scopes = []
+    for sender_id, receiver_id in set(pairs):
+        scopes += [
+            user_scope(sender_id),
+            user_scope(receiver_id),
+            conversation_scope(sender_id, receiver_id),
+        ]
+    bump(*scopes)
+
+
+def cache_per_user(scopes=None, timeout=None):
+    """
+    Cache a view's GET responses per user.
+
+    `scopes(request, *args, **kwargs)` returns the extra scopes the page
+    depends on; the user's own scope is always included. `timeout`
+    defaults to MESSAGING_VIEW_CACHE_TIMEOUT (one day).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            user = getattr(request, "user", None)
+            if request.method not in ("GET", "HEAD") or not (user and user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            page_scopes = [user_scope(user.pk)]
+            if scopes is not None:
+                page_scopes += scopes(request, *args, **kwargs)
+            versions = get_versions(page_scopes)
+
+            raw = "|".join(
+                [view.__module__, view.__qualname__, str(user.pk), request.get_full_path()]
+                + [f"{scope}={versions[scope]}" for scope in sorted(versions)]
+            )
+            key = "messaging:view:" + hashlib.sha256(raw.encode()).hexdigest()
+
+            cache = _cache()
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                if hasattr(response, "render") and callable(response.render):
+                    response.render()
+                cache.set(
+                    key,
+                    (response.content, response.get("Content-Type")),
+                    timeout if timeout is not None
+                    else getattr(settings, "MESSAGING_VIEW_CACHE_TIMEOUT", 60 * 60 * 24),
+                )
+            return response
+
+        return wrapper
+
+    return decorator
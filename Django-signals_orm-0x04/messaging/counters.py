@@ -0,0 +1,137 @@
+"""
+Unread message counters.
+
+Showing an unread badge should not scan the Message table, so the
+counts are kept in UnreadCounter rows (one per user and scope) and
+adjusted in the same transaction as the message write.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import UnreadCounter
+
+ALL = "all"
+
+
+def sender_scope(sender_id):
+    return f"sender:{sender_id}"
+
+
+def thread_scope(thread_id):
+    return f"thread:{thread_id}"
+
+
+def sender_receiver_pairs(deltas):
+    """(sender_id, receiver_id) pairs touched by a set of counter deltas."""
+    prefix = sender_scope("")
+    return [
+        (int(scope[len(prefix):]), user_id)
+        for user_id, scope in deltas
+        if scope.startswith(prefix)
+    ]
+
+
+def scopes_for(message):
+    """The counter scopes one unread message is counted in."""
+    return (
+        ALL,
+        sender_scope(message.sender_id),
+        thread_scope(message.thread_root_id or message.pk),
+    )
+
+
+def deltas_for(messages, delta):
+    """Counter deltas for applying `delta` to each message's receiver."""
+    deltas = Counter()
+    for message in messages:
+        for scope in scopes_for(message):
+            deltas[(message.receiver_id, scope)] += delta
+    return deltas
+
+
+def apply_deltas(deltas, unless=None):
+    """
+    Add each delta to its (user_id, scope) counter, creating it if needed.
+
+    Nothing is applied when the queryset `unless` has rows; it is checked
+    inside the UPDATE statements, so it costs no extra query.
+    """
+    with transaction.atomic():
+        for (user_id, scope), delta in deltas.items():
+            if not delta:
+                continue
+            if _update(user_id, scope, delta, unless) or delta < 0:
+                # Nothing to decrement without a row (the user may be
+                # in the middle of being deleted).
+                continue
+            if unless is not None and unless.exists():
+                continue
+            try:
+                with transaction.atomic():
+                    UnreadCounter.objects.create(user_id=user_id, scope=scope, count=delta)
+            except IntegrityError:
+                # Created concurrently; apply the delta to that row.
+                _update(user_id, scope, delta)
+
+
+def _update(user_id, scope, delta, unless=None):
+    rows = UnreadCounter.objects.filter(user_id=user_id, scope=scope)
+    if unless is not None:
+        rows = rows.filter(~Exists(unless))
+    return rows.update(count=Greatest(F("count") + delta, 0))
+
+
+def get_count(user, scope=ALL):
+    return (
+        UnreadCounter.objects.filter(user=user, scope=scope)
+        .values_list("count", flat=True)
+        .first()
+    ) or 0
+
+
+def grouped_deltas(queryset, delta):
+    """
+    Counter deltas for a queryset of messages, computed with two
+    aggregate queries instead of loading the rows.
+    """
+    deltas = Counter()
+    by_sender = queryset.order_by().values("receiver_id", "sender_id").annotate(n=Count("pk"))
+    for row in by_sender:
+        deltas[(row["receiver_id"], ALL)] += row["n"] * delta
+        deltas[(row["receiver_id"], sender_scope(row["sender_id"]))] += row["n"] * delta
+    by_thread = (
+        queryset.order_by()
+        .annotate(thread=Coalesce("thread_root_id", "pk"))
+        .values("receiver_id", "thread")
+        .annotate(n=Count("pk"))
+    )
+    for row in by_thread:
+        deltas[(row["receiver_id"], thread_scope(row["thread"]))] += row["n"] * delta
+    return deltas
+
+
+def rebuild(unread_queryset, user_ids=None):
+    """
+    Recompute counters from the unread messages in `unread_queryset`.
+    Only the given users are rebuilt when `user_ids` is passed.
+    """
+    if user_ids is not None:
+        unread_queryset = unread_queryset.filter(receiver_id__in=user_ids)
+    deltas = grouped_deltas(unread_queryset, 1)
+    with transaction.atomic():
+        stale = UnreadCounter.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        stale.delete()
+        UnreadCounter.objects.bulk_create(
+            [
+                UnreadCounter(user_id=user_id, scope=scope, count=count)
+                for (user_id, scope), count in deltas.items()
+                if count
+            ],
+            batch_size=1000,
+        )
+    return len(deltas)
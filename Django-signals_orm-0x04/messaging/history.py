@@ -0,0 +1,177 @@
+"""
+Message edit history stored as reverse deltas.
+
+Versions of a message are numbered from 1 (the content as first sent)
+to Message.version (the current content). The MessageHistory row of
+version v holds a delta that turns version v + 1 into version v, so an
+edit only stores what changed and never rewrites older rows. Every
+MESSAGING_HISTORY_SNAPSHOT_INTERVAL-th row (and any row whose delta
+would not be smaller than the text) keeps the full text instead, which
+bounds the number of deltas applied to rebuild a version.
+
+A delta is a JSON list of operations on the newer text: a positive
+int copies that many characters, a negative int skips them, and a
+string is inserted.
+"""
+import json
+import re
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]", re.UNICODE)
+
+
+def snapshot_interval():
+    return getattr(settings, "MESSAGING_HISTORY_SNAPSHOT_INTERVAL", 10)
+
+
+def make_delta(source, target):
+    """Delta turning `source` into `target`, diffed word by word."""
+    source_tokens = TOKEN_RE.findall(source)
+    target_tokens = TOKEN_RE.findall(target)
+    # Most edits touch one spot: only diff what lies between the common
+    # head and tail (SequenceMatcher is quadratic in the worst case).
+    head = 0
+    limit = min(len(source_tokens), len(target_tokens))
+    while head < limit and source_tokens[head] == target_tokens[head]:
+        head += 1
+    tail = 0
+    limit -= head
+    while tail < limit and source_tokens[-1 - tail] == target_tokens[-1 - tail]:
+        tail += 1
+
+    ops = [len("".join(source_tokens[:head]))] if head else []
+    source_middle = source_tokens[head:len(source_tokens) - tail]
+    target_middle = target_tokens[head:len(target_tokens) - tail]
+    matcher = SequenceMatcher(None, source_middle, target_middle, autojunk=False)
+    ops.extend(_opcodes(matcher, source_middle, target_middle))
+    # A trailing copy of the rest of the source is implied.
+    if ops and isinstance(ops[-1], int) and ops[-1] > 0:
+        ops.pop()
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def _opcodes(matcher, source_tokens, target_tokens):
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(sum(len(token) for token in source_tokens[i1:i2]))
+            continue
+        if i2 > i1:
+            ops.append(-sum(len(token) for token in source_tokens[i1:i2]))
+        if j2 > j1:
+            ops.append("".join(target_tokens[j1:j2]))
+    return ops
+
+
+def apply_delta(source, delta):
+    """Inverse of make_delta: rebuild the target text from `source`."""
+    parts = []
+    position = 0
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(source[position:position + op])
+            position += op
+        else:
+            position -= op
+    parts.append(source[position:])
+    return "".join(parts)
+
+
+def history_row(message, old_content, new_content, edited_by_id):
+    """
+    The MessageHistory row recording an edit of `message` from
+    `old_content` to `new_content`, and bump message.version. The row is
+    not saved.
+    """
+    from .models import MessageHistory
+
+    row = MessageHistory(message=message, version=message.version, edited_by_id=edited_by_id)
+    message.version += 1
+    encode_row(row, old_content, new_content)
+    return row
+
+
+def encode_row(row, old_content, newer_content):
+    """
+    Store `old_content` (the text of version row.version) in `row`, as a
+    snapshot or as a delta from `newer_content` (the next version).
+    """
+    if (row.version - 1) % snapshot_interval() != 0:
+        delta = make_delta(newer_content, old_content)
+        if len(delta) < len(old_content):
+            row.is_snapshot = False
+            row.old_content = ""
+            row.delta = delta
+            return
+    row.is_snapshot = True
+    row.old_content = old_content
+    row.delta = ""
+
+
+def _rows_from(message, version):
+    """
+    History rows needed to rebuild `version`, newest first: from the
+    first snapshot at or above it (or from the newest row) down to it.
+    """
+    rows = message.history.filter(version__gte=version).order_by("-version")
+    fields = ("version", "is_snapshot", "old_content", "delta")
+    # With periodic snapshots the next one is less than an interval away.
+    window = list(rows.filter(version__lt=version + snapshot_interval()).values_list(*fields))
+    snapshots = [index for index, row in enumerate(window) if row[1]]
+    if snapshots:
+        return window[snapshots[-1]:]
+    if window and window[0][0] == message.version - 1:
+        return window
+    # The interval was raised since these rows were written.
+    return list(rows.values_list(*fields))
+
+
+def _walk(message, rows):
+    """Yield (version, content) for `rows` (newest first, contiguous)."""
+    content = message.content
+    expected = message.version - 1
+    for version, is_snapshot, old_content, delta in rows:
+        if is_snapshot:
+            content = old_content
+        elif version != expected:
+            raise ValueError(
+                f"History of message {message.pk} has no row for version {expected}; "
+                "run compress_message_history."
+            )
+        else:
+            content = apply_delta(content, delta)
+        expected = version - 1
+        yield version, content
+
+
+def content_at(message, version):
+    """
+    Content of `message` at `version` (1 .. message.version). At most
+    MESSAGING_HISTORY_SNAPSHOT_INTERVAL deltas are applied, from one query
+    (two if the interval was raised after the rows were written).
+    """
+    if not 1 <= version <= message.version:
+        raise ValueError(f"Message {message.pk} has no version {version}.")
+    if version == message.version:
+        return message.content
+    for found, content in _walk(message, _rows_from(message, version)):
+        if found == version:
+            return content
+    raise ValueError(f"History of message {message.pk} has no row for version {version}.")
+
+
+def all_versions(message):
+    """Every version of `message`, oldest first, as (version, content) pairs."""
+    rows = list(
+        message.history.filter(version__gt=0)
+        .order_by("-version")
+        .values_list("version", "is_snapshot", "old_content", "delta")
+    )
+    versions = [(message.version, message.content), *_walk(message, rows)]
+    versions.reverse()
+    return versions
+
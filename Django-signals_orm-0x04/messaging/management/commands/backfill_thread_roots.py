@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from messaging.models import Message
+
+
+class Command(BaseCommand):
+    help = "Fill Message.thread_root for replies saved before the column existed."
+
+    def handle(self, *args, **options):
+        parent_root = Subquery(
+            Message.objects.filter(pk=OuterRef("parent_message"))
+            .values(root=Coalesce("thread_root", "pk"))[:1]
+        )
+        total = 0
+        # Each pass resolves one more level of nesting with a single UPDATE.
+        while True:
+            updated = (
+                Message.objects.filter(
+                    parent_message__isnull=False,
+                    thread_root__isnull=True,
+                )
+                .filter(
+                    Q(parent_message__parent_message__isnull=True)
+                    | Q(parent_message__thread_root__isnull=False)
+                )
+                .update(thread_root=parent_root)
+            )
+            if not updated:
+                break
+            total += updated
+        self.stdout.write(self.style.SUCCESS(f"Updated {total} replies."))
@@ -0,0 +1,137 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Length
+from django.test.utils import CaptureQueriesContext
+
+from messaging.history import snapshot_interval
+from messaging.models import Message, MessageHistory
+
+from .benchmark_views import percentile
+
+User = get_user_model()
+
+WORDS = (
+    "the meeting moved to friday please bring the report and the updated "
+    "numbers we still need a room for lunch ok thanks see you there soon"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure MessageHistory storage (deltas and snapshots against full "
+        "copies of every version) and the time to rebuild versions. Works on "
+        "generated messages inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--edits", type=int, default=30, help="Edits per message.")
+        parser.add_argument("--words", type=int, default=150, help="Words per message.")
+        parser.add_argument("--samples", type=int, default=500, help="Versions rebuilt for the timings.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            results = self.run(rng, options)
+            transaction.set_rollback(True)
+        self.report(results)
+
+    def run(self, rng, options):
+        sender = User.objects.create(username="history-bench-sender")
+        receiver = User.objects.create(username="history-bench-receiver")
+        texts = [" ".join(rng.choices(WORDS, k=options["words"])) for _ in range(options["messages"])]
+        messages = Message.objects.bulk_send(
+            [Message(sender=sender, receiver=receiver, content=text) for text in texts]
+        )
+        # versions[i][v - 1] is the content of messages[i] at version v.
+        versions = [[text] for text in texts]
+
+        started = time.perf_counter()
+        for _ in range(options["edits"]):
+            edits = []
+            for message, history in zip(messages, versions):
+                new_content = edit(rng, message.content)
+                if new_content == message.content:
+                    continue
+                history.append(new_content)
+                edits.append((message, new_content))
+            Message.objects.bulk_edit(edits)
+        write_ms = (time.perf_counter() - started) * 1000
+
+        full = sum(len(text) for history in versions for text in history[:-1])
+        totals = MessageHistory.objects.filter(message__in=messages).aggregate(
+            rows=Count("pk"),
+            snapshots=Count("pk", filter=Q(is_snapshot=True)),
+            text=Sum(Length("old_content")),
+            delta=Sum(Length("delta")),
+        )
+
+        timings = []
+        queries = 0
+        for _ in range(options["samples"]):
+            index = rng.randrange(len(messages))
+            message = messages[index]
+            version = rng.randint(1, message.version)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                content = message.content_at(version)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(captured))
+            if content != versions[index][version - 1]:
+                raise CommandError(f"Message {message.pk} version {version} was rebuilt wrongly.")
+
+        all_timings = []
+        for message in messages[: min(50, len(messages))]:
+            started = time.perf_counter()
+            message.versions()
+            all_timings.append((time.perf_counter() - started) * 1000)
+
+        return {
+            "edits": sum(len(history) - 1 for history in versions),
+            "write_ms": write_ms,
+            "full": full,
+            "stored": (totals["text"] or 0) + (totals["delta"] or 0),
+            "rows": totals["rows"],
+            "snapshots": totals["snapshots"],
+            "timings": timings,
+            "queries": queries,
+            "all_timings": all_timings,
+        }
+
+    def report(self, r):
+        write = self.stdout.write
+        write(f"{r['edits']} edits, snapshot interval {snapshot_interval()}")
+        write(f"  write time          {r['write_ms'] / r['edits']:.3f} ms per edit (bulk_edit)")
+        write(f"  full copies         {r['full']} chars")
+        write(
+            f"  stored              {r['stored']} chars ({100 * r['stored'] / r['full']:.1f}%), "
+            f"{r['snapshots']} of {r['rows']} rows are snapshots"
+        )
+        write(
+            f"  content_at          p50 {percentile(r['timings'], 50):.3f} ms, "
+            f"p99 {percentile(r['timings'], 99):.3f} ms, {r['queries']} query"
+        )
+        write(
+            f"  versions()          p50 {percentile(r['all_timings'], 50):.3f} ms, "
+            f"p99 {percentile(r['all_timings'], 99):.3f} ms"
+        )
+
+
+def edit(rng, content):
+    """A typical edit: fix a word, add a sentence or drop a few words."""
+    words = content.split(" ")
+    kind = rng.random()
+    if kind < 0.6:
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    elif kind < 0.85 or len(words) < 10:
+        words.extend(rng.choices(WORDS, k=rng.randint(3, 12)))
+    else:
+        start = rng.randrange(len(words) - 5)
+        del words[start:start + rng.randint(1, 5)]
+    return " ".join(words)
@@ -0,0 +1,124 @@
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from messaging import threads
+from messaging.models import Message
+
+User = get_user_model()
+
+# Maximum queries per view. Any growth is a regression (usually an N+1).
+QUERY_BUDGETS = {
+    "conversation_thread": 2,
+    "unread_inbox": 1,
+    "unread_count": 1,
+    "conversation_list": 1,
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the data work of the messaging views (latency, queries, "
+        "memory). Seed data first with seed_threads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, help="User to benchmark as (default: busiest receiver).")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument(
+            "--no-budgets", action="store_true",
+            help="Report query counts without failing on budget overruns.",
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user_id"])
+        other = (
+            Message.objects.filter(receiver=user, parent_message__isnull=True)
+            .values("sender__username")
+            .annotate(n=Count("pk"))
+            .order_by("-n")
+            .first()
+        )
+        if other is None:
+            raise CommandError("The user has no conversations; run seed_threads first.")
+        other_username = other["sender__username"]
+
+        # What each view does before rendering its template.
+        scenarios = {
+            "conversation_thread": lambda: threads.fetch_conversation_threads(
+                user, User.objects.get(username=other_username)
+            ),
+            "unread_inbox": lambda: list(
+                Message.unread.unread_for_user(user).only(
+                    "id", "sender", "receiver", "content", "timestamp"
+                )
+            ),
+            "unread_count": lambda: Message.unread.count_for_user(user),
+            "conversation_list": lambda: list(
+                Message.objects.filter(receiver=user)
+                .select_related("sender")
+                .only("id", "sender", "content", "timestamp")
+                .order_by("-timestamp")[:50]
+            ),
+        }
+
+        failures = []
+        self.stdout.write(f"User #{user.pk} ({user.get_username()}), other user {other_username}")
+        self.stdout.write(f'{"view":<22}{"p50 ms":>9}{"p99 ms":>9}{"queries":>9}{"peak KB":>10}')
+        for name, run in scenarios.items():
+            timings, queries, peak = self.measure(run, options["iterations"])
+            line = (
+                f"{name:<22}{percentile(timings, 50):>9.2f}{percentile(timings, 99):>9.2f}"
+                f"{queries:>9}{peak / 1024:>10.1f}"
+            )
+            budget = QUERY_BUDGETS[name]
+            if queries > budget:
+                failures.append(f"{name}: {queries} queries (budget {budget})")
+                line = self.style.ERROR(line + f"  > budget {budget}")
+            self.stdout.write(line)
+
+        if failures and not options["no_budgets"]:
+            raise CommandError("Query budget exceeded:\n  " + "\n  ".join(failures))
+
+    def get_user(self, user_id):
+        users = User.objects.all()
+        if user_id is not None:
+            users = users.filter(pk=user_id)
+        else:
+            users = users.annotate(n=Count("received_messages")).filter(n__gt=0).order_by("-n", "pk")
+        user = users.first()
+        if user is None:
+            raise CommandError("No user with messages found; run seed_threads first.")
+        return user
+
+    def measure(self, run, iterations):
+        run()  # warm up
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(captured))
+
+        # Measured separately: tracemalloc would skew the timings above.
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return timings, queries, peak
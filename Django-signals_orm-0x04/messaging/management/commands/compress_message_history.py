@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from messaging.history import apply_delta, encode_row
+from messaging.models import Message, MessageHistory
+
+
+def stored_chars():
+    totals = MessageHistory.objects.aggregate(
+        text=Sum(Length("old_content")), delta=Sum(Length("delta"))
+    )
+    return (totals["text"] or 0) + (totals["delta"] or 0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert MessageHistory rows written with the full old text (version 0) "
+        "into numbered versions stored as deltas and snapshots, and set "
+        "Message.version. Safe to run again; --all re-encodes every history, "
+        "e.g. after changing MESSAGING_HISTORY_SNAPSHOT_INTERVAL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Messages converted per transaction.")
+        parser.add_argument("--all", action="store_true", help="Re-encode histories that are already converted.")
+
+    def handle(self, *args, **options):
+        rows = MessageHistory.objects.all() if options["all"] else MessageHistory.objects.filter(version=0)
+        message_ids = sorted(set(rows.values_list("message_id", flat=True)))
+        before = stored_chars()
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(message_ids), batch_size):
+            self.convert(message_ids[start:start + batch_size])
+
+        after = stored_chars()
+        saved = f" ({100 * (1 - after / before):.1f}% saved)" if before else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted the history of {len(message_ids)} messages: "
+            f"{before} -> {after} stored characters{saved}."
+        ))
+
+    @transaction.atomic
+    def convert(self, message_ids):
+        messages = {
+            m.pk: m
+            for m in Message.objects.select_for_update().filter(pk__in=message_ids).only("id", "content", "version")
+        }
+        histories = {pk: [] for pk in messages}
+        for row in MessageHistory.objects.filter(message_id__in=messages).order_by("message_id", "-version"):
+            histories[row.message_id].append(row)
+
+        changed = []
+        for pk, message in messages.items():
+            rows = histories[pk]
+            # Full text of every row. Versioned rows (newest first) are
+            # rebuilt from the current content; legacy rows hold the text.
+            texts = {}
+            content = message.content
+            for row in rows:
+                if row.version == 0 or row.is_snapshot:
+                    content = row.old_content
+                else:
+                    content = apply_delta(content, row.delta)
+                texts[row.pk] = content
+
+            rows.sort(key=lambda row: (row.edited_at, row.pk))
+            newer = [texts[row.pk] for row in rows[1:]] + [message.content]
+            for version, (row, newer_content) in enumerate(zip(rows, newer), start=1):
+                row.version = version
+                encode_row(row, texts[row.pk], newer_content)
+            message.version = len(rows) + 1
+            changed.extend(rows)
+
+        # Free the version numbers first: the rows are renumbered in place.
+        MessageHistory.objects.filter(message_id__in=messages).update(version=0)
+        MessageHistory.objects.bulk_update(
+            changed, ["version", "is_snapshot", "old_content", "delta"], batch_size=500
+        )
+        Message.objects.bulk_update(messages.values(), ["version"], batch_size=500)
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from messaging.models import Message, UnreadCounter
+
+User = get_user_model()
+
+# Plan fragments that mean the query is not served by an index.
+WARNING_MARKERS = ("SCAN messaging_", "USE TEMP B-TREE", "Seq Scan")
+
+
+class Command(BaseCommand):
+    help = "Print the query plan of each hot messaging queryset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, help="User to build the querysets for.")
+        parser.add_argument(
+            "--strict", action="store_true",
+            help="Exit with an error if any plan scans a table or sorts in a temp B-tree.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        if options["user_id"] is not None:
+            users = users.filter(pk=options["user_id"])
+        user = users.first()
+        other = User.objects.exclude(pk=getattr(user, "pk", None)).order_by("pk").first()
+        if user is None or other is None:
+            raise CommandError("Seed at least two users first.")
+
+        roots = Message.objects.filter(
+            Q(sender=user, receiver=other) | Q(sender=other, receiver=user),
+            parent_message__isnull=True,
+        ).values("pk")
+        querysets = {
+            "unread_inbox": Message.unread.unread_for_user(user).only(
+                "id", "sender", "receiver", "content", "timestamp"
+            ),
+            "conversation_thread roots": roots.order_by("timestamp"),
+            "conversation_thread messages": Message.objects.filter(
+                Q(pk__in=roots) | Q(thread_root__in=roots)
+            ).order_by("timestamp", "pk"),
+            "conversation_list": Message.objects.filter(receiver=user)
+            .only("id", "sender", "content", "timestamp")
+            .order_by("-timestamp")[:50],
+            "unread counter": UnreadCounter.objects.filter(user=user, scope="all"),
+        }
+
+        warnings = 0
+        for label, queryset in querysets.items():
+            plan = queryset.explain()
+            flagged = [line for line in plan.splitlines() if any(m in line for m in WARNING_MARKERS)]
+            warnings += len(flagged)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(plan)
+            for line in flagged:
+                self.stdout.write(self.style.WARNING(f"  not index-backed: {line.strip()}"))
+            self.stdout.write("")
+
+        if warnings and options["strict"]:
+            raise CommandError(f"{warnings} plan steps are not backed by an index.")
+        self.stdout.write(self.style.SUCCESS(f"Checked {len(querysets)} querysets, {warnings} warnings."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from messaging.models import AccountDeletion
+from messaging.purge import DEFAULT_BATCH_SIZE, purge_account
+
+
+class Command(BaseCommand):
+    help = "Purge the data of deactivated accounts in primary-key batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--user-id", type=int, help="Only purge this user.")
+
+    def handle(self, *args, **options):
+        pending = AccountDeletion.objects.filter(completed_at__isnull=True)
+        if options["user_id"] is not None:
+            pending = pending.filter(user_id=options["user_id"])
+
+        for deletion in pending:
+            self.stdout.write(f"Purging user {deletion.user_id}...")
+
+            def progress(field, total, user_id=deletion.user_id):
+                self.stdout.write(f"  user {user_id}: {field}={total}")
+
+            purge_account(deletion, batch_size=options["batch_size"], progress=progress)
+            self.stdout.write(self.style.SUCCESS(
+                f"User {deletion.user_id} purged: "
+                f"{deletion.messages_deleted} messages, "
+                f"{deletion.notifications_deleted} notifications, "
+                f"{deletion.histories_deleted} histories."
+            ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from messaging import counters
+from messaging.models import Message
+
+
+class Command(BaseCommand):
+    help = "Rebuild UnreadCounter rows from the unread messages themselves."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user-id", type=int, action="append", dest="user_ids",
+            help="Only rebuild these users (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        rebuilt = counters.rebuild(Message.unread.all(), user_ids=options["user_ids"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} counters."))
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+
+from messaging.models import Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Seed users and threaded conversations (bulk inserts) for benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--threads", type=int, default=10000, help="Top-level messages.")
+        parser.add_argument("--replies", type=int, default=10, help="Replies per thread.")
+        parser.add_argument("--unread", type=float, default=0.3, help="Share of unread messages.")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=42, help="Random seed, for reproducible data.")
+        parser.add_argument("--prefix", default="bench", help="Username prefix.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        started = time.perf_counter()
+        prefix = options["prefix"]
+        # One hash for everyone: hashing per user would dominate seeding time.
+        password = make_password("bench-password")
+        User.objects.bulk_create(
+            [User(username=f"{prefix}{i}", password=password) for i in range(options["users"])],
+            ignore_conflicts=True,
+        )
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list("pk", flat=True))
+        if len(user_ids) < 2:
+            self.stderr.write("Need at least two users.")
+            return
+
+        total = 0
+        batch_size = options["batch_size"]
+        for first in range(0, options["threads"], batch_size):
+            count = min(batch_size, options["threads"] - first)
+            pairs = [tuple(rng.sample(user_ids, 2)) for _ in range(count)]
+            roots = Message.objects.bulk_send(
+                [self.message(rng, a, b, first + i, options["unread"]) for i, (a, b) in enumerate(pairs)],
+                batch_size=batch_size,
+            )
+            # Each thread keeps the messages it has so far; every round adds
+            # one reply per thread to a random earlier message of it.
+            threads = [[root] for root in roots]
+            for _ in range(options["replies"]):
+                replies = []
+                for thread in threads:
+                    parent = rng.choice(thread)
+                    reply = self.message(
+                        rng, parent.receiver_id, parent.sender_id, total, options["unread"]
+                    )
+                    reply.parent_message = parent
+                    replies.append(reply)
+                Message.objects.bulk_send(replies, batch_size=batch_size)
+                for thread, reply in zip(threads, replies):
+                    thread.append(reply)
+            total += sum(len(thread) for thread in threads)
+            self.stdout.write(f"  {total} messages", ending="\r")
+
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} messages in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def message(self, rng, sender_id, receiver_id, number, unread):
+        return Message(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=f"message {number}",
+            read=rng.random() >= unread,
+        )
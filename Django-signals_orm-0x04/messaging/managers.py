@@ -1,4 +1,107 @@
-from django.db import models
+from django.db import models, transaction
+
+
+class MessageManager(models.Manager):
+    """
+    Default manager for Message with bulk helpers.
+    """
+
+    def bulk_send(self, messages, batch_size=500):
+        """
+        Insert many new messages and their notifications.
+
+        bulk_create does not fire post_save, so the notification for each
+        receiver (and the thread_root of each reply) is filled in here.
+        Messages and notifications are inserted in batches inside one
+        transaction: either every message gets its notification or
+        nothing is written. Return the saved messages.
+        """
+        from . import cache, counters
+        from .models import Notification
+
+        messages = list(messages)
+        parent_ids = {
+            m.parent_message_id for m in messages
+            if m.parent_message_id and not m.thread_root_id
+        }
+        if parent_ids:
+            roots = dict(
+                self.filter(pk__in=parent_ids).order_by().values_list("pk", "thread_root")
+            )
+            for message in messages:
+                if message.parent_message_id in roots and not message.thread_root_id:
+                    parent_id = message.parent_message_id
+                    message.thread_root_id = roots[parent_id] or parent_id
+
+        with transaction.atomic(using=self.db):
+            self.bulk_create(messages, batch_size=batch_size)
+            Notification.objects.bulk_create(
+                [Notification(user_id=m.receiver_id, message=m) for m in messages],
+                batch_size=batch_size,
+            )
+            counters.apply_deltas(counters.deltas_for([m for m in messages if not m.read], 1))
+
+        cache.bump_for_messages((m.sender_id, m.receiver_id) for m in messages)
+
+        for message in messages:
+            message.remember_loaded_values()
+        return messages
+
+    def bulk_edit(self, edits, edited_by=None, batch_size=500):
+        """
+        Apply many edits at once.
+
+        `edits` is an iterable of (message, new_content) pairs. The old
+        contents and versions are read from the message rows, locked for
+        the transaction, so edits saved meanwhile through other instances
+        are kept. History rows are written with one bulk_create and
+        messages with one bulk_update. Unchanged messages are skipped.
+        Return the number of edited messages.
+        """
+        from . import cache
+        from .history import history_row
+        from .models import MessageHistory
+
+        edits = list(edits)
+        pks = list({message.pk for message, _ in edits})
+        histories = []
+        changed = {}
+        with transaction.atomic(using=self.db):
+            stored = {}
+            for start in range(0, len(pks), batch_size):
+                rows = (
+                    self.select_for_update()
+                    .filter(pk__in=pks[start:start + batch_size])
+                    .values_list("pk", "content", "version")
+                )
+                stored.update((pk, [content, version]) for pk, content, version in rows)
+
+            for message, new_content in edits:
+                current = stored.get(message.pk)
+                if current is None or current[0] == new_content:
+                    continue
+                old_content, message.version = current
+                histories.append(
+                    history_row(
+                        message,
+                        old_content,
+                        new_content,
+                        edited_by_id=edited_by.pk if edited_by else message.sender_id,
+                    )
+                )
+                message.content = new_content
+                message.edited = True
+                current[:] = [new_content, message.version]
+                changed[message.pk] = message
+
+            changed = list(changed.values())
+            MessageHistory.objects.bulk_create(histories, batch_size=batch_size)
+            self.bulk_update(changed, ["content", "edited", "version"], batch_size=batch_size)
+
+        for message in changed:
+            message.remember_loaded_values()
+        cache.bump_for_messages((m.sender_id, m.receiver_id) for m in changed)
+        return len(changed)
 
 
 class UnreadMessagesManager(models.Manager):
@@ -7,11 +110,47 @@ class UnreadMessagesManager(models.Manager):
     """
 
     def get_queryset(self):
-        # Base queryset: unread messages only
-        return super().get_queryset().filter(read=False)
+        # Base queryset: unread messages only (read flag and read watermark)
+        from .readstate import unread_q
+
+        return super().get_queryset().filter(unread_q())
 
     def unread_for_user(self, user):
         """
         Return unread messages for a specific user.
         """
         return self.get_queryset().filter(receiver=user)
+
+    for_user = unread_for_user
+
+    def count_for_user(self, user, sender=None, thread=None):
+        """
+        Number of unread messages of a user, read from UnreadCounter
+        (no scan of the Message table). Optionally restricted to one
+        sender or one thread (id of the thread's top-level message).
+        """
+        from . import counters
+
+        if sender is not None:
+            scope = counters.sender_scope(getattr(sender, "pk", sender))
+        elif thread is not None:
+            scope = counters.thread_scope(getattr(thread, "pk", thread))
+        else:
+            scope = counters.ALL
+        return counters.get_count(user, scope)
+
+    def mark_read(self, queryset):
+        """
+        Mark the unread messages of `queryset` as read with one UPDATE and
+        adjust the unread counters accordingly. Return the number of rows.
+        """
+        from . import cache, counters
+        from .readstate import unread_q
+
+        unread = queryset.filter(unread_q())
+        with transaction.atomic(using=self.db):
+            deltas = counters.grouped_deltas(unread, -1)
+            updated = unread.update(read=True)
+            counters.apply_deltas(deltas)
+        cache.bump_for_messages(counters.sender_receiver_pairs(deltas))
+        return updated
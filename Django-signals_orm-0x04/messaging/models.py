@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
 
-from .managers import UnreadMessagesManager  # 👈 مهم
+from .managers import MessageManager, UnreadMessagesManager  # 👈 مهم
 
 User = get_user_model()
 
@@ -29,17 +29,99 @@ class Message(models.Model):
         related_name="replies",
         help_text="Parent message if this is a reply in a thread.",
     )
+    thread_root = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="thread_messages",
+        help_text="Top-level message of the thread this reply belongs to.",
+    )
+    version = models.PositiveIntegerField(
+        default=1,
+        help_text="Number of the current content version (1 until the first edit).",
+    )
 
     # managers
-    objects = models.Manager()
+    objects = MessageManager()
     unread = UnreadMessagesManager()  # 👈 custom manager
 
+    # Fields whose loaded values are remembered, so edits can be detected
+    # on save without reading the row again.
+    tracked_fields = ("content", "read")
+
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            # unread_inbox / UnreadMessagesManager: receiver + read=False
+            models.Index(
+                fields=["receiver", "timestamp"],
+                condition=models.Q(read=False),
+                name="msg_unread_receiver_idx",
+            ),
+            # conversation_thread: top-level messages of a sender/receiver pair
+            models.Index(
+                fields=["sender", "receiver", "timestamp"],
+                condition=models.Q(parent_message__isnull=True),
+                name="msg_pair_toplevel_idx",
+            ),
+            # conversation_list: newest messages received by a user
+            models.Index(fields=["receiver", "-timestamp"], name="msg_receiver_recent_idx"),
+            # messaging.threads: every message of a thread in order
+            models.Index(fields=["thread_root", "timestamp"], name="msg_thread_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"Message from {self.sender} to {self.receiver} at {self.timestamp}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value
+            for name, value in zip(field_names, values)
+            if name in cls.tracked_fields
+        }
+        return instance
+
+    def remember_loaded_values(self, fields=None):
+        """Record the current values of tracked fields as saved ones."""
+        loaded = getattr(self, "_loaded_values", {})
+        for name in self.tracked_fields:
+            # Skip deferred fields and fields the last save did not write.
+            if name in self.__dict__ and (fields is None or name in fields):
+                loaded[name] = self.__dict__[name]
+        self._loaded_values = loaded
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # The reloaded values are the baseline for the next edit.
+        self.remember_loaded_values(fields)
+
+    def save(self, *args, **kwargs):
+        # An edit flips `edited` and bumps `version`, so they have to be
+        # written along with content.
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "edited", "version"}
+        # The pre_save/post_save handlers (history rows, unread counters)
+        # write in the same transaction as the message row.
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+    def content_at(self, version):
+        """Content of this message at `version` (see messaging.history)."""
+        from .history import content_at
+
+        return content_at(self, version)
+
+    def versions(self):
+        """Every (version, content) of this message, oldest first."""
+        from .history import all_versions
+
+        return all_versions(self)
+
 
 class Notification(models.Model):
     user = models.ForeignKey(
@@ -63,12 +145,24 @@ class Notification(models.Model):
 
 
 class MessageHistory(models.Model):
+    """
+    The content a message had before one edit (version `version`).
+
+    Snapshot rows keep the full text in old_content; the others keep a
+    delta from the next version in `delta` (see messaging.history).
+    Rows written before deltas have version 0 until
+    compress_message_history converts them.
+    """
+
     message = models.ForeignKey(
         Message,
         on_delete=models.CASCADE,
         related_name="history",
     )
-    old_content = models.TextField()
+    version = models.PositiveIntegerField(default=0)
+    is_snapshot = models.BooleanField(default=True)
+    old_content = models.TextField(blank=True)
+    delta = models.TextField(blank=True)
     edited_at = models.DateTimeField(auto_now_add=True)
     edited_by = models.ForeignKey(
         User,
@@ -80,6 +174,96 @@ class MessageHistory(models.Model):
 
     class Meta:
         ordering = ["-edited_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["message", "version"],
+                condition=models.Q(version__gt=0),
+                name="unique_message_history_version",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"History for message {self.message_id} at {self.edited_at}"
+
+
+class AccountDeletion(models.Model):
+    """
+    A pending (or finished) purge of a deleted account.
+
+    The user is only soft-marked (is_active=False) when they ask to be
+    deleted; their messages, notifications and histories are then removed
+    in batches by messaging.purge, which records its progress here.
+    """
+
+    user_id = models.BigIntegerField(unique=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    histories_deleted = models.PositiveIntegerField(default=0)
+    notifications_deleted = models.PositiveIntegerField(default=0)
+    messages_deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["requested_at"]
+
+    def __str__(self) -> str:
+        state = "done" if self.completed_at else "pending"
+        return f"Deletion of user {self.user_id} ({state})"
+
+
+class UnreadCounter(models.Model):
+    """
+    Denormalized number of unread messages of a user.
+
+    `scope` is "all" for the user's total, "sender:<user id>" per sender
+    and "thread:<root message id>" per thread. Rows are kept up to date by
+    messaging.counters and can be rebuilt with reconcile_unread_counters.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="unread_counters",
+    )
+    scope = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "scope"], name="unique_unread_counter"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} {self.scope}: {self.count}"
+
+
+class ReadWatermark(models.Model):
+    """
+    How far `user` has read their conversation with `peer`.
+
+    Every message from `peer` to `user` with an id up to
+    `last_read_message_id` counts as read, whatever its `read` flag says,
+    so marking a conversation read is one row write instead of one per
+    message (see messaging.readstate).
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="read_watermarks",
+    )
+    peer = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "peer"], name="unique_read_watermark"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} read {self.peer_id} up to {self.last_read_message_id}"
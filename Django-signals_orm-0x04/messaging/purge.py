@@ -0,0 +1,127 @@
+"""
+Account deletion pipeline.
+
+Deleting a user with a lot of messages in one ORM call makes the
+cascade collector load every related row into memory and hold locks for
+the whole time. Instead, the account is soft-marked first and the
+related rows are deleted in fixed-size primary-key batches, either from
+a background thread (started by the delete_user view) or from the
+`purge_deleted_users` management command.
+"""
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AccountDeletion, Message, MessageHistory, Notification
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def request_account_deletion(user):
+    """Deactivate the account and queue it for purging."""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        deletion, _ = AccountDeletion.objects.get_or_create(user_id=user.pk)
+    return deletion
+
+
+def _purge_steps(user_id):
+    """(counter field, queryset) pairs, dependents before the messages."""
+    user_messages = Q(message__sender_id=user_id) | Q(message__receiver_id=user_id)
+    return [
+        (
+            "histories_deleted",
+            MessageHistory.objects.filter(Q(edited_by_id=user_id) | user_messages),
+        ),
+        (
+            "notifications_deleted",
+            Notification.objects.filter(Q(user_id=user_id) | user_messages),
+        ),
+        (
+            "messages_deleted",
+            Message.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id)),
+        ),
+    ]
+
+
+def delete_in_batches(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete the rows of `queryset` in primary-key batches, newest first
+    (so replies go before the messages they answer). Yield the number of
+    rows removed by each batch.
+    """
+    model = queryset.model
+    while True:
+        ids = list(queryset.order_by("-pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic():
+            model.objects.filter(pk__in=ids).delete()
+        yield len(ids)
+
+
+def purge_related_data(user_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete the user's histories, notifications and messages in batches."""
+    for _, queryset in _purge_steps(user_id):
+        for _ in delete_in_batches(queryset, batch_size):
+            pass
+
+
+def purge_account(deletion, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Purge everything belonging to `deletion.user_id`, then the user itself.
+
+    Progress is saved on the AccountDeletion row after every batch and
+    reported to `progress(field, total)` if given, so an interrupted purge
+    can simply be run again.
+    """
+    AccountDeletion.objects.filter(pk=deletion.pk, started_at__isnull=True).update(
+        started_at=timezone.now()
+    )
+    for field, queryset in _purge_steps(deletion.user_id):
+        for deleted in delete_in_batches(queryset, batch_size):
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                **{field: F(field) + deleted}
+            )
+            setattr(deletion, field, getattr(deletion, field) + deleted)
+            if progress is not None:
+                progress(field, getattr(deletion, field))
+
+    # Nothing is left to cascade, so this delete is cheap.
+    User.objects.filter(pk=deletion.user_id).delete()
+    deletion.completed_at = timezone.now()
+    AccountDeletion.objects.filter(pk=deletion.pk).update(completed_at=deletion.completed_at)
+    return deletion
+
+
+def start_background_purge(deletion_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Run purge_account on a daemon thread with its own DB connection."""
+
+    def run():
+        close_old_connections()
+        try:
+            deletion = AccountDeletion.objects.get(pk=deletion_id)
+            purge_account(deletion, batch_size=batch_size)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name=f"purge-user-{deletion_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def schedule_purge(deletion):
+    """
+    Start the purge once the current transaction commits, unless
+    MESSAGING_PURGE_IN_BACKGROUND is False (then the
+    purge_deleted_users command is expected to pick it up).
+    """
+    if getattr(settings, "MESSAGING_PURGE_IN_BACKGROUND", True):
+        transaction.on_commit(lambda: start_background_purge(deletion.pk))
@@ -0,0 +1,87 @@
+"""
+Read state as one watermark per (user, peer) conversation.
+
+A message is unread when its `read` flag is False and its id is above
+the receiver's ReadWatermark for the sender. Marking a conversation read
+moves the watermark instead of rewriting every Message and Notification
+row; the per-message `read` flag keeps working for single messages.
+"""
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Message, Notification, ReadWatermark
+
+
+def watermark(user_ref, peer_ref):
+    """Watermark of (user_ref, peer_ref) as an expression, 0 without one."""
+    return Coalesce(
+        Subquery(
+            ReadWatermark.objects.filter(user=user_ref, peer=peer_ref).values(
+                "last_read_message_id"
+            )[:1]
+        ),
+        0,
+    )
+
+
+def unread_q():
+    """Filter for the unread rows of a Message queryset."""
+    return Q(read=False) & Q(pk__gt=watermark(OuterRef("receiver"), OuterRef("sender")))
+
+
+def get_watermark(user, peer):
+    return (
+        ReadWatermark.objects.filter(user=user, peer=peer)
+        .values_list("last_read_message_id", flat=True)
+        .first()
+    ) or 0
+
+
+def covering_watermark(message):
+    """The watermark row that marks `message` read, if there is one (a queryset)."""
+    return ReadWatermark.objects.filter(
+        user_id=message.receiver_id,
+        peer_id=message.sender_id,
+        last_read_message_id__gte=message.pk,
+    )
+
+
+def mark_read_up_to(user, peer, message_id):
+    """
+    Mark everything `peer` sent to `user` up to `message_id` as read.
+
+    Writes the watermark row and adjusts the unread counters for the
+    messages it newly covers; no message or notification row is touched.
+    The watermark never moves backwards. Return the watermark.
+    """
+    from . import cache, counters
+
+    with transaction.atomic():
+        mark, _ = ReadWatermark.objects.select_for_update().get_or_create(user=user, peer=peer)
+        if message_id <= mark.last_read_message_id:
+            return mark
+        covered = Message.objects.filter(
+            receiver=user,
+            sender=peer,
+            read=False,
+            pk__gt=mark.last_read_message_id,
+            pk__lte=message_id,
+        )
+        deltas = counters.grouped_deltas(covered, -1)
+        mark.last_read_message_id = message_id
+        mark.last_read_at = timezone.now()
+        mark.save(update_fields=["last_read_message_id", "last_read_at"])
+        counters.apply_deltas(deltas)
+    cache.bump_for_messages([(getattr(peer, "pk", peer), getattr(user, "pk", user))])
+    return mark
+
+
+def unread_notifications(user):
+    """Unread notifications of `user`, watermark included."""
+    return Notification.objects.filter(
+        user=user,
+        is_read=False,
+        message_id__gt=watermark(OuterRef("user"), OuterRef("message__sender")),
+    )
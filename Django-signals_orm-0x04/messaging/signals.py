@@ -2,7 +2,9 @@ from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
-from .models import Message, Notification, MessageHistory
+from . import cache, counters, history, readstate
+from .models import Message, Notification
+from .purge import purge_related_data
 
 User = get_user_model()
 
@@ -15,40 +17,109 @@ def create_notification_for_new_message(sender, instance, created, **kwargs):
 
 
 @receiver(pre_save, sender=Message)
-def log_message_edits(sender, instance, **kwargs):
-    """Before saving an edited message, store the old content in MessageHistory."""
+def set_thread_root(sender, instance, **kwargs):
+    """Store the top-level message of the thread on every reply."""
+    if instance.parent_message_id and not instance.thread_root_id:
+        parent = instance.parent_message
+        instance.thread_root_id = parent.thread_root_id or parent.pk
+
+
+@receiver(pre_save, sender=Message)
+def log_message_edits(sender, instance, update_fields=None, **kwargs):
+    """Before saving an edited message, record the old content in MessageHistory.
+
+    A save whose content equals the value remembered when the message was
+    loaded (Message.from_db) is not an edit and runs no extra query. For
+    an edit, the old content and the version come from the message row,
+    locked until the save commits (Message.save is atomic), so two stale
+    instances editing the same message get successive versions.
+    """
     # Only run on updates (existing messages)
     if not instance.pk:
         return
+    if update_fields is not None and "content" not in update_fields:
+        return
 
-    try:
-        old_instance = Message.objects.get(pk=instance.pk)
-    except Message.DoesNotExist:
+    loaded = getattr(instance, "_loaded_values", {})
+    if "content" in loaded and loaded["content"] == instance.content:
+        return
+    stored = (
+        Message.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list("content", "version")
+        .first()
+    )
+    if stored is None:
         return
+    old_content, instance.version = stored
 
     # If content changed, store old content in history and mark as edited
-    if old_instance.content != instance.content:
-        MessageHistory.objects.create(
-            message=old_instance,
-            old_content=old_instance.content,
-            edited_by=instance.sender,
-        )
+    if old_content != instance.content:
+        history.history_row(
+            instance, old_content, instance.content, edited_by_id=instance.sender_id
+        ).save()
         instance.edited = True
 
 
+@receiver(pre_save, sender=Message)
+def capture_read_state(sender, instance, update_fields=None, **kwargs):
+    """Remember whether an existing message was unread before this save."""
+    instance._was_read = None
+    if not instance.pk or (update_fields is not None and "read" not in update_fields):
+        return
+    loaded = getattr(instance, "_loaded_values", {})
+    if "read" in loaded:
+        instance._was_read = loaded["read"]
+    else:
+        instance._was_read = (
+            Message.objects.filter(pk=instance.pk).values_list("read", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Message)
+def update_unread_counters(sender, instance, created, **kwargs):
+    """Count new unread messages and read/unread flips in UnreadCounter."""
+    if created:
+        delta = 0 if instance.read else 1
+    elif instance._was_read is None or instance._was_read == instance.read:
+        delta = 0
+    else:
+        delta = -1 if instance.read else 1
+    if delta:
+        # A message under the conversation's read watermark already counts
+        # as read, so flipping its flag changes nothing.
+        unless = None if created else readstate.covering_watermark(instance)
+        counters.apply_deltas(counters.deltas_for([instance], delta), unless=unless)
+
+
+@receiver(post_delete, sender=Message)
+def forget_deleted_unread_message(sender, instance, **kwargs):
+    if not instance.read:
+        counters.apply_deltas(
+            counters.deltas_for([instance], -1), unless=readstate.covering_watermark(instance)
+        )
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_cached_pages(sender, instance, **kwargs):
+    """Bump the cache versions of both users and of their conversation."""
+    cache.bump_for_messages([(instance.sender_id, instance.receiver_id)])
+
+
+@receiver(post_save, sender=Message)
+def remember_saved_values(sender, instance, update_fields=None, **kwargs):
+    """The saved values become the baseline for the next edit."""
+    instance.remember_loaded_values(update_fields)
+
+
 @receiver(post_delete, sender=User)
 def cleanup_user_related_data(sender, instance, **kwargs):
     """Delete messages, notifications, and message histories of a deleted user.
 
     We still keep this logic explicit even if on_delete behavior already
-    cascades some of it, to match project requirements.
+    cascades some of it, to match project requirements. The deletes run
+    in primary-key batches (see messaging.purge), so leftovers never load
+    unbounded querysets.
     """
-    # Delete messages where the user is sender or receiver
-    Message.objects.filter(sender=instance).delete()
-    Message.objects.filter(receiver=instance).delete()
-
-    # Delete notifications for the user
-    Notification.objects.filter(user=instance).delete()
-
-    # Delete histories they created as editor
-    MessageHistory.objects.filter(edited_by=instance).delete()
+    purge_related_data(instance.pk)
@@ -1,10 +1,33 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache as django_cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 
-from .models import Message, Notification, MessageHistory
+from . import counters, purge, readstate
+from .views import mark_read_up_to
+from .cache import cache_per_user
+from .models import Message, Notification, MessageHistory, ReadWatermark, UnreadCounter
+from .threads import fetch_conversation_threads, get_all_replies
 
 User = get_user_model()
 
+# Keep the views cache in memory for every test in this module.
+_view_cache_override = override_settings(MESSAGING_VIEW_CACHE="default")
+
+
+def setUpModule():
+    _view_cache_override.enable()
+
+
+def tearDownModule():
+    _view_cache_override.disable()
+
 
 class MessagingSignalsTests(TestCase):
     def setUp(self):
@@ -42,3 +65,343 @@ class MessagingSignalsTests(TestCase):
         )
         unread_for_receiver = Message.unread.for_user(self.receiver)
         self.assertEqual(unread_for_receiver.count(), 1)
+
+
+class MessageThreadTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="test12345")
+        self.bob = User.objects.create_user(username="bob", password="test12345")
+        self.root = Message.objects.create(sender=self.alice, receiver=self.bob, content="root")
+        self.reply = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="reply", parent_message=self.root
+        )
+        self.nested = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="nested", parent_message=self.reply
+        )
+        self.second = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="second", parent_message=self.root
+        )
+
+    def test_replies_store_thread_root(self):
+        self.nested.refresh_from_db()
+        self.assertEqual(self.nested.thread_root_id, self.root.pk)
+
+    def test_get_all_replies_loads_thread_in_one_query(self):
+        with self.assertNumQueries(1):
+            replies = get_all_replies(self.root)
+            self.assertEqual(
+                [(m.content, m.depth) for m in replies],
+                [("reply", 1), ("nested", 2), ("second", 1)],
+            )
+
+    def test_conversation_threads_are_nested(self):
+        with self.assertNumQueries(1):
+            roots = fetch_conversation_threads(self.bob, self.alice)
+            self.assertEqual([m.pk for m in roots], [self.root.pk])
+            self.assertEqual(
+                [m.pk for m in roots[0].thread_children], [self.reply.pk, self.second.pk]
+            )
+
+
+class MessageEditTrackingTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="test12345")
+        self.receiver = User.objects.create_user(username="receiver", password="test12345")
+        self.msg = Message.objects.create(
+            sender=self.sender, receiver=self.receiver, content="Original"
+        )
+
+    def test_edit_reads_the_locked_row_once(self):
+        msg = Message.objects.get(pk=self.msg.pk)
+        msg.content = "Edited"
+        # SELECT ... FOR UPDATE + history INSERT + message UPDATE
+        with self.assertNumQueries(3):
+            msg.save()
+        self.assertTrue(Message.objects.get(pk=msg.pk).edited)
+
+    def test_save_without_content_change_writes_no_history(self):
+        msg = Message.objects.get(pk=self.msg.pk)
+        msg.read = True
+        with CaptureQueriesContext(connection) as ctx:
+            msg.save(update_fields=["read"])
+        self.assertFalse(any(q["sql"].startswith("SELECT") for q in ctx.captured_queries))
+        self.assertFalse(MessageHistory.objects.exists())
+
+    def test_refresh_from_db_updates_the_edit_baseline(self):
+        msg = Message.objects.get(pk=self.msg.pk)
+        Message.objects.filter(pk=msg.pk).update(content="v2", version=2)
+        MessageHistory.objects.create(message=msg, version=1, old_content="Original")
+        msg.refresh_from_db()
+        msg.content = "v3"
+        msg.save()
+        self.assertEqual(msg.versions(), [(1, "Original"), (2, "v2"), (3, "v3")])
+
+    def test_bulk_edit_writes_history_in_bulk(self):
+        other = Message.objects.create(
+            sender=self.sender, receiver=self.receiver, content="Other"
+        )
+        edited = Message.objects.bulk_edit(
+            [(self.msg, "One"), (other, "Two"), (other, "Two")]
+        )
+        self.assertEqual(edited, 2)
+        self.assertEqual(
+            sorted(MessageHistory.objects.values_list("old_content", flat=True)),
+            ["Original", "Other"],
+        )
+        self.assertEqual(Message.objects.get(pk=other.pk).content, "Two")
+
+
+class MessageBulkSendTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="test12345")
+        self.receiver = User.objects.create_user(username="receiver", password="test12345")
+
+    def test_bulk_send_creates_one_notification_per_message(self):
+        root = Message.objects.create(sender=self.sender, receiver=self.receiver, content="root")
+        messages = [
+            Message(sender=self.sender, receiver=self.receiver, content=f"m{i}", parent_message=root)
+            for i in range(10)
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            Message.objects.bulk_send(messages)
+        inserts = [q["sql"].split('"')[1] for q in ctx.captured_queries if q["sql"].startswith("INSERT")]
+        # one batched INSERT per table, whatever the number of messages
+        self.assertEqual(inserts.count("messaging_message"), 1)
+        self.assertEqual(inserts.count("messaging_notification"), 1)
+        for message in messages:
+            self.assertEqual(message.thread_root_id, root.pk)
+            self.assertTrue(
+                Notification.objects.filter(user=self.receiver, message=message).exists()
+            )
+
+
+class AccountPurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="leaving", password="test12345")
+        self.other = User.objects.create_user(username="staying", password="test12345")
+        for i in range(7):
+            msg = Message.objects.create(sender=self.user, receiver=self.other, content=f"m{i}")
+            Message.objects.create(
+                sender=self.other, receiver=self.user, content="re", parent_message=msg
+            )
+        self.kept = Message.objects.create(sender=self.other, receiver=self.other, content="note")
+
+    def test_request_deletion_only_deactivates(self):
+        deletion = purge.request_account_deletion(self.user)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNone(deletion.completed_at)
+        self.assertEqual(Message.objects.count(), 15)
+
+    def test_purge_account_in_batches(self):
+        deletion = purge.request_account_deletion(self.user)
+        seen = []
+        purge.purge_account(deletion, batch_size=3, progress=lambda f, n: seen.append((f, n)))
+        deletion.refresh_from_db()
+        self.assertIsNotNone(deletion.completed_at)
+        self.assertEqual(deletion.messages_deleted, 14)
+        self.assertEqual(deletion.notifications_deleted, 14)
+        self.assertIn(("messages_deleted", 3), seen)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(list(Message.objects.all()), [self.kept])
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="test12345")
+        self.receiver = User.objects.create_user(username="receiver", password="test12345")
+        self.first = Message.objects.create(sender=self.sender, receiver=self.receiver, content="a")
+        self.reply = Message.objects.create(
+            sender=self.sender, receiver=self.receiver, content="b", parent_message=self.first
+        )
+
+    def test_counters_follow_new_and_read_messages(self):
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 2)
+        self.assertEqual(Message.unread.count_for_user(self.receiver, thread=self.first), 2)
+        self.reply.read = True
+        self.reply.save(update_fields=["read"])
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 1)
+        self.assertEqual(Message.unread.count_for_user(self.receiver, sender=self.sender), 1)
+
+    def test_mark_read_and_bulk_send_update_counters(self):
+        Message.objects.bulk_send(
+            [Message(sender=self.sender, receiver=self.receiver, content="c")]
+        )
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 3)
+        Message.unread.mark_read(Message.unread.for_user(self.receiver))
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 0)
+
+    def test_rebuild_matches_source_rows(self):
+        UnreadCounter.objects.all().delete()
+        Message.objects.filter(pk=self.first.pk).update(read=True)
+        counters.rebuild(Message.unread.all())
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 1)
+        self.assertEqual(Message.unread.count_for_user(self.receiver, thread=self.first), 1)
+
+
+class UnreadCounterAtomicityTests(TransactionTestCase):
+    def test_failed_counter_update_rolls_back_the_message(self):
+        sender = User.objects.create_user(username="sender", password="test12345")
+        receiver = User.objects.create_user(username="receiver", password="test12345")
+        with mock.patch.object(counters, "apply_deltas", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Message.objects.create(sender=sender, receiver=receiver, content="a")
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+
+class PerUserViewCacheTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.alice = User.objects.create_user(username="alice", password="test12345")
+        self.bob = User.objects.create_user(username="bob", password="test12345")
+        self.calls = 0
+
+        @cache_per_user()
+        def inbox(request):
+            self.calls += 1
+            count = Message.objects.filter(receiver=request.user).count()
+            return HttpResponse(f"{request.user.username}:{count}")
+
+        self.view = inbox
+
+    def get(self, user):
+        request = RequestFactory().get("/inbox/")
+        request.user = user
+        return self.view(request).content.decode()
+
+    def test_pages_are_cached_per_user(self):
+        self.assertEqual(self.get(self.alice), "alice:0")
+        self.assertEqual(self.get(self.bob), "bob:0")
+        self.assertEqual(self.get(self.alice), "alice:0")
+        self.assertEqual(self.calls, 2)
+
+    def test_new_message_invalidates_receiver_page(self):
+        self.get(self.bob)
+        Message.objects.create(sender=self.alice, receiver=self.bob, content="hi")
+        self.assertEqual(self.get(self.bob), "bob:1")
+        self.assertEqual(self.calls, 2)
+
+
+class BenchmarkBudgetTests(TestCase):
+    def test_seeded_views_stay_within_query_budgets(self):
+        call_command("seed_threads", users=4, threads=20, replies=3, stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 80)
+        self.assertEqual(Message.objects.filter(thread_root__isnull=False).count(), 60)
+        out = StringIO()
+        # Raises CommandError if any view exceeds its query budget.
+        call_command("benchmark_views", iterations=2, stdout=out)
+        self.assertIn("conversation_thread", out.getvalue())
+
+
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="test12345")
+        self.receiver = User.objects.create_user(username="receiver", password="test12345")
+        self.messages = [
+            Message.objects.create(sender=self.sender, receiver=self.receiver, content=str(i))
+            for i in range(4)
+        ]
+
+    def test_watermark_marks_older_messages_read_without_touching_rows(self):
+        with CaptureQueriesContext(connection) as ctx:
+            readstate.mark_read_up_to(self.receiver, self.sender, self.messages[2].pk)
+        self.assertFalse(any("messaging_message" in q["sql"] and q["sql"].startswith("UPDATE") for q in ctx))
+        self.assertEqual(list(Message.unread.for_user(self.receiver)), [self.messages[3]])
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 1)
+        self.assertEqual(readstate.unread_notifications(self.receiver).count(), 1)
+        self.assertEqual(Message.objects.filter(read=False).count(), 4)
+
+    def test_watermark_never_moves_back_and_flags_are_not_counted_twice(self):
+        readstate.mark_read_up_to(self.receiver, self.sender, self.messages[2].pk)
+        readstate.mark_read_up_to(self.receiver, self.sender, self.messages[0].pk)
+        self.assertEqual(readstate.get_watermark(self.receiver, self.sender), self.messages[2].pk)
+        covered = Message.objects.get(pk=self.messages[1].pk)
+        covered.read = True
+        covered.save(update_fields=["read"])
+        covered.delete()
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 1)
+        counters.rebuild(Message.unread.all())
+        self.assertEqual(Message.unread.count_for_user(self.receiver), 1)
+
+    def test_mark_read_view(self):
+        request = RequestFactory().post("/read/", {"message_id": self.messages[3].pk})
+        request.user = self.receiver
+        response = mark_read_up_to(request, username="sender")
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {"last_read_message_id": self.messages[3].pk, "unread": 0})
+        self.assertTrue(ReadWatermark.objects.filter(user=self.receiver, peer=self.sender).exists())
+
+
+@override_settings(MESSAGING_HISTORY_SNAPSHOT_INTERVAL=3)
+class MessageHistoryDeltaTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="test12345")
+        self.receiver = User.objects.create_user(username="receiver", password="test12345")
+        self.contents = [
+            "see you at the station at nine",
+            "see you at the station at ten",
+            "see you at the north station at ten",
+            "see you at the north station at ten, bring the tickets",
+            "see you at the north station at ten",
+            "meet me at the north station at ten",
+            "meet me at the north station at half past ten",
+            "meet me at the station at half past ten",
+        ]
+        self.msg = Message.objects.create(
+            sender=self.sender, receiver=self.receiver, content=self.contents[0]
+        )
+        for content in self.contents[1:]:
+            self.msg.content = content
+            self.msg.save()
+
+    def test_edits_are_stored_as_deltas_between_snapshots(self):
+        rows = list(self.msg.history.order_by("version").values_list("version", "is_snapshot", "old_content"))
+        self.assertEqual([row[0] for row in rows], list(range(1, 8)))
+        self.assertEqual([row[0] for row in rows if row[1]], [1, 4, 7])
+        self.assertTrue(all(row[2] == "" for row in rows if not row[1]))
+        self.assertEqual(Message.objects.get(pk=self.msg.pk).version, 8)
+
+    def test_every_version_is_rebuilt_with_one_query(self):
+        msg = Message.objects.get(pk=self.msg.pk)
+        for version, content in enumerate(self.contents, start=1):
+            with self.assertNumQueries(0 if version == msg.version else 1):
+                self.assertEqual(msg.content_at(version), content)
+        self.assertEqual(msg.versions(), list(enumerate(self.contents, start=1)))
+        with self.assertRaises(ValueError):
+            msg.content_at(9)
+
+    def test_bulk_edit_continues_the_history(self):
+        msg = Message.objects.get(pk=self.msg.pk)
+        Message.objects.bulk_edit([(msg, "cancelled")])
+        msg = Message.objects.get(pk=self.msg.pk)
+        self.assertEqual(msg.versions(), list(enumerate([*self.contents, "cancelled"], start=1)))
+
+    def test_edits_through_stale_instances_get_successive_versions(self):
+        first = Message.objects.get(pk=self.msg.pk)
+        second = Message.objects.get(pk=self.msg.pk)
+        first.content = "first"
+        first.save()
+        second.content = "second"
+        second.save()
+        third = Message.objects.get(pk=self.msg.pk)
+        Message.objects.bulk_edit([(self.msg, "third"), (second, "fourth")])
+        self.assertEqual(third.version, 10)
+        self.assertEqual(
+            Message.objects.get(pk=self.msg.pk).versions(),
+            list(enumerate([*self.contents, "first", "second", "third", "fourth"], start=1)),
+        )
+
+    def test_compress_converts_full_text_rows(self):
+        legacy = Message.objects.create(sender=self.sender, receiver=self.receiver, content=self.contents[-1])
+        # Rows as written before deltas: full old text, no version.
+        MessageHistory.objects.bulk_create(
+            MessageHistory(message=legacy, old_content=content) for content in self.contents[:-1]
+        )
+        call_command("compress_message_history", stdout=StringIO())
+
+        legacy = Message.objects.get(pk=legacy.pk)
+        self.assertEqual(legacy.versions(), list(enumerate(self.contents, start=1)))
+        self.assertEqual(legacy.history.filter(is_snapshot=False).count(), 4)
+        # Already converted histories are left alone.
+        self.assertEqual(Message.objects.get(pk=self.msg.pk).versions(), legacy.versions())
@@ -0,0 +1,84 @@
+"""
+Load whole message threads in a single query.
+
+Every reply stores its top-level message in `thread_root`, so a thread
+(or all threads between two users) is one indexed filter. The rows are
+then nested in Python: each message gets `thread_children` (ordered by
+timestamp) and `depth` (0 for the top-level message).
+"""
+from django.db.models import Q
+
+from .models import Message
+
+
+def _base_queryset():
+    return Message.objects.select_related("sender", "receiver").order_by("timestamp", "pk")
+
+
+def build_thread_tree(messages):
+    """
+    Nest already loaded messages and return the top-level ones in order.
+
+    A message whose parent is not part of `messages` is treated as a root.
+    """
+    by_id = {message.pk: message for message in messages}
+    roots = []
+    for message in messages:
+        message.thread_children = []
+    for message in messages:
+        parent = by_id.get(message.parent_message_id)
+        if parent is None:
+            roots.append(message)
+        else:
+            parent.thread_children.append(message)
+
+    stack = [(root, 0) for root in reversed(roots)]
+    while stack:
+        message, depth = stack.pop()
+        message.depth = depth
+        stack.extend((child, depth + 1) for child in reversed(message.thread_children))
+    return roots
+
+
+def flatten_thread(message):
+    """Return all descendants of a nested message, depth-first, in order."""
+    flat = []
+    stack = list(reversed(message.thread_children))
+    while stack:
+        reply = stack.pop()
+        flat.append(reply)
+        stack.extend(reversed(reply.thread_children))
+    return flat
+
+
+def fetch_thread(message):
+    """
+    Load the whole thread `message` belongs to with one query.
+    Return the nested node for `message` itself.
+    """
+    root_id = message.thread_root_id or message.pk
+    messages = list(_base_queryset().filter(Q(pk=root_id) | Q(thread_root_id=root_id)))
+    build_thread_tree(messages)
+    for node in messages:
+        if node.pk == message.pk:
+            return node
+    return None
+
+
+def get_all_replies(message):
+    """All replies under `message`, depth-first, each with `depth` set."""
+    node = fetch_thread(message)
+    return flatten_thread(node) if node is not None else []
+
+
+def fetch_conversation_threads(user, other_user):
+    """
+    Load every thread started between two users, replies included, with
+    one query. Return the nested top-level messages ordered by timestamp.
+    """
+    roots = Message.objects.filter(
+        Q(sender=user, receiver=other_user) | Q(sender=other_user, receiver=user),
+        parent_message__isnull=True,
+    ).values("pk")
+    messages = list(_base_queryset().filter(Q(pk__in=roots) | Q(thread_root__in=roots)))
+    return build_thread_tree(messages)
@@ -1,8 +1,13 @@
+from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth import get_user_model
-from django.views.decorators.cache import cache_page  # 👈 مهم
+from django.db.models import Q
 
+from . import purge, readstate, threads
+from .cache import cache_per_user, conversation_scope
 from .models import Message
 
 User = get_user_model()
@@ -12,43 +17,34 @@ User = get_user_model()
 def delete_user(request):
     """
     Allow the authenticated user to delete their own account.
-    Related data is cleaned up by post_delete signal on User.
+    The account is deactivated right away; messages, notifications and
+    histories are purged in batches in the background (messaging.purge).
     """
     user = request.user
-    user.delete()
+    deletion = purge.request_account_deletion(user)
+    purge.schedule_purge(deletion)
+    logout(request)
     return redirect("/")
 
 
-@cache_page(60)  # 👈 cache view dyal conversation list for 60 seconds
+def _thread_scopes(request, username):
+    other_id = User.objects.filter(username=username).values_list("pk", flat=True).first()
+    return [conversation_scope(request.user.pk, other_id)] if other_id else []
+
+
 @login_required
+@cache_per_user(scopes=_thread_scopes)
 def conversation_thread(request, username):
     """
     Threaded conversation between request.user and another user.
-    Uses Message.objects.filter + select_related + prefetch_related
-    to optimize messages and their replies.
-    This view is cached for 60 seconds using cache_page.
+    All threads, replies included, are loaded with a single query and
+    nested by messaging.threads (each message has thread_children/depth).
+    The page is cached per user and per conversation (messaging.cache) and
+    invalidated as soon as a message between the two users changes.
     """
     other_user = get_object_or_404(User, username=username)
 
-    # Base queryset: top-level messages in conversation
-    messages_qs_1 = Message.objects.filter(
-        sender=request.user,
-        receiver=other_user,
-        parent_message__isnull=True,
-    )
-    messages_qs_2 = Message.objects.filter(
-        sender=other_user,
-        receiver=request.user,
-        parent_message__isnull=True,
-    )
-
-    messages = (
-        messages_qs_1 | messages_qs_2
-    ).select_related(
-        "sender", "receiver"
-    ).prefetch_related(
-        "replies", "replies__sender", "replies__receiver"
-    ).order_by("timestamp")
+    messages = threads.fetch_conversation_threads(request.user, other_user)
 
     context = {
         "other_user": other_user,
@@ -59,20 +55,10 @@ def conversation_thread(request, username):
 
 def get_all_replies(message):
     """
-    Recursive ORM-based helper to fetch all replies for a message.
+    Fetch all replies for a message (depth-first, with depth set)
+    using one query for the whole thread.
     """
-    replies = (
-        Message.objects.filter(parent_message=message)
-        .select_related("sender", "receiver")
-        .prefetch_related("replies")
-        .order_by("timestamp")
-    )
-
-    all_replies = []
-    for reply in replies:
-        all_replies.append(reply)
-        all_replies.extend(get_all_replies(reply))
-    return all_replies
+    return threads.get_all_replies(message)
 
 
 @login_required
@@ -87,3 +73,46 @@ def unread_inbox(request):
     )
     context = {"messages": unread_messages}
     return render(request, "messaging/unread_inbox.html", context)
+
+
+@login_required
+def unread_count(request):
+    """
+    Unread badge count for the current user, answered from UnreadCounter
+    without scanning messages. Optional ?sender=<id> or ?thread=<id>.
+    """
+    sender = request.GET.get("sender")
+    thread = request.GET.get("thread")
+    count = Message.unread.count_for_user(
+        request.user,
+        sender=int(sender) if sender and sender.isdigit() else None,
+        thread=int(thread) if thread and thread.isdigit() else None,
+    )
+    return JsonResponse({"unread": count})
+
+
+@login_required
+@require_POST
+def mark_read_up_to(request, username):
+    """
+    Mark the conversation with `username` read up to the message id
+    posted as `message_id`. Only the read watermark is written
+    (messaging.readstate), however many messages it covers.
+    """
+    peer = get_object_or_404(User, username=username)
+    message_id = request.POST.get("message_id", "")
+    if not message_id.isdigit():
+        return JsonResponse({"error": "message_id is required."}, status=400)
+    message_id = int(message_id)
+    between = Message.objects.filter(
+        Q(sender=peer, receiver=request.user) | Q(sender=request.user, receiver=peer),
+        pk=message_id,
+    )
+    if not between.exists():
+        return JsonResponse({"error": "Unknown message."}, status=404)
+
+    mark = readstate.mark_read_up_to(request.user, peer, message_id)
+    return JsonResponse({
+        "last_read_message_id": mark.last_read_message_id,
+        "unread": Message.unread.count_for_user(request.user, sender=peer),
+    })
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -71,5 +73,17 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         "LOCATION": "unique-snowflake",
-    }
+    },
+    # Per-user page cache (messaging.cache), shared by all workers. Kept
+    # out of the source tree: every message save writes to it.
+    "views": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "MESSAGING_VIEW_CACHE_DIR",
+            Path(tempfile.gettempdir()) / "messaging_app" / "views",
+        ),
+    },
 }
+
+MESSAGING_VIEW_CACHE = "views"
+MESSAGING_VIEW_CACHE_TIMEOUT = 60 * 60 * 24
@@ -1,5 +1,7 @@
 from django.contrib import admin
+from django.db.models import Q
 from .models import Conversation, Message
+from .search import get_search_backend
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
@@ -11,3 +13,12 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'conversation', 'sender', 'created_at')
     search_fields = ('content', 'sender__username')
     list_filter = ('created_at',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Content goes through the search index instead of LIKE '%...%'.
+        if not search_term:
+            return queryset, False
+        matches = get_search_backend().search(queryset, search_term).values('pk')
+        return queryset.filter(
+            Q(pk__in=matches) | Q(sender__username__iexact=search_term.strip())
+        ), False
@@ -3,3 +3,14 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        from django.core import checks
+
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from .authentication import check_denylist_cache
+        from .membership import check_membership_cache
+
+        checks.register(check_denylist_cache, checks.Tags.security)
+        checks.register(check_membership_cache, checks.Tags.security)
@@ -1,15 +1,73 @@
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+import time
+
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from .authentication import is_revoked, revoke_token
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     # Custom JWT serializer to include extra user information in the token.
+    # These claims are everything chats.authentication needs, so API
+    # requests do not load the user row.
 
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
         token['username'] = user.username
         token['email'] = user.email
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token['roles'] = sorted(user.groups.values_list('name', flat=True))
+        # Sub-second login time, compared with revocations (is_revoked).
+        token['auth_time'] = time.time()
         return token
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    # Revoked refresh tokens can't mint new access tokens.
+
+    def validate(self, attrs):
+        try:
+            refresh = RefreshToken(attrs['refresh'])
+        except TokenError as exc:
+            raise InvalidToken(exc.args[0])
+        if is_revoked(refresh):
+            raise InvalidToken('Token has been revoked.')
+        return super().validate(attrs)
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer
+
+
+class TokenRevokeView(APIView):
+    """
+    Log out a JWT client: deny the access token of the request and the
+    refresh token posted as {"refresh": "..."} (optional).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if hasattr(request.auth, 'payload'):
+            # Authenticated with an access token (not a session).
+            revoke_token(request.auth)
+        refresh = request.data.get('refresh')
+        if refresh:
+            try:
+                token = RefreshToken(refresh)
+            except TokenError as exc:
+                raise InvalidToken(exc.args[0])
+            if token.get(jwt_settings.USER_ID_CLAIM) != request.user.id:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            revoke_token(token)
+        return Response(status=status.HTTP_205_RESET_CONTENT)
@@ -0,0 +1,135 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .checks import shared_cache_errors
+
+User = get_user_model()
+
+
+# --- Deny-list ---------------------------------------------------------------
+# Only revoked tokens are stored, each until it would have expired anyway,
+# plus one "revoked before" timestamp per user for revoking every token of
+# an account at once. Both are checked with a single cache.get_many.
+# The cache (CHATS_JWT_DENYLIST_CACHE) must be shared by every worker and
+# survive restarts; check_denylist_cache refuses per-process backends.
+
+def _denylist():
+    return caches[getattr(settings, 'CHATS_JWT_DENYLIST_CACHE', 'default')]
+
+
+def check_denylist_cache(app_configs, **kwargs):
+    return shared_cache_errors(
+        'CHATS_JWT_DENYLIST_CACHE', 'JWT deny-list', ('chats.E001', 'chats.E002')
+    )
+
+
+def _denied_key(jti):
+    return f'chats:jwt-denied:{jti}'
+
+
+def _revoked_before_key(user_id):
+    return f'chats:jwt-revoked-before:{user_id}'
+
+
+def revoke_token(token):
+    """Deny one token (access or refresh) until it expires."""
+    remaining = int(token['exp'] - time.time())
+    if remaining > 0:
+        _denylist().set(_denied_key(token[jwt_settings.JTI_CLAIM]), 1, remaining)
+
+
+def revoke_user_tokens(*user_ids):
+    """Deny every token issued to these users up to now."""
+    lifetime = int(jwt_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    now = time.time()
+    _denylist().set_many({_revoked_before_key(user_id): now for user_id in user_ids}, lifetime)
+
+
+def is_revoked(token):
+    user_id = token.get(jwt_settings.USER_ID_CLAIM)
+    jti_key = _denied_key(token.get(jwt_settings.JTI_CLAIM))
+    user_key = _revoked_before_key(user_id)
+    found = _denylist().get_many([jti_key, user_key])
+    if jti_key in found:
+        return True
+    if user_key not in found:
+        return False
+    # auth_time (set at login, copied to refreshed access tokens) is
+    # sub-second, so a login right after a save that revoked (a password
+    # rehash, a password change) keeps its tokens. Tokens without it only
+    # have the whole-second iat: one from the revocation's second counts
+    # as revoked.
+    auth_time = token.get('auth_time')
+    if auth_time is not None:
+        return auth_time < found[user_key]
+    return token.get('iat', 0) <= found[user_key]
+
+
+# --- Stateless authentication ------------------------------------------------
+
+def _user_cache_key(user_id):
+    return f'chats:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """
+    The User row for `user_id`, cached for CHATS_USER_CACHE_TIMEOUT seconds
+    (default 60) and dropped by chats.signals when the user changes.
+    """
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.get(pk=user_id)
+        cache.set(key, user, getattr(settings, 'CHATS_USER_CACHE_TIMEOUT', 60))
+    return user
+
+
+def invalidate_cached_users(*user_ids):
+    cache.delete_many([_user_cache_key(user_id) for user_id in user_ids])
+
+
+class ClaimsUser(TokenUser):
+    """
+    request.user for StatelessJWTAuthentication: id, username, email,
+    is_staff, is_superuser and roles (group names) all come from the token.
+    Code that needs the model instance calls get_db_user().
+    """
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def roles(self):
+        return frozenset(self.token.get('roles', ()))
+
+    def get_db_user(self):
+        return get_cached_user(self.id)
+
+
+def model_user(user):
+    # A User instance for code that needs one (foreign keys, forms).
+    return user.get_db_user() if isinstance(user, ClaimsUser) else user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication without the per-request User query: the user is a
+    ClaimsUser built from the token, and revoked tokens are rejected
+    through the shared cache deny-list.
+    """
+
+    def get_user(self, validated_token):
+        if jwt_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if is_revoked(validated_token):
+            raise InvalidToken('Token has been revoked.')
+        return ClaimsUser(validated_token)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+
+def shared_cache_errors(setting, purpose, ids):
+    """
+    Errors if the cache alias named by `setting` is unknown or private to
+    one process. Data that signals invalidate (or that must outlive a
+    restart) is only correct in a cache every worker reads.
+    `ids` is the pair of check ids (unknown alias, per-process backend).
+    """
+    alias = getattr(settings, setting, 'default')
+    config = settings.CACHES.get(alias)
+    if config is None:
+        return [checks.Error(f'{setting} names an unknown cache alias: {alias!r}.', id=ids[0])]
+    backend = import_string(config['BACKEND'])
+    if issubclass(backend, (LocMemCache, DummyCache)):
+        return [checks.Error(
+            f'The {purpose} cache {alias!r} uses {backend.__name__}, which other workers cannot see.',
+            hint=f'Point {setting} at a shared cache (database, Redis, Memcached).',
+            id=ids[1],
+        )]
+    return []
@@ -0,0 +1,67 @@
+import threading
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+
+class CompressionStats:
+    """Response sizes before and after gzip, totalled for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.responses = 0
+            self.compressed = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def record(self, size, compressed_size=None):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += size
+            if compressed_size is None:
+                self.bytes_out += size
+            else:
+                self.compressed += 1
+                self.bytes_out += compressed_size
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'responses': self.responses,
+                'compressed': self.compressed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+            }
+
+
+stats = CompressionStats()
+
+
+class GZipStatsMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves bodies under CHATS_GZIP_MIN_SIZE bytes
+    (default 1024) uncompressed, where gzip saves little, and records the
+    sizes in `stats` (served at api/stats/compression/). Streaming
+    responses are compressed but not counted.
+
+    Put it near the top of MIDDLEWARE, right after SecurityMiddleware.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return super().process_response(request, response)
+        size = len(response.content)
+        if size < getattr(settings, 'CHATS_GZIP_MIN_SIZE', 1024):
+            stats.record(size)
+            return response
+        response = super().process_response(request, response)
+        if response.get('Content-Encoding') == 'gzip':
+            stats.record(size, len(response.content))
+        else:
+            stats.record(size)
+        return response
@@ -0,0 +1,63 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve.
+
+    The validators come from get_validators() (a few aggregate queries),
+    not from the rendered body, so a request whose If-None-Match or
+    If-Modified-Since still matches gets a 304 before the page is
+    fetched or serialized.
+    """
+
+    def get_validators(self, request, pk=None):
+        """
+        Return (parts, last_modified): `parts` must change whenever the
+        response would, `last_modified` is an aware datetime or None.
+        """
+        raise NotImplementedError
+
+    def get_etag(self, request, parts):
+        raw = repr((
+            request.user.id,
+            request.get_full_path(),
+            getattr(request.accepted_renderer, 'format', None),
+            parts,
+        ))
+        return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+    def conditional(self, request, build, pk=None):
+        try:
+            parts, last_modified = self.get_validators(request, pk)
+        except (TypeError, ValueError):
+            # A malformed pk: let build() answer it (404) as before.
+            return build()
+        etag = self.get_etag(request, parts)
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = build()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # Clients may keep the response but must revalidate it.
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            request,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            request,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+            pk=kwargs[self.lookup_url_kwarg or self.lookup_field],
+        )
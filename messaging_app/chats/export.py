@@ -0,0 +1,82 @@
+import csv
+import io
+import zlib
+from itertools import islice
+
+from .models import Message
+from .renderers import FastJSONRenderer
+from .serializers import MessageRowSerializer
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+CSV_HEADER = ('id', 'conversation', 'sender_id', 'sender_username', 'sender_email',
+              'content', 'created_at', 'updated_at')
+
+
+def export_queryset(user_id=None, conversation_id=None, after=None):
+    """
+    Messages to export, oldest first: the mailbox of `user_id` (every
+    conversation they take part in) and/or one conversation. `after` is
+    the id of the last message already exported, to resume an export.
+    """
+    queryset = Message.objects.all()
+    if user_id is not None:
+        queryset = queryset.filter(conversation__participants=user_id)
+    if conversation_id is not None:
+        queryset = queryset.filter(conversation_id=conversation_id)
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    # Ordered by id so that the last id received is a resume cursor.
+    return queryset.order_by('id')
+
+
+def iter_export(queryset, export_format='ndjson', chunk_size=1000):
+    """
+    Yield the messages of `queryset` as NDJSON lines (the same objects as
+    the API) or CSV rows, one bytes chunk per `chunk_size` messages.
+
+    The rows come from a single query read with iterator(chunk_size), so
+    memory use depends on the chunk size, not on the number of messages.
+    """
+    if export_format not in CONTENT_TYPES:
+        raise ValueError(f'Unknown export format: {export_format!r}')
+    rows = MessageRowSerializer.rows(queryset).iterator(chunk_size=chunk_size)
+    render = FastJSONRenderer().render
+    if export_format == 'csv':
+        yield _csv_line(CSV_HEADER)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        # A new serializer per chunk, so its sender dicts don't pile up.
+        items = MessageRowSerializer().serialize(chunk)
+        if export_format == 'ndjson':
+            yield b''.join(render(item) + b'\n' for item in items)
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows(
+                (item['id'], item['conversation'], item['sender']['id'], item['sender']['username'],
+                 item['sender']['email'], item['content'], item['created_at'], item['updated_at'])
+                for item in items
+            )
+            yield buffer.getvalue().encode()
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of bytes chunks into one gzip stream, on the fly."""
+    # wbits=31: deflate with a gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,174 @@
+import json
+import statistics
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from chats.models import Message
+from chats.pagination import MessagePagination
+
+User = get_user_model()
+
+# Maximum queries per request. Any growth here is a regression (usually an
+# N+1), so the command fails instead of only reporting it.
+QUERY_BUDGETS = {
+    'conversations': 6,
+    'messages page 1': 3,
+    'messages deep page': 3,
+    'messages cursor': 1,
+    'conversation messages': 3,
+    'search': 3,
+    # Revalidation with If-None-Match: validator queries only.
+    'conversations (304)': 2,
+    'messages page 1 (304)': 1,
+}
+
+# Scenarios repeated with the ETag of their first response.
+REVALIDATED = ('conversations', 'messages page 1')
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of a non-empty list.
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the messaging API through the test client (full middleware '
+        'stack): latency, queries per request and memory. Seed data first with '
+        'seed_messages.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User to send the requests as (default: busiest user).')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--search', default='lunch friday', help='Query used for the search scenario.')
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+        parser.add_argument(
+            '--no-budgets', action='store_true',
+            help='Report query counts without failing on budget overruns.',
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user_id'])
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        conversation = user.conversations.annotate(n=Count('messages')).order_by('-n').first()
+        # The last page: OFFSET pagination is at its slowest there.
+        visible = Message.objects.filter(conversation__participants=user).count()
+        last_page = max(1, -(-visible // MessagePagination.page_size))
+        scenarios = {
+            'conversations': '/api/conversations/',
+            'messages page 1': '/api/messages/',
+            'messages deep page': f'/api/messages/?page={last_page}',
+            'messages cursor': '/api/messages/?cursor=',
+            'conversation messages': f'/api/messages/?conversation_id={conversation.pk}',
+            'search': '/api/messages/?' + urlencode({'q': options['search']}),
+        }
+        for name in REVALIDATED:
+            scenarios[f'{name} (304)'] = scenarios[name]
+
+        results = []
+        failures = []
+        # The test client sends Host: testserver.
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        for name, url in scenarios.items():
+            with override_settings(ALLOWED_HOSTS=allowed_hosts):
+                etag = self.get(client, url)['ETag'] if name.endswith(' (304)') else None
+                result = self.run_scenario(client, name, url, options['iterations'], options['warmup'], etag)
+            results.append(result)
+            budget = QUERY_BUDGETS.get(name)
+            if budget is not None and result['queries'] > budget:
+                failures.append(f'{name}: {result["queries"]} queries (budget {budget})')
+
+        self.report(user, results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+        if failures and not options['no_budgets']:
+            raise CommandError('Query budget exceeded:\n  ' + '\n  '.join(failures))
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            try:
+                return User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                raise CommandError(f'User {user_id} does not exist.')
+        user = (
+            User.objects.annotate(n=Count('messages')).filter(n__gt=0).order_by('-n', 'pk').first()
+        )
+        if user is None:
+            raise CommandError('No messages found; run seed_messages first.')
+        return user
+
+    def run_scenario(self, client, name, url, iterations, warmup, etag=None):
+        for _ in range(warmup):
+            self.get(client, url, etag)
+
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.get(client, url, etag)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(captured))
+
+        # Memory is measured on a separate request: tracemalloc slows
+        # allocation down and would skew the timings above.
+        tracemalloc.start()
+        try:
+            response = self.get(client, url, etag)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'name': name,
+            'url': url,
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries': queries,
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def get(self, client, url, etag=None):
+        if etag is None:
+            response = client.get(url)
+            expected = 200
+        else:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            expected = 304
+        if response.status_code != expected:
+            raise CommandError(f'GET {url} returned {response.status_code}.')
+        return response
+
+    def report(self, user, results):
+        self.stdout.write(f'User #{user.pk} ({user.get_username()})')
+        header = f'{"scenario":<24}{"p50 ms":>9}{"p99 ms":>9}{"queries":>9}{"peak KB":>10}{"bytes":>9}'
+        self.stdout.write(header)
+        for r in results:
+            budget = QUERY_BUDGETS.get(r['name'])
+            line = (
+                f'{r["name"]:<24}{r["p50_ms"]:>9.2f}{r["p99_ms"]:>9.2f}'
+                f'{r["queries"]:>9}{r["peak_kb"]:>10.1f}{r["bytes"]:>9}'
+            )
+            if budget is not None and r['queries'] > budget:
+                line = self.style.ERROR(line + f'  > budget {budget}')
+            self.stdout.write(line)
+
@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from chats.models import Conversation, Message
+
+User = get_user_model()
+
+# Plan fragments that mean the query is not served by an index.
+WARNING_MARKERS = ('SCAN chats_', 'USE TEMP B-TREE', 'Seq Scan')
+
+
+class Command(BaseCommand):
+    help = 'Print the query plan of each hot chats queryset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User to build the querysets for.')
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Exit with an error if any plan scans a table or sorts in a temp B-tree.',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user_id'] is not None:
+            users = users.filter(pk=options['user_id'])
+        user = users.first()
+        if user is None:
+            raise CommandError('Seed at least one user first.')
+        conversation = Conversation.objects.filter(participants=user).order_by('pk').first()
+        conversation_id = conversation.pk if conversation else 0
+
+        # Same shapes as ConversationViewSet / MessageViewSet build.
+        messages = Message.objects.filter(conversation__participants=user).order_by('-created_at', '-id')
+        newest = messages.filter(conversation_id=conversation_id).first()
+        last_message_id = Subquery(
+            Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id').values('id')[:1]
+        )
+        querysets = {
+            'messages (all conversations)': messages[:20],
+            'messages (one conversation)': messages.filter(conversation_id=conversation_id)[:20],
+            'messages (keyset page)': messages.filter(conversation_id=conversation_id).filter(
+                Q(created_at__lt=newest.created_at) | Q(created_at=newest.created_at, id__lt=newest.id)
+            )[:21] if newest else messages.none(),
+            'conversations': Conversation.objects.filter(participants=user).annotate(
+                message_count=Count('messages'),
+                last_activity=Coalesce(Max('messages__created_at'), 'created_at'),
+                last_message_id=last_message_id,
+            ).order_by('-last_activity', '-id')[:20],
+        }
+
+        warnings = 0
+        for label, queryset in querysets.items():
+            plan = queryset.explain()
+            flagged = [line for line in plan.splitlines() if any(m in line for m in WARNING_MARKERS)]
+            warnings += len(flagged)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(plan)
+            for line in flagged:
+                self.stdout.write(self.style.WARNING(f'  not index-backed: {line.strip()}'))
+            self.stdout.write('')
+
+        if warnings and options['strict']:
+            raise CommandError(f'{warnings} plan steps are not backed by an index.')
+        self.stdout.write(self.style.SUCCESS(f'Checked {len(querysets)} querysets, {warnings} warnings.'))
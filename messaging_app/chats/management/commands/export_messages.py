@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.export import CONTENT_TYPES, export_queryset, gzip_chunks, iter_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export a user's messages or a conversation as NDJSON or CSV, oldest "
+        "first, streamed in chunks so memory stays flat for any size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Export the messages of every conversation of this user id.')
+        parser.add_argument('--conversation', type=int, help='Export this conversation.')
+        parser.add_argument('--type', choices=sorted(CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--after', type=int, help='Resume after this message id.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--output', help='File to write (default: stdout).')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output (implied by a .gz --output).')
+
+    def handle(self, *args, **options):
+        if options['user'] is None and options['conversation'] is None:
+            raise CommandError('Give --user, --conversation or both.')
+        queryset = export_queryset(
+            user_id=options['user'], conversation_id=options['conversation'], after=options['after']
+        )
+        chunks = iter_export(queryset, options['type'], options['chunk_size'])
+        output = options['output']
+        if options['gzip'] or (output or '').endswith('.gz'):
+            chunks = gzip_chunks(chunks)
+
+        written = 0
+        out = open(output, 'wb') if output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if output:
+                out.close()
+            else:
+                out.flush()
+        if output:
+            self.stderr.write(self.style.SUCCESS(f'Wrote {written} bytes to {output}.'))
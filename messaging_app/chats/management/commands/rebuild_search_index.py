@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from chats.models import Message
+from chats.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the message search index from the messages table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.clear()
+        batch, total = [], 0
+        for message in Message.objects.only('id', 'content').order_by('pk').iterator(chunk_size=options['batch_size']):
+            batch.append(message)
+            if len(batch) >= options['batch_size']:
+                backend.index(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            backend.index(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} messages with {type(backend).__name__}.'))
@@ -0,0 +1,104 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chats.models import Conversation, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Seed users, conversations and messages with bulk_create (for benchmarks).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--conversations', type=int, default=500)
+        parser.add_argument('--participants', type=int, default=3, help='Participants per conversation.')
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for reproducible data.')
+        parser.add_argument('--prefix', default='bench', help='Username prefix.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        # One hash for everyone: hashing per user would dominate seeding time.
+        password = make_password('bench-password')
+        prefix = options['prefix']
+        User.objects.bulk_create(
+            [
+                User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+                for i in range(options['users'])
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith=prefix).values_list('pk', flat=True)
+        )
+
+        conversations = Conversation.objects.bulk_create(
+            [Conversation() for _ in range(options['conversations'])], batch_size=batch_size
+        )
+        Participant = Conversation.participants.through
+        members = {}
+        links = []
+        for conversation in conversations:
+            chosen = rng.sample(user_ids, min(options['participants'], len(user_ids)))
+            members[conversation.pk] = chosen
+            links += [Participant(conversation_id=conversation.pk, user_id=u) for u in chosen]
+        Participant.objects.bulk_create(links, batch_size=batch_size)
+        self.stdout.write(f'{len(user_ids)} users, {len(conversations)} conversations.')
+
+        conversation_ids = list(members)
+        start = timezone.now() - timedelta(days=365)
+        step = timedelta(days=365) / max(options['messages'], 1)
+        total = options['messages']
+        created = 0
+        # Messages are generated batch by batch, so memory stays flat even
+        # for millions of rows.
+        while created < total:
+            batch = []
+            for i in range(created, min(created + batch_size, total)):
+                conversation_id = rng.choice(conversation_ids)
+                batch.append(Message(
+                    conversation_id=conversation_id,
+                    sender_id=rng.choice(members[conversation_id]),
+                    content=f'message {i} ' + ' '.join(rng.choices(WORDS, k=rng.randint(3, 15))),
+                ))
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                # auto_now_add fixes created_at at insert time; spread the
+                # timestamps over a year so ordering behaves like real data.
+                # executemany is much faster than bulk_update's CASE WHEN.
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f'UPDATE {Message._meta.db_table} SET created_at = %s WHERE id = %s',
+                        [
+                            (connection.ops.adapt_datetimefield_value(start + step * (created + offset)), message.pk)
+                            for offset, message in enumerate(batch)
+                        ],
+                    )
+            created += len(batch)
+            self.stdout.write(f'  {created}/{total} messages', ending='\r')
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {created} messages in {time.perf_counter() - started:.1f}s. '
+            f'Run rebuild_search_index to index them for ?q= searches.'
+        ))
+
+
+WORDS = (
+    'hello lunch friday meeting tomorrow project deadline coffee weekend call '
+    'review merge deploy bug fix release train ticket budget plan agenda notes '
+    'thanks sorry later today tonight morning office remote update status'
+).split()
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from .checks import shared_cache_errors
+from .models import Conversation
+
+Participant = Conversation.participants.through
+
+
+def _cache():
+    return caches[getattr(settings, 'CHATS_MEMBERSHIP_CACHE', 'default')]
+
+
+def check_membership_cache(app_configs, **kwargs):
+    # Removing a participant only clears the cache of the process that
+    # did it; a per-process cache would let them in elsewhere until expiry.
+    return shared_cache_errors(
+        'CHATS_MEMBERSHIP_CACHE', 'participant membership', ('chats.E003', 'chats.E004')
+    )
+
+
+def _cache_key(user_id):
+    return f'chats:participant-conversations:{user_id}'
+
+
+def conversation_ids_for_user(user_id):
+    """
+    Return the frozenset of conversation ids the user participates in.
+
+    The set is cached per user (PARTICIPANT_CACHE_TIMEOUT seconds, default
+    300) in the shared CHATS_MEMBERSHIP_CACHE and dropped by chats.signals
+    whenever the participants of a conversation change.
+    """
+    key = _cache_key(user_id)
+    ids = _cache().get(key)
+    if ids is None:
+        ids = frozenset(
+            Participant.objects.filter(user_id=user_id)
+            .values_list('conversation_id', flat=True)
+        )
+        _cache().set(key, ids, getattr(settings, 'PARTICIPANT_CACHE_TIMEOUT', 300))
+    return ids
+
+
+def invalidate_participant_cache(*user_ids):
+    _cache().delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def is_participant(request, conversation_id):
+    """
+    O(1) membership test for request.user.
+
+    The conversation id set is memoized on the request, so several checks
+    in one request (permissions, perform_create, ...) share a single
+    cache lookup.
+    """
+    user = request.user
+    if not user or not user.is_authenticated:
+        return False
+    memo = getattr(request, '_participant_conversation_ids', None)
+    if memo is None:
+        memo = conversation_ids_for_user(user.id)
+        request._participant_conversation_ids = memo
+    return conversation_id in memo
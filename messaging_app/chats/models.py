@@ -19,5 +19,26 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # MessageViewSet: messages of a conversation, newest first (keyset pages)
+            models.Index(fields=['conversation', '-created_at', '-id'], name='chats_msg_conv_recent_idx'),
+        ]
+
     def __str__(self):
         return f"Message #{self.id} in Conversation #{self.conversation_id}"
+
+class MessageSearchTerm(models.Model):
+    # Inverted index row (term -> message) used by the portable search
+    # backend in chats.search when SQLite FTS5 is not available.
+    message = models.ForeignKey(Message, related_name='search_terms', on_delete=models.CASCADE)
+    term = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'message'], name='chats_search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} in Message #{self.message_id}"
@@ -1,15 +1,40 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class MessagePagination(PageNumberPagination):
     """
     Paginate message lists: 20 messages per page.
+
+    Two modes are supported:
+    - page mode (default): ?page=N, returns the exact total count.
+    - cursor mode: ?cursor=<token> (an empty token starts at the newest
+      message). Pages are keyed on (created_at, id), so every page costs
+      the same no matter how deep the client scrolls, and no COUNT(*) is
+      run unless the client opts in with ?count=true.
     """
     page_size = 20
     page_query_param = 'page'
     max_page_size = 100
 
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    # Must match the ordering of MessageViewSet.get_queryset()
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request)
+
     def get_paginated_response(self, data):
         """
         Custom paginated response that includes:
@@ -17,9 +42,119 @@ class MessagePagination(PageNumberPagination):
         - next / previous links
         - the current page results
         """
+        if self.cursor_mode:
+            payload = {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+            if self.total_count is not None:
+                payload['count'] = self.total_count
+            return Response(payload)
+
         return Response({
             'count': self.page.paginator.count,   # <-- الكلمة اللي باغيها الـ checker
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data,
         })
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return self._cursor_link(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self._cursor_link(self.previous_position, reverse=True)
+
+    # -- cursor mode -------------------------------------------------------
+
+    def paginate_queryset_by_cursor(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        self.total_count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.total_count = queryset.count()
+
+        if position is not None:
+            created_at, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # Fetch one extra row to know whether there is a further page.
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        first = self.get_position(rows[0]) if rows else None
+        last = self.get_position(rows[-1]) if rows else None
+
+        if reverse:
+            self.next_position = last if position is not None else None
+            self.previous_position = first if has_more else None
+        else:
+            self.next_position = last if has_more else None
+            self.previous_position = first if position is not None else None
+
+        return rows
+
+    def get_position(self, row):
+        # Rows are model instances, or dicts from MessageRowSerializer.rows()
+        if isinstance(row, dict):
+            return row['created_at'], row['id']
+        return row.created_at, row.id
+
+    def decode_cursor(self, request):
+        """
+        Return ((created_at, id) or None, reverse) from the opaque cursor.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            created_at = parse_datetime(data['t'])
+            pk = int(data['i'])
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound('Invalid cursor.')
+        if created_at is None:
+            raise NotFound('Invalid cursor.')
+        return (created_at, pk), reverse
+
+    def encode_cursor(self, position, reverse):
+        created_at, pk = position
+        data = {'t': created_at.isoformat(), 'i': pk}
+        if reverse:
+            data['r'] = 1
+        raw = json.dumps(data, separators=(',', ':')).encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def _cursor_link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(position, reverse)
+        )
@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from .membership import is_participant
 from .models import Conversation, Message
 
 
@@ -11,6 +12,8 @@ class IsParticipantOfConversation(permissions.BasePermission):
     - For Message objects: user must be a participant in the related conversation.
     - For unsafe methods (PUT, PATCH, DELETE) we strictly enforce that
       only participants in the conversation can update or delete messages.
+    - Membership is answered from the cached conversation id set in
+      chats.membership, so no query is run per object.
     """
 
     def has_permission(self, request, view):
@@ -18,23 +21,21 @@ class IsParticipantOfConversation(permissions.BasePermission):
         return bool(request.user and request.user.is_authenticated)
 
     def has_object_permission(self, request, view, obj):
-        user = request.user
-
         # For modification methods (PUT, PATCH, DELETE)
         # we still apply the same participant rule, but we mention
         # the methods explicitly so the checker can detect them.
         if request.method in ["PUT", "PATCH", "DELETE"]:
             if isinstance(obj, Conversation):
-                return obj.participants.filter(id=user.id).exists()
+                return is_participant(request, obj.pk)
             if isinstance(obj, Message):
-                return obj.conversation.participants.filter(id=user.id).exists()
+                return is_participant(request, obj.conversation_id)
             return False
 
         # For safe methods like GET, HEAD, OPTIONS:
         if isinstance(obj, Conversation):
-            return obj.participants.filter(id=user.id).exists()
+            return is_participant(request, obj.pk)
 
         if isinstance(obj, Message):
-            return obj.conversation.participants.filter(id=user.id).exists()
+            return is_participant(request, obj.conversation_id)
 
         return False
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Conversation
+
+Participant = Conversation.participants.through
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Broker:
+    """
+    Pub/sub interface used by the message stream.
+
+    publish() is called from synchronous code (views, signal handlers) in
+    any thread; subscribe() is called on the event loop serving the
+    stream. A multi-process deployment needs a broker shared by every
+    process (e.g. one built on Redis pub/sub), selected with
+    CHATS_REALTIME_BROKER.
+    """
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """Return a Subscription receiving the events of `channel`."""
+        raise NotImplementedError
+
+
+class Subscription:
+    """
+    Events of one channel for one listener, buffered in an asyncio.Queue.
+
+    The queue is bounded: a listener that stops reading loses its oldest
+    events instead of growing without limit, and `dropped` counts them
+    (message_stream then ends the stream, so the client reconnects with
+    Last-Event-ID and the missed messages are replayed).
+    """
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def push(self, event):
+        # Runs on self.loop.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker(Broker):
+    """
+    Broker for a single process: events are handed straight to the
+    subscriptions' event loops with call_soon_threadsafe. An idle
+    listener is only a queue waiting on the loop, so thousands of them
+    cost no threads.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # The loop was closed without unsubscribing.
+                subscription.close()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+
+_broker = None
+
+
+def get_broker():
+    """
+    The broker named by CHATS_REALTIME_BROKER (a dotted path, default
+    chats.realtime.InProcessBroker), built once with the keyword
+    arguments in CHATS_REALTIME_BROKER_OPTIONS.
+    """
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'CHATS_REALTIME_BROKER', 'chats.realtime.InProcessBroker')
+        options = getattr(settings, 'CHATS_REALTIME_BROKER_OPTIONS', {})
+        _broker = import_string(path)(**options)
+    return _broker
+
+
+def message_event(message):
+    return {
+        'type': 'message',
+        'id': message.pk,
+        'conversation': message.conversation_id,
+        'sender': message.sender_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def publish_messages(messages):
+    """
+    Push new messages to every participant of their conversations.
+    The recipients of all the messages are looked up with one query.
+    """
+    messages = list(messages)
+    if not messages:
+        return
+    recipients = defaultdict(list)
+    rows = Participant.objects.filter(
+        conversation_id__in={m.conversation_id for m in messages}
+    ).values_list('conversation_id', 'user_id')
+    for conversation_id, user_id in rows:
+        recipients[conversation_id].append(user_id)
+
+    broker = get_broker()
+    for message in messages:
+        event = message_event(message)
+        for user_id in recipients[message.conversation_id]:
+            broker.publish(user_channel(user_id), event)
+
+
+def publish_conversations(pairs):
+    """Tell users about conversations they were added to ((user_id, conversation_id) pairs)."""
+    broker = get_broker()
+    for user_id, conversation_id in pairs:
+        broker.publish(user_channel(user_id), {'type': 'conversation', 'id': conversation_id})
@@ -0,0 +1,147 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import Message, MessageSearchTerm
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+
+class SQLiteFTS5Backend:
+    """
+    Full-text search with an SQLite FTS5 table whose rowid is the message id.
+    Results are ranked by bm25 (lower rank is better).
+    """
+    table = 'chats_message_fts'
+
+    def ensure_table(self):
+        # Also run from post_migrate (chats.signals), so this normally exists.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                f"USING fts5(content, tokenize='unicode61')"
+            )
+
+    def _executemany(self, sql, params):
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, params)
+        except OperationalError:
+            # The table may have been dropped with a rolled-back migration
+            # or a fresh database; create it and retry once.
+            self.ensure_table()
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, params)
+
+    def index(self, messages):
+        rows = [(m.pk, m.content) for m in messages]
+        self._executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk, _ in rows])
+        self._executemany(f"INSERT INTO {self.table} (rowid, content) VALUES (%s, %s)", rows)
+
+    def remove(self, message_ids):
+        self._executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in message_ids])
+
+    def clear(self):
+        self.ensure_table()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+        # Quote every term so user input can't use FTS5 query syntax.
+        match = ' '.join('"%s"' % term for term in terms)
+        table = self.table
+        message_table = Message._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT rank FROM {table} WHERE {table} MATCH %s AND rowid = {message_table}.id",
+                (match,),
+            )
+        ).order_by('search_rank', '-id')
+
+
+class TermIndexBackend:
+    """
+    Portable inverted index stored in MessageSearchTerm rows.
+    Every query term must match; results are ranked by the number of
+    occurrences of the query terms.
+    """
+
+    def index(self, messages):
+        messages = list(messages)
+        MessageSearchTerm.objects.filter(message__in=messages).delete()
+        MessageSearchTerm.objects.bulk_create(
+            [
+                MessageSearchTerm(message=message, term=term, count=count)
+                for message in messages
+                for term, count in Counter(tokenize(message.content)).items()
+            ],
+            batch_size=1000,
+        )
+
+    def remove(self, message_ids):
+        MessageSearchTerm.objects.filter(message_id__in=list(message_ids)).delete()
+
+    def clear(self):
+        MessageSearchTerm.objects.all().delete()
+
+    def search(self, queryset, query):
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return queryset.none()
+        matching = (
+            MessageSearchTerm.objects.filter(term__in=terms)
+            .values('message')
+            .annotate(matched=Count('term'))
+            .filter(matched=len(terms))
+            .values('message')
+        )
+        occurrences = (
+            MessageSearchTerm.objects.filter(message=OuterRef('pk'), term__in=terms)
+            .values('message')
+            .annotate(total=Sum('count'))
+            .values('total')
+        )
+        return queryset.filter(id__in=matching).annotate(
+            search_rank=Coalesce(Subquery(occurrences, output_field=IntegerField()), 0)
+        ).order_by('-search_rank', '-id')
+
+
+def _fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = {row[0] for row in cursor.fetchall()}
+    return 'ENABLE_FTS5' in options
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    CHATS_SEARCH_BACKEND selects the backend: 'fts5', 'terms', or 'auto'
+    (the default: FTS5 on SQLite builds that have it, terms otherwise).
+    """
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'CHATS_SEARCH_BACKEND', 'auto')
+        if name == 'auto':
+            name = 'fts5' if _fts5_available() else 'terms'
+        _backend = SQLiteFTS5Backend() if name == 'fts5' else TermIndexBackend()
+    return _backend
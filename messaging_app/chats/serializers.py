@@ -1,4 +1,5 @@
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth import get_user_model
 from .models import Conversation, Message
 
@@ -17,11 +18,140 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'conversation', 'sender', 'content', 'created_at', 'updated_at']
         read_only_fields = ['id', 'sender', 'created_at', 'updated_at']
 
+class MessageRowSerializer:
+    """
+    Read-only fast path for message lists, producing exactly what
+    MessageSerializer(many=True).data produces.
+
+    Messages are read with values() (sender columns joined in the same
+    query) and turned into dicts with a field plan computed once, instead
+    of running the DRF field machinery per message and field. Each
+    sender dict is built once and shared by all of its messages.
+    """
+    # values() columns, in output order after the sender columns
+    columns = ('id', 'conversation_id', 'sender_id', 'sender__username', 'sender__email',
+               'content', 'created_at', 'updated_at')
+
+    def __init__(self):
+        self.senders = {}
+        to_datetime = _datetime_converter()
+        # (output key, values() column, converter or None)
+        self.plan = (
+            ('id', 'id', None),
+            ('conversation', 'conversation_id', None),
+            ('sender', 'sender_id', self.senders.__getitem__),
+            ('content', 'content', None),
+            ('created_at', 'created_at', to_datetime),
+            ('updated_at', 'updated_at', to_datetime),
+        )
+
+    @classmethod
+    def rows(cls, queryset):
+        return queryset.values(*cls.columns)
+
+    def to_representation(self, row):
+        data = {}
+        for key, column, convert in self.plan:
+            value = row[column]
+            data[key] = value if convert is None else convert(value)
+        return data
+
+    def serialize(self, rows):
+        rows = list(rows)
+        senders = self.senders
+        for row in rows:
+            if row['sender_id'] not in senders:
+                senders[row['sender_id']] = {
+                    'id': row['sender_id'],
+                    'username': row['sender__username'],
+                    'email': row['sender__email'],
+                }
+        return [self.to_representation(row) for row in rows]
+
+def _datetime_converter():
+    """
+    DateTimeField().to_representation for the default ISO 8601 format,
+    with the field's timezone looked up once instead of per value.
+    """
+    field = serializers.DateTimeField()
+    field_timezone = field.default_timezone()
+    if field_timezone is None or api_settings.DATETIME_FORMAT.lower() != ISO_8601:
+        return field.to_representation
+
+    def to_representation(value):
+        if not value:
+            return None
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return to_representation
+
+class BulkMessageSerializer(serializers.Serializer):
+    # One item of POST /api/messages/bulk/. The conversation is checked
+    # against the sender's cached membership instead of being loaded.
+    conversation = serializers.IntegerField()
+    content = serializers.CharField()
+
+
+class ConversationListSerializer(serializers.ListSerializer):
+    """
+    Loads the last message of every conversation on the page in one query
+    instead of one query per conversation.
+    """
+
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, 'all') else data)
+        last_ids = [
+            c.last_message_id for c in conversations
+            if getattr(c, 'last_message_id', None) is not None
+        ]
+        last_messages = Message.objects.select_related('sender').in_bulk(last_ids)
+        for conversation in conversations:
+            if hasattr(conversation, 'last_message_id'):
+                conversation.last_message = last_messages.get(conversation.last_message_id)
+        return super().to_representation(conversations)
+
+
 class ConversationSerializer(serializers.ModelSerializer):
+    """
+    Conversation summary: participants, last message, message count and
+    last activity time. The full history is served by the paginated
+    /api/messages/?conversation_id= endpoint.
+
+    message_count, last_activity and last_message_id are expected as
+    annotations (see ConversationViewSet.get_queryset); they are computed
+    on the fly for instances that were not loaded through it.
+    """
     participants = UserSerializer(many=True, read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
+    last_message = serializers.SerializerMethodField()
+    message_count = serializers.SerializerMethodField()
+    last_activity = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ['id', 'participants', 'created_at', 'messages']
-        read_only_fields = ['id', 'participants', 'created_at', 'messages']
+        fields = ['id', 'participants', 'created_at', 'last_message', 'message_count', 'last_activity']
+        read_only_fields = ['id', 'participants', 'created_at', 'last_message', 'message_count', 'last_activity']
+        list_serializer_class = ConversationListSerializer
+
+    def get_last_message(self, obj):
+        if not hasattr(obj, 'last_message'):
+            obj.last_message = (
+                obj.messages.select_related('sender').order_by('-created_at', '-id').first()
+            )
+        if obj.last_message is None:
+            return None
+        return MessageSerializer(obj.last_message, context=self.context).data
+
+    def get_message_count(self, obj):
+        if hasattr(obj, 'message_count'):
+            return obj.message_count
+        return obj.messages.count()
+
+    def get_last_activity(self, obj):
+        last_activity = getattr(obj, 'last_activity', None)
+        if last_activity is None:
+            last_message = obj.last_message if hasattr(obj, 'last_message') else None
+            last_activity = last_message.created_at if last_message else obj.created_at
+        return serializers.DateTimeField().to_representation(last_activity)
@@ -0,0 +1,94 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_users, revoke_user_tokens
+from .membership import invalidate_participant_cache
+from .models import Conversation, Message
+from .realtime import publish_conversations, publish_messages
+from .search import SQLiteFTS5Backend, get_search_backend
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Drop the cached conversation ids of every user whose membership changed.
+    if action == 'pre_clear' and not reverse:
+        # conversation.participants.clear() does not pass pk_set
+        invalidate_participant_cache(*instance.participants.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            invalidate_participant_cache(instance.pk)
+        else:
+            invalidate_participant_cache(*(pk_set or ()))
+    if action == 'post_add' and pk_set:
+        # Tell the new participants' streams about the conversation.
+        pairs = [(instance.pk, c) for c in pk_set] if reverse else [(u, instance.pk) for u in pk_set]
+        transaction.on_commit(lambda: publish_conversations(pairs))
+
+
+@receiver(pre_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    invalidate_participant_cache(*instance.participants.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, update_fields=None, **kwargs):
+    # Keep the search index in step with message content.
+    if update_fields is None or 'content' in update_fields:
+        get_search_backend().index([instance])
+
+
+@receiver(post_save, sender=Message)
+def publish_new_message(sender, instance, created, **kwargs):
+    # Push to the participants' streams once the message is committed.
+    if created:
+        transaction.on_commit(lambda: publish_messages([instance]))
+
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_migrate)
+def create_search_table(sender, app_config=None, **kwargs):
+    # The FTS5 virtual table is not a model, so create it after migrate.
+    if app_config is not None and app_config.label == 'chats':
+        backend = get_search_backend()
+        if isinstance(backend, SQLiteFTS5Backend):
+            backend.ensure_table()
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Tokens carry the user's claims, so a changed user has to log in again.
+    # Login itself only writes last_login and is left alone.
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_cached_users(instance.pk)
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_cached_users(instance.pk)
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Group names are the `roles` claim.
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.user_set.values_list('pk', flat=True))
+    else:
+        user_ids = list(pk_set or ())
+    if user_ids:
+        invalidate_cached_users(*user_ids)
+        revoke_user_tokens(*user_ids)
@@ -1,7 +1,32 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, modify_settings, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from .models import Conversation
+from . import compression, realtime, search
+from .authentication import check_denylist_cache
+from .export import export_queryset, iter_export
+from .membership import check_membership_cache, conversation_ids_for_user
+from .models import Conversation, Message
+from .renderers import FastJSONRenderer
+from .serializers import MessageRowSerializer, MessageSerializer
 
 User = get_user_model()
 
@@ -14,3 +39,535 @@ class ConversationAPITestCase(TestCase):
     def test_create_conversation(self):
         response = self.client.post('/api/conversations/', {})
         self.assertEqual(response.status_code, 201)
+
+
+class MessageCursorPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        for i in range(45):
+            Message.objects.create(
+                conversation=self.conversation, sender=self.user1, content=f'msg {i}'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_cursor_pages_cover_all_messages_without_count(self):
+        seen = []
+        url = '/api/messages/?cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        expected = list(
+            Message.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_prior_page(self):
+        first = self.client.get('/api/messages/?cursor=')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [m['id'] for m in back.data['results']],
+            [m['id'] for m in first.data['results']],
+        )
+        self.assertIsNone(back.data['previous'])
+
+    def test_count_is_opt_in(self):
+        response = self.client.get('/api/messages/?cursor=&count=true')
+        self.assertEqual(response.data['count'], 45)
+
+
+class ParticipantMembershipTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user2)
+
+    def test_non_participant_cannot_send(self):
+        response = self.client.post(
+            '/api/messages/', {'conversation': self.conversation.pk, 'content': 'hi'}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_cache_is_invalidated_when_participant_added(self):
+        self.assertNotIn(self.conversation.pk, conversation_ids_for_user(self.user2.pk))
+        self.conversation.participants.add(self.user2)
+        self.assertIn(self.conversation.pk, conversation_ids_for_user(self.user2.pk))
+        response = self.client.post(
+            '/api/messages/', {'conversation': self.conversation.pk, 'content': 'hi'}
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_cache_is_invalidated_when_participant_removed(self):
+        self.assertIn(self.conversation.pk, conversation_ids_for_user(self.user1.pk))
+        self.user1.conversations.remove(self.conversation)
+        self.assertNotIn(self.conversation.pk, conversation_ids_for_user(self.user1.pk))
+
+    def test_membership_cache_must_be_shared(self):
+        self.assertEqual(check_membership_cache(None), [])
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem, CHATS_MEMBERSHIP_CACHE='default'):
+            self.assertEqual([error.id for error in check_membership_cache(None)], ['chats.E004'])
+
+
+class ConversationSummaryTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass1234')
+        self.older = Conversation.objects.create()
+        self.newer = Conversation.objects.create()
+        for conversation in (self.older, self.newer):
+            conversation.participants.add(self.user1, self.user2)
+        Message.objects.create(conversation=self.newer, sender=self.user2, content='first')
+        Message.objects.create(conversation=self.older, sender=self.user1, content='hello')
+        self.last = Message.objects.create(conversation=self.older, sender=self.user2, content='bye')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_list_returns_summaries_sorted_by_activity(self):
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([c['id'] for c in results], [self.older.pk, self.newer.pk])
+        self.assertEqual(results[0]['message_count'], 2)
+        self.assertEqual(results[0]['last_message']['id'], self.last.pk)
+        self.assertNotIn('messages', results[0])
+
+    def test_list_query_count_does_not_grow_with_conversations(self):
+        for _ in range(5):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user1, self.user2)
+            Message.objects.create(conversation=conversation, sender=self.user2, content='x')
+        # 2 ETag validators, count, page, participants prefetch, last messages
+        with self.assertNumQueries(6):
+            self.client.get('/api/conversations/')
+
+
+class BulkMessageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        self.other = Conversation.objects.create()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_bulk_send(self):
+        payload = [{'conversation': self.conversation.pk, 'content': f'm{i}'} for i in range(30)]
+        response = self.client.post('/api/messages/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 30)
+
+    def test_bulk_send_rejects_foreign_conversation(self):
+        payload = [
+            {'conversation': self.conversation.pk, 'content': 'ok'},
+            {'conversation': self.other.pk, 'content': 'nope'},
+        ]
+        response = self.client.post('/api/messages/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+
+
+class MessageSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        self.foreign = Conversation.objects.create()
+        self.lunch = Message.objects.create(conversation=self.conversation, sender=self.user1, content='Lunch on Friday?')
+        self.both = Message.objects.create(conversation=self.conversation, sender=self.user1, content='lunch lunch friday')
+        Message.objects.create(conversation=self.conversation, sender=self.user1, content='Dinner tonight')
+        Message.objects.create(conversation=self.foreign, sender=self.user1, content='lunch friday elsewhere')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def search(self, q):
+        response = self.client.get('/api/messages/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [m['id'] for m in response.data['results']]
+
+    def test_search_is_scoped_and_requires_all_terms(self):
+        self.assertCountEqual(self.search('friday lunch'), [self.lunch.pk, self.both.pk])
+        self.assertEqual(self.search('dinner friday'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.lunch.content = 'Brunch instead'
+        self.lunch.save()
+        self.assertEqual(self.search('brunch'), [self.lunch.pk])
+        self.lunch.delete()
+        self.assertEqual(self.search('brunch'), [])
+
+    def test_term_index_backend_ranks_by_occurrences(self):
+        backend = search.TermIndexBackend()
+        backend.index(Message.objects.all())
+        results = backend.search(Message.objects.filter(conversation=self.conversation), 'lunch')
+        self.assertEqual([m.pk for m in results], [self.both.pk, self.lunch.pk])
+
+
+class BenchmarkBudgetTestCase(TestCase):
+    def test_seeded_api_stays_within_query_budgets(self):
+        call_command('seed_messages', users=5, conversations=4, messages=300, stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 300)
+        out = StringIO()
+        # Raises CommandError if any endpoint exceeds its query budget.
+        call_command('benchmark_api', iterations=2, warmup=0, stdout=out)
+        self.assertIn('messages cursor', out.getvalue())
+
+
+class RealtimeStreamTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass1234')
+        self.outsider = User.objects.create_user(username='user3', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    async def read_event(self, subscription):
+        event = await subscription.get(timeout=1)
+        self.assertIsNotNone(event)
+        return event
+
+    async def test_new_messages_reach_every_participant(self):
+        broker = realtime.InProcessBroker()
+        subscriptions = [
+            broker.subscribe(realtime.user_channel(user.pk))
+            for user in (self.user1, self.user2, self.outsider)
+        ]
+
+        def send():
+            # Messages are published once the transaction commits.
+            with self.captureOnCommitCallbacks(execute=True):
+                return Message.objects.create(conversation=self.conversation, sender=self.user1, content='hi')
+
+        with mock.patch.object(realtime, '_broker', broker):
+            message = await sync_to_async(send)()
+        for subscription in subscriptions[:2]:
+            event = await self.read_event(subscription)
+            self.assertEqual((event['type'], event['id'], event['content']), ('message', message.pk, 'hi'))
+        self.assertIsNone(await subscriptions[2].get(timeout=0.05))
+
+    async def test_stream_replays_missed_messages(self):
+        first = await Message.objects.acreate(conversation=self.conversation, sender=self.user1, content='one')
+        await Message.objects.acreate(conversation=self.conversation, sender=self.user2, content='two')
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user2)
+        response = await client.get('/api/stream/', headers={'Last-Event-ID': str(first.pk)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunk = await anext(aiter(response.streaming_content))
+        self.assertIn(b'"content": "two"', chunk)
+        await response.streaming_content.aclose()
+
+    async def test_stream_ends_after_max_age_and_releases_its_subscription(self):
+        message = await Message.objects.acreate(conversation=self.conversation, sender=self.user1, content='one')
+        broker = realtime.InProcessBroker()
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user2)
+        with mock.patch.object(realtime, '_broker', broker), \
+                override_settings(CHATS_STREAM_MAX_AGE=0.2, CHATS_STREAM_HEARTBEAT=0.05):
+            response = await client.get('/api/stream/')
+            broker.publish(realtime.user_channel(self.user2.pk), {'type': 'conversation', 'id': 99})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        # The latest message id comes first, so a reconnect can resume.
+        self.assertTrue(body.startswith(f'id: {message.pk}\n\n'.encode()))
+        self.assertIn(b'event: conversation\ndata:', body)
+        self.assertNotIn(b'id: 99', body)
+        self.assertEqual(broker._subscriptions, {})
+
+    async def test_stream_ends_on_overflow_and_reconnect_replays_the_gap(self):
+        broker = realtime.InProcessBroker(queue_size=2)
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user2)
+        with mock.patch.object(realtime, '_broker', broker), override_settings(CHATS_STREAM_MAX_AGE=5):
+            response = await client.get('/api/stream/')
+            chunks = aiter(response.streaming_content)
+            self.assertEqual(await anext(chunks), b'id: 0\n\n')
+            messages = [
+                await Message.objects.acreate(conversation=self.conversation, sender=self.user1, content=str(i))
+                for i in range(4)
+            ]
+            for message in messages:
+                broker.publish(realtime.user_channel(self.user2.pk), realtime.message_event(message))
+            await asyncio.sleep(0)
+            rest = b''.join([chunk async for chunk in chunks])
+        # Nothing after the gap is sent, so Last-Event-ID stays at 0.
+        self.assertNotIn(b'event: message', rest)
+        self.assertEqual(broker._subscriptions, {})
+
+        with mock.patch.object(realtime, '_broker', broker), override_settings(CHATS_STREAM_REPLAY_LIMIT=3):
+            response = await client.get('/api/stream/', headers={'Last-Event-ID': '0'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        # The replay stops at its limit and the stream ends there too; the
+        # next reconnect resumes from the third message.
+        self.assertEqual(body.count(b'event: message'), 3)
+        self.assertIn(f'id: {messages[2].pk}\n'.encode(), body)
+        self.assertNotIn(b': connected', body)
+
+    def test_stream_is_refused_outside_asgi(self):
+        self.client.force_login(self.user2)
+        self.assertEqual(self.client.get('/api/stream/').status_code, 501)
+
+    def test_stream_requires_authentication(self):
+        response = self.client.get('/api/stream/')
+        self.assertEqual(response.status_code, 401)
+
+
+class StatelessJWTTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass1234', email='u1@example.com')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        self.client = APIClient()
+        response = self.client.post('/api/token/', {'username': 'user1', 'password': 'pass1234'})
+        self.tokens = response.data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_requests_do_not_load_the_user(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/messages/')
+        self.assertEqual(response.status_code, 200)
+        # Messages join auth_user for the sender; no query loads the user itself.
+        self.assertFalse(any('FROM "auth_user" WHERE' in q['sql'] for q in ctx.captured_queries))
+
+    def test_writes_use_the_cached_user(self):
+        for content in ('one', 'two'):
+            response = self.client.post('/api/messages/', {'conversation': self.conversation.pk, 'content': content})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data['sender']['username'], 'user1')
+        self.assertEqual(Message.objects.filter(sender=self.user1).count(), 2)
+
+    def test_revoked_tokens_are_rejected(self):
+        response = self.client.post('/api/token/revoke/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 205)
+        self.assertEqual(self.client.get('/api/messages/').status_code, 401)
+        response = APIClient().post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_group_change_revokes_tokens(self):
+        self.user1.groups.add(Group.objects.create(name='moderator'))
+        self.assertEqual(self.client.get('/api/messages/').status_code, 401)
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_login_right_after_a_revoking_save_keeps_its_tokens(self):
+        # Logging in with an outdated hash rehashes the password, which
+        # saves the user (and revokes its tokens) during the login itself.
+        self.user1.password = make_password('pass1234', hasher='md5')
+        self.user1.save()
+        tokens = APIClient().post('/api/token/', {'username': 'user1', 'password': 'pass1234'}).data
+        self.user1.refresh_from_db()
+        self.assertTrue(self.user1.password.startswith('pbkdf2_sha256$'))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(client.get('/api/messages/').status_code, 200)
+        response = APIClient().post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        # The tokens issued before the save are still revoked.
+        self.assertEqual(self.client.get('/api/messages/').status_code, 401)
+
+    def test_password_change_then_login_in_the_same_second(self):
+        self.user1.set_password('new-pass1234')
+        self.user1.save()
+        tokens = APIClient().post('/api/token/', {'username': 'user1', 'password': 'new-pass1234'}).data
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(client.get('/api/messages/').status_code, 200)
+        self.assertEqual(self.client.get('/api/messages/').status_code, 401)
+
+    def test_revocations_are_stored_in_the_shared_cache(self):
+        self.client.post('/api/token/revoke/')
+        cache.clear()
+        self.assertEqual(self.client.get('/api/messages/').status_code, 401)
+
+    def test_per_process_deny_list_cache_is_refused(self):
+        self.assertEqual(check_denylist_cache(None), [])
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem, CHATS_JWT_DENYLIST_CACHE='default'):
+            self.assertEqual([error.id for error in check_denylist_cache(None)], ['chats.E002'])
+        with override_settings(CHATS_JWT_DENYLIST_CACHE='missing'):
+            self.assertEqual([error.id for error in check_denylist_cache(None)], ['chats.E001'])
+
+
+class FastMessageSerializationTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234', email='u1@example.com')
+        self.user2 = User.objects.create_user(username='usér2', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        for i, content in enumerate(['plain', 'émoji 😀', 'line sep ', 'ctl \x01 "q" \\ </script>']):
+            Message.objects.create(
+                conversation=self.conversation, sender=self.user1 if i % 2 else self.user2, content=content
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_output_is_byte_identical_to_message_serializer(self):
+        queryset = Message.objects.select_related('sender').order_by('-created_at', '-id')
+        expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+        rows = MessageRowSerializer().serialize(MessageRowSerializer.rows(queryset))
+        self.assertEqual(FastJSONRenderer().render(rows), expected)
+
+    def test_api_pages_match_message_serializer(self):
+        for url in ('/api/messages/', '/api/messages/?cursor=&page_size=2'):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            ids = [m['id'] for m in response.data['results']]
+            queryset = Message.objects.filter(pk__in=ids).select_related('sender').order_by('-created_at', '-id')
+            expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+            self.assertEqual(FastJSONRenderer().render(response.data['results']), expected)
+            self.assertIn(expected[1:-1], response.content)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.message = Message.objects.create(conversation=self.conversation, sender=self.user2, content='hi')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def assertRevalidates(self, url, queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def test_unchanged_lists_return_304(self):
+        self.assertRevalidates('/api/messages/', 1)
+        self.assertRevalidates(f'/api/messages/?conversation_id={self.conversation.pk}', 1)
+        self.assertRevalidates(f'/api/messages/{self.message.pk}/', 1)
+        self.assertRevalidates('/api/conversations/', 2)
+        self.assertRevalidates(f'/api/conversations/{self.conversation.pk}/', 2)
+
+    def test_cursor_pages_skip_the_validator_aggregate(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/messages/?cursor=')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_if_modified_since_alone_never_revalidates(self):
+        # Deletes and same-second sends would not move a Last-Modified date.
+        response = self.client.get('/api/messages/')
+        self.assertFalse(response.has_header('Last-Modified'))
+        since = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        Message.objects.create(conversation=self.conversation, sender=self.user2, content='again')
+        self.assertEqual(self.client.get('/api/messages/', HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        self.message.delete()
+        self.assertEqual(self.client.get('/api/messages/', HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_etag_changes_with_messages_and_participants(self):
+        messages_etag = self.assertRevalidates('/api/messages/', 1)
+        conversations_etag = self.assertRevalidates('/api/conversations/', 2)
+
+        self.message.content = 'edited'
+        self.message.save()
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=messages_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['content'], 'edited')
+
+        self.conversation.participants.add(User.objects.create_user(username='user3'))
+        response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=conversations_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user_and_page(self):
+        etag = self.client.get('/api/messages/')['ETag']
+        url = f'/api/messages/?conversation_id={self.conversation.pk}'
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+        self.client.force_authenticate(user=self.user2)
+        self.assertNotEqual(self.client.get('/api/messages/')['ETag'], etag)
+
+    @override_settings(CHATS_GZIP_MIN_SIZE=1024)
+    @modify_settings(MIDDLEWARE={'prepend': 'chats.compression.GZipStatsMiddleware'})
+    def test_large_responses_are_gzipped_and_counted(self):
+        compression.stats.reset()
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.user1, content='lunch on friday? ' * 5)
+            for _ in range(30)
+        ])
+        response = self.client.get('/api/messages/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(f'/api/messages/{self.message.pk}/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        snapshot = compression.stats.snapshot()
+        self.assertEqual((snapshot['responses'], snapshot['compressed']), (2, 1))
+        self.assertLess(snapshot['ratio'], 0.5)
+
+
+class MessageExportTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234', email='u1@example.com')
+        self.user2 = User.objects.create_user(username='user2', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.other = Conversation.objects.create()
+        self.other.participants.add(self.user2)
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'hi, "{i}"\nbye')
+        Message.objects.create(conversation=self.other, sender=self.user2, content='not for user1')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def expected(self, after=0):
+        queryset = Message.objects.filter(conversation=self.conversation, id__gt=after).order_by('id')
+        return json.loads(JSONRenderer().render(MessageSerializer(queryset, many=True).data))
+
+    def test_ndjson_export_streams_api_objects_in_id_order(self):
+        response = self.client.get('/api/messages/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected())
+
+        after = self.expected()[1]['id']
+        response = self.client.get(f'/api/messages/export/?after={after}')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected(after))
+
+    def test_export_reads_rows_with_one_query(self):
+        chunks = iter_export(export_queryset(user_id=self.user1.id), chunk_size=2)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(chunks)), 3)
+
+    def test_csv_export_gzipped(self):
+        response = self.client.get(
+            f'/api/messages/export/?type=csv&conversation_id={self.conversation.pk}',
+            HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([row['content'] for row in rows], [m['content'] for m in self.expected()])
+        self.assertEqual(rows[0]['sender_username'], 'user2')
+
+    def test_export_of_foreign_conversation_is_refused(self):
+        response = self.client.get(f'/api/messages/export/?conversation_id={self.other.pk}')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get('/api/messages/export/?type=xml').status_code, 400)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ndjson.gz')
+            call_command('export_messages', '--user', str(self.user1.id), '--output', path, stderr=StringIO())
+            with gzip.open(path) as f:
+                self.assertEqual([json.loads(line) for line in f], self.expected())
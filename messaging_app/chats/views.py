@@ -1,19 +1,47 @@
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import APIException, PermissionDenied, ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from .authentication import model_user
+from .compression import stats as compression_stats
+from .conditional import ConditionalGetMixin
+from .export import CONTENT_TYPES, export_queryset, gzip_chunks, iter_export
+from .membership import is_participant
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .renderers import FastJSONRenderer
+from .serializers import BulkMessageSerializer, ConversationSerializer, MessageRowSerializer, MessageSerializer
 from .permissions import IsParticipantOfConversation
 from .filters import MessageFilter
 from .pagination import MessagePagination
+from .realtime import Participant, get_broker, message_event, publish_messages, user_channel
+from .search import get_search_backend
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing conversations.
 
     - Users must be authenticated.
     - Each user can only see conversations where they are a participant.
+    - Conversations are returned as summaries (last message, message count,
+      last activity), most recently active first.
+    - GET responses carry an ETag built from the messages and participant
+      rows of the user's conversations (see get_validators).
     """
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
@@ -21,42 +49,89 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        # Only conversations the user participates in
-        return Conversation.objects.filter(participants=user).distinct()
+        last_message_id = Subquery(
+            Message.objects.filter(conversation=OuterRef('pk'))
+            .order_by('-created_at', '-id')
+            .values('id')[:1]
+        )
+        # Only conversations the user participates in. The participant
+        # filter leaves one row per conversation, so Count needs no DISTINCT.
+        return (
+            Conversation.objects.filter(participants=user.id)
+            .annotate(
+                message_count=Count('messages'),
+                last_activity=Coalesce(Max('messages__created_at'), 'created_at'),
+                last_message_id=last_message_id,
+            )
+            .prefetch_related('participants')
+            .order_by('-last_activity', '-id')
+        )
+
+    def get_validators(self, request, pk=None):
+        # Sending, editing or deleting a message changes the message count,
+        # max(updated_at) or max(id); creating a conversation or changing
+        # its participants changes the participant count or max(id).
+        # Renaming a user is not tracked, it only shows up after another change.
+        conversations = Conversation.objects.filter(participants=request.user.id)
+        if pk is not None:
+            conversations = conversations.filter(pk=pk)
+        messages = Message.objects.filter(conversation__in=conversations).aggregate(
+            count=Count('id'), last_id=Max('id'), updated=Max('updated_at')
+        )
+        participants = Participant.objects.filter(conversation__in=conversations).aggregate(
+            count=Count('id'), last_id=Max('id')
+        )
+        # No Last-Modified: participant changes have no timestamp.
+        return (sorted(messages.items()), sorted(participants.items())), None
 
     def perform_create(self, serializer):
         # When a conversation is created, add the current user as a participant.
         conversation = serializer.save()
-        conversation.participants.add(self.request.user)
+        conversation.participants.add(self.request.user.id)
         conversation.save()
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing messages.
 
     - Users must be authenticated.
     - Each user can only see messages in conversations where they are a participant.
-    - Pagination: 20 messages per page.
+    - Pagination: 20 messages per page, or keyset pages with ?cursor=.
     - Filtering is enabled via MessageFilter.
+    - POST /api/messages/bulk/ sends up to `bulk_max_messages` messages at once.
+    - ?q= runs a ranked full-text search over message content (chats.search);
+      results are best-match first in page mode.
+    - Lists are serialized from values() rows (MessageRowSerializer) and
+      rendered with orjson when it is installed (FastJSONRenderer).
+    - GET responses (except cursor pages) carry an ETag from the count,
+      max(id) and max(updated_at) of the filtered messages; a matching
+      If-None-Match gets a 304.
+    - GET /api/messages/export/ streams the user's messages (or one
+      conversation's) as NDJSON or CSV.
     """
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated, IsParticipantOfConversation]
     pagination_class = MessagePagination
     filterset_class = MessageFilter
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     # This attribute is just to make sure HTTP_403_FORBIDDEN appears in this file
     # (the checker searches for this constant by name).
     http_forbidden_status = status.HTTP_403_FORBIDDEN
 
+    bulk_max_messages = 500
+    bulk_batch_size = 100
+    export_chunk_size = 1000
+
     def get_queryset(self):
         user = self.request.user
 
         # Base queryset: messages from conversations where the user is a participant
         queryset = Message.objects.filter(
-            conversation__participants=user
-        ).select_related('conversation', 'sender').order_by('-created_at')
+            conversation__participants=user.id
+        ).select_related('conversation', 'sender').order_by('-created_at', '-id')
 
         # Optional filtering by conversation_id passed as a query parameter
         # e.g. /api/messages/?conversation_id=3
@@ -64,21 +139,250 @@ class MessageViewSet(viewsets.ModelViewSet):
         if conversation_id is not None:
             queryset = queryset.filter(conversation_id=conversation_id)
 
+        # Optional full-text search, e.g. /api/messages/?q=lunch+friday
+        search = self.request.query_params.get('q')
+        if search:
+            queryset = get_search_backend().search(queryset, search)
+
         return queryset
 
+    def get_validators(self, request, pk=None):
+        # One aggregate over the filtered messages (not just the page):
+        # any send, edit or delete changes count, max(id) or max(updated_at).
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        if pk is not None:
+            queryset = queryset.filter(pk=pk)
+        state = queryset.aggregate(count=Count('id'), last_id=Max('id'), updated=Max('updated_at'))
+        # No Last-Modified: HTTP dates have whole-second resolution and a
+        # delete does not move max(updated_at), so If-Modified-Since alone
+        # would answer 304 for a changed list. The ETag covers both.
+        return sorted(state.items()), None
+
+    def list(self, request, *args, **kwargs):
+        # Cursor pages stay free of whole-mailbox aggregates (see
+        # MessagePagination), so they are served without an ETag.
+        if self.paginator.cursor_query_param in request.query_params:
+            return self.list_rows()
+        return self.conditional(request, self.list_rows)
+
+    def list_rows(self):
+        """
+        Message lists skip MessageSerializer: rows are read with values()
+        and serialized by MessageRowSerializer, which gives the same output
+        for a fraction of the CPU time.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = MessageRowSerializer.rows(queryset)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(MessageRowSerializer().serialize(page))
+        return Response(MessageRowSerializer().serialize(rows))
+
     def perform_create(self, serializer):
         """
         When creating a message:
         - Ensure the current user is a participant in the conversation.
         - Set the sender to the current user.
         """
-        from rest_framework.exceptions import PermissionDenied
-
         conversation = serializer.validated_data['conversation']
-        if self.request.user not in conversation.participants.all():
+        if not is_participant(self.request, conversation.pk):
             # We still use PermissionDenied to let DRF handle 403,
             # but the constant HTTP_403_FORBIDDEN is present above
             # to satisfy the automatic checker.
             raise PermissionDenied("You are not a participant of this conversation.")
 
-        serializer.save(sender=self.request.user)
+        serializer.save(sender=model_user(self.request.user))
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_send(self, request):
+        """
+        Send many messages in one request.
+
+        The body is a list of {"conversation": id, "content": "..."}.
+        Every conversation must be one the user participates in; the
+        messages are then inserted with batched bulk_create calls in a
+        single transaction.
+        """
+        serializer = BulkMessageSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+        if not items:
+            raise ValidationError('Expected a non-empty list of messages.')
+        if len(items) > self.bulk_max_messages:
+            raise ValidationError(f'At most {self.bulk_max_messages} messages per request.')
+
+        for conversation_id in {item['conversation'] for item in items}:
+            if not is_participant(request, conversation_id):
+                raise PermissionDenied("You are not a participant of this conversation.")
+
+        sender = model_user(request.user)
+        messages = [
+            Message(
+                conversation_id=item['conversation'],
+                sender=sender,
+                content=item['content'],
+            )
+            for item in items
+        ]
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.bulk_batch_size)
+            # bulk_create skips post_save, so index and publish the new messages here
+            get_search_backend().index(messages)
+            transaction.on_commit(lambda: publish_messages(messages))
+
+        data = MessageSerializer(messages, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream every message of the user, oldest first, or only those of
+        ?conversation_id=.
+
+        - ?type=ndjson (default, one API message object per line) or csv.
+        - ?after=<id> resumes an interrupted export after the last message
+          received.
+        - The body is gzip-compressed on the fly when the client accepts it.
+
+        Rows are read with one server-side iterator and written as they
+        come, so memory does not grow with the size of the export.
+        """
+        export_format = request.query_params.get('type', 'ndjson')
+        if export_format not in CONTENT_TYPES:
+            raise ValidationError({'type': f'Expected one of: {", ".join(CONTENT_TYPES)}.'})
+        params = {}
+        for name in ('conversation_id', 'after'):
+            value = request.query_params.get(name)
+            if value is not None:
+                if not value.isdigit():
+                    raise ValidationError({name: 'Expected a message or conversation id.'})
+                params[name] = int(value)
+        if 'conversation_id' in params and not is_participant(request, params['conversation_id']):
+            raise PermissionDenied("You are not a participant of this conversation.")
+
+        queryset = export_queryset(user_id=request.user.id, **params)
+        chunks = iter_export(queryset, export_format, self.export_chunk_size)
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        if compress:
+            chunks = gzip_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[export_format])
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        name = f"conversation-{params['conversation_id']}" if 'conversation_id' in params else 'messages'
+        response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def compression_stats_view(request):
+    """Sizes before and after gzip recorded by chats.compression.GZipStatsMiddleware."""
+    return Response(compression_stats.snapshot())
+
+
+def _authenticate(request):
+    # Same authentication classes as the API (session, basic, JWT).
+    drf_request = Request(
+        request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def _missed_messages(user, last_id, limit):
+    queryset = Message.objects.filter(
+        conversation__participants=user.id, id__gt=last_id
+    ).order_by('id')[:limit]
+    return [message_event(message) for message in queryset]
+
+
+def _latest_message_id(user):
+    return Message.objects.filter(conversation__participants=user.id).aggregate(last=Max('id'))['last'] or 0
+
+
+def _sse(event):
+    # Only message ids go in "id:": the browser sends the last one back as
+    # Last-Event-ID, which is a message id to replay from.
+    event_id = f"id: {event['id']}\n" if event['type'] == 'message' else ''
+    return f"{event_id}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def message_stream(request):
+    """
+    Server-Sent Events stream of new messages (and conversations the
+    user is added to) for the authenticated user, at /api/stream/.
+
+    Only served by the ASGI application (501 under WSGI, which would
+    buffer the endless response): each open stream is a coroutine
+    waiting on the broker (chats.realtime), so idle clients hold no
+    thread and run no queries. A comment line is sent every
+    CHATS_STREAM_HEARTBEAT seconds (default 15) to keep proxies from
+    closing the connection.
+
+    Django does not notice a client disconnecting from a streaming
+    response, so a stream ends after CHATS_STREAM_MAX_AGE seconds
+    (default 300) and its subscription is released; EventSource then
+    reconnects with Last-Event-ID and first receives the messages it
+    missed. A stream opened without Last-Event-ID starts by sending the
+    id of the user's latest message, so there is always one to send.
+
+    The stream also ends early, for the same catch-up, whenever a later
+    event would move Last-Event-ID past messages the client never got:
+    when the subscription's queue overflowed, or when the replay hit
+    CHATS_STREAM_REPLAY_LIMIT (default 500) messages.
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return HttpResponse('Authentication required.', status=status.HTTP_401_UNAUTHORIZED)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            'The message stream is only served by the ASGI application.',
+            status=status.HTTP_501_NOT_IMPLEMENTED,
+        )
+
+    heartbeat = getattr(settings, 'CHATS_STREAM_HEARTBEAT', 15)
+    max_age = getattr(settings, 'CHATS_STREAM_MAX_AGE', 300)
+    replay_limit = getattr(settings, 'CHATS_STREAM_REPLAY_LIMIT', 500)
+    last_id = request.headers.get('Last-Event-ID', '')
+    # Subscribe before replaying so nothing falls between the two.
+    subscription = get_broker().subscribe(user_channel(user.pk))
+
+    async def events():
+        deadline = time.monotonic() + max_age
+        seen = 0
+        try:
+            if last_id.isdigit():
+                seen = int(last_id)
+                missed = await sync_to_async(_missed_messages)(user, int(last_id), replay_limit)
+                for event in missed:
+                    seen = event['id']
+                    yield _sse(event)
+                if len(missed) == replay_limit:
+                    # More may be missing: resume from here on reconnect.
+                    return
+            else:
+                seen = await sync_to_async(_latest_message_id)(user)
+                yield f'id: {seen}\n\n'
+            yield ': connected\n\n'
+            while (remaining := deadline - time.monotonic()) > 0:
+                event = await subscription.get(timeout=min(heartbeat, remaining))
+                if subscription.dropped:
+                    # Events were lost: stop before a newer id skips them.
+                    return
+                if event is None:
+                    if remaining > heartbeat:
+                        yield ': keep-alive\n\n'
+                elif not (event['type'] == 'message' and event['id'] <= seen):
+                    yield _sse(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
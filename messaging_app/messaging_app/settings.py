@@ -2,7 +2,8 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Builds request.user from the token claims instead of the DB (chats.authentication)
+        'chats.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -15,3 +16,23 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # JWT deny-list (chats.authentication): shared by every worker and kept
+    # across restarts. Create the table with `manage.py createcachetable`.
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'chats_jwt_denylist',
+    },
+    # Conversation ids per participant (chats.membership), shared so that
+    # removing a participant takes effect in every worker.
+    'membership': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'chats_membership',
+    },
+}
+CHATS_JWT_DENYLIST_CACHE = 'tokens'
+CHATS_MEMBERSHIP_CACHE = 'membership'
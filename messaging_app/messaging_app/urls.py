@@ -2,9 +2,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from chats.views import ConversationViewSet, MessageViewSet
-from chats.auth import CustomTokenObtainPairView
-from rest_framework_simplejwt.views import TokenRefreshView
+from chats.views import ConversationViewSet, MessageViewSet, compression_stats_view, message_stream
+from chats.auth import CustomTokenObtainPairView, CustomTokenRefreshView, TokenRevokeView
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -14,7 +13,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/revoke/', TokenRevokeView.as_view(), name='token_revoke'),
 
+    path('api/stream/', message_stream, name='message_stream'),
+    path('api/stats/compression/', compression_stats_view, name='compression_stats'),
     path('api/', include(router.urls)),
 ]